@@ -0,0 +1,40 @@
+"""
+Settings for benchmarking (python manage.py benchmark)
+
+The same as settings.py but with a local SQLite database (bench.sqlite3),
+so benchmark data never goes into the real database, and with no real
+emails sent. Use with --settings=ecommerce_project.bench_settings.
+"""
+
+import os
+
+# settings.py reads these from .env - not needed to benchmark
+os.environ.setdefault("EMAIL_HOST_USER", "bench@example.com")
+os.environ.setdefault("EMAIL_HOST_PASSWORD", "")
+
+from .settings import *  # noqa: E402,F401,F403
+from .settings import BASE_DIR  # noqa: E402
+
+# Like production
+DEBUG = False
+ALLOWED_HOSTS = ["testserver", "localhost", "127.0.0.1"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "bench.sqlite3",
+        # Simulated clients write at the same time: take the write lock
+        # when a transaction starts (SQLite can't upgrade a read lock
+        # while others wait) and wait for it instead of failing
+        "OPTIONS": {
+            "timeout": 30,
+            "transaction_mode": "IMMEDIATE",
+            "init_command": "PRAGMA journal_mode=WAL;",
+        },
+    }
+}
+
+EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+
+# The benchmark counts queries itself
+STORE_METRICS_ENABLED = False
@@ -38,15 +38,21 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "rest_framework",
     "store",
 ]
 
 MIDDLEWARE = [
+    # Query and timing numbers (store/metrics.py) - first, so it times
+    # everything; removes itself unless STORE_METRICS_ENABLED
+    "store.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Sets request.role (Vendors/Buyers), cached per user
+    "store.roles.RoleMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -63,6 +69,7 @@ TEMPLATES = [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "store.context_processors.cart_summary",
             ],
         },
     },
@@ -138,3 +145,103 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = config("EMAIL_HOST_USER")
+
+# JSON API (/api/v1/)
+REST_FRAMEWORK = {
+    # Browser sessions, or username/password for mobile clients (HTTPS)
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
+    "DEFAULT_PERMISSION_CLASSES": [
+        "rest_framework.permissions.IsAuthenticatedOrReadOnly",
+    ],
+    "DEFAULT_PAGINATION_CLASS": "store.api.pagination.KeysetPagination",
+}
+
+# Store settings
+
+# Number of products shown per page on the browse page
+STORE_PRODUCTS_PAGE_SIZE = 24
+
+# Number of reviews shown at a time on the product page
+STORE_REVIEWS_PAGE_SIZE = 10
+
+# Number of orders per page in the buyer's order history
+STORE_ORDERS_PAGE_SIZE = 20
+
+# Bulk product import (see store/product_import.py): rows saved per
+# batch, and most rejected rows listed on the import page
+STORE_IMPORT_BATCH_SIZE = 1000
+STORE_IMPORT_ERRORS_SHOWN = 200
+
+# Order lines read per query by the sales export (store/sales_export.py)
+STORE_EXPORT_CHUNK_SIZE = 2000
+
+# Most products a search returns (the best scoring ones), so very short
+# prefixes like "ca" don't page through the whole catalog
+STORE_SEARCH_MAX_RESULTS = 5000
+
+# Email outbox (see store/outbox.py and the send_outbox command)
+STORE_OUTBOX_BATCH_SIZE = 50
+STORE_OUTBOX_MAX_ATTEMPTS = 5
+STORE_OUTBOX_RETRY_BASE_SECONDS = 60
+STORE_OUTBOX_RETRY_MAX_SECONDS = 3600
+
+# Cart storage (see store/cart_stores.py). Use
+# "store.cart_stores.RedisCartStore" to keep carts in Redis instead.
+STORE_CART_BACKEND = "store.cart_stores.DatabaseCartStore"
+STORE_CART_REDIS_URL = config("STORE_CART_REDIS_URL",
+                              default="redis://localhost:6379/0")
+# Carts nobody touched for 30 days are dropped from Redis
+STORE_CART_REDIS_TTL = 60 * 60 * 24 * 30
+
+# Cart stock holds for flash sales (see store/stock_holds.py): adding to
+# the cart sets the units aside for STORE_STOCK_HOLD_SECONDS. Run the
+# expire_stock_holds worker when this is on.
+STORE_STOCK_HOLDS_ENABLED = config("STORE_STOCK_HOLDS_ENABLED",
+                                   default=False, cast=bool)
+STORE_STOCK_HOLD_SECONDS = 60 * 10
+
+# Seconds rendered product fragments and logged-out pages are cached
+# (entries are also replaced as soon as the product changes)
+STORE_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+STORE_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Buyer dashboard (store/buyer_summary.py): seconds a buyer's cached
+# summary is kept (it is updated in place by checkout and reviews), how
+# many products waiting for a review it lists, and how many recently
+# viewed products are remembered, for how long
+STORE_BUYER_SUMMARY_TIMEOUT = 60 * 60 * 24
+STORE_PENDING_REVIEWS_SHOWN = 10
+STORE_RECENTLY_VIEWED = 10
+STORE_RECENTLY_VIEWED_TIMEOUT = 60 * 60 * 24 * 30
+
+# Request metrics (see store/metrics.py): Server-Timing headers, a warning
+# in the "store.metrics" log for views over budget, and totals at
+# /metrics for Prometheus (staff only, or send the token as
+# "Authorization: Bearer <token>")
+STORE_METRICS_ENABLED = config("STORE_METRICS_ENABLED", default=DEBUG,
+                               cast=bool)
+STORE_METRICS_TOKEN = config("STORE_METRICS_TOKEN", default="")
+STORE_METRICS_QUERY_BUDGET = 20
+STORE_METRICS_DB_TIME_BUDGET_MS = 200
+# Budgets for single views, by URL name. Saving products also updates
+# the search index and facet counts; imports do that per batch. Checkout
+# takes each product out of stock and adds it to the daily sales totals.
+STORE_METRICS_QUERY_BUDGETS = {
+    "store:checkout": 40,
+    "store:vendor_product_add": 40,
+    "store:vendor_product_edit": 40,
+    "store:vendor_product_import": 200,
+}
+
+# Cache for small derived values like cart summaries and for rendered
+# HTML (store/page_cache.py). Per process by default; point this at a
+# shared cache (Redis, Memcached) when running more than one server
+# process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
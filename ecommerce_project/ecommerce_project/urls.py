@@ -18,7 +18,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from store.metrics import metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    # JSON API for mobile clients (see store/api)
+    path("api/v1/", include("store.api.urls")),
+    # Prometheus scrape endpoint (see store/metrics.py)
+    path("metrics", metrics, name="metrics"),
     path("", include("store.urls")),
 ]
@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Store, Product, Review, Order, OrderItem
+from .models import (
+    Store, Product, Review, Order, OrderItem, OutboxEmail, CartItem,
+    StoreDailySales, VendorDailySales, ProductDailySales, StockMovement,
+    StockHold,
+)
 
 # Register all your models
 admin.site.register(Store)
@@ -7,3 +11,27 @@ admin.site.register(Product)
 admin.site.register(Review)
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(OutboxEmail)
+admin.site.register(CartItem)
+admin.site.register(StoreDailySales)
+admin.site.register(VendorDailySales)
+admin.site.register(ProductDailySales)
+admin.site.register(StockHold)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """The inventory ledger, read only (stock changes go through
+    store.inventory so the product's stock moves with them)"""
+
+    list_display = ["product", "kind", "quantity", "stock_after",
+                    "created_at"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
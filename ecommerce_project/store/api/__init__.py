@@ -0,0 +1,10 @@
+"""
+JSON API, served under /api/v1/
+
+- products, stores, reviews: read only, for everyone
+- cart, orders: the logged-in buyer's own cart and orders
+
+Every list is paged with keyset cursors (?cursor=, ?page_size=), every
+endpoint takes ?fields=a,b,c to return only some fields, and GET
+responses carry an ETag so clients can send If-None-Match and get a 304.
+"""
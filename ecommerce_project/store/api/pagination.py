@@ -0,0 +1,69 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from ..pagination import InvalidCursor, KeysetPaginator
+
+
+class KeysetPagination(BasePagination):
+    """
+    API paging with store.pagination.KeysetPaginator
+
+    Views give their ordering with get_keyset_ordering(); the last field
+    must be unique (normally "-id").
+
+    Query string:
+        cursor: the page to show (from "next"/"previous")
+        page_size: rows per page, up to max_page_size
+    """
+
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = _("Invalid cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = KeysetPaginator(
+            queryset,
+            ordering=view.get_keyset_ordering(),
+            page_size=self.get_page_size(request),
+        )
+        try:
+            self.page = paginator.page(request.query_params.get("cursor"))
+        except InvalidCursor:
+            raise NotFound(self.invalid_cursor_message)
+        return list(self.page)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get("page_size", self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self._link(self.page.next_cursor),
+            "previous": self._link(self.page.previous_cursor),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), "cursor", cursor
+        )
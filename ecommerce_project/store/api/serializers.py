@@ -0,0 +1,113 @@
+from rest_framework import serializers
+
+from ..models import Order, OrderItem, Product, Review, Store
+
+
+class SparseFieldsMixin:
+    """
+    Let the caller pick which fields to return
+
+    Args:
+        fields: list of field names to keep (None = all). The API views
+        pass ?fields=a,b,c here.
+
+    Raises:
+        ValidationError: if a field name doesn't exist
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            return
+
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": [f"Unknown field: {name}"
+                            for name in sorted(unknown)]}
+            )
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+
+class StoreSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """A store; views annotate product_count and join the owner"""
+
+    owner = serializers.CharField(source="owner.username", read_only=True)
+    product_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Store
+        fields = ["id", "name", "description", "owner", "product_count",
+                  "created_at"]
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """A product with its review totals; views join the store"""
+
+    store_name = serializers.CharField(source="store.name", read_only=True)
+    rating_histogram = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ["id", "sku", "name", "description", "price", "stock",
+                  "store", "store_name", "rating_average", "rating_count",
+                  "rating_histogram", "created_at"]
+
+    def get_rating_histogram(self, product):
+        """{"5": number of 5 star reviews, ..., "1": ...}"""
+        return {str(stars): count
+                for stars, count in product.rating_histogram}
+
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """A review; views join the buyer"""
+
+    buyer = serializers.CharField(source="buyer.username", read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ["id", "product", "buyer", "rating", "content", "verified",
+                  "created_at"]
+
+
+class CartLineSerializer(SparseFieldsMixin, serializers.Serializer):
+    """One line of the cart (a store.cart.CartLine)"""
+
+    product = ProductSerializer(
+        fields=["id", "name", "price", "stock", "store_name"]
+    )
+    quantity = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartItemSerializer(serializers.Serializer):
+    """Input for adding a product to the cart or changing its quantity"""
+
+    product = serializers.PrimaryKeyRelatedField(
+        queryset=Product.objects.all()
+    )
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name",
+                                         read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ["product", "product_name", "quantity", "price"]
+
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """An order; views prefetch its items (with products) as lines"""
+
+    item_count = serializers.SerializerMethodField()
+    items = OrderItemSerializer(source="lines", many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ["id", "order_date", "total_price", "item_count", "items"]
+
+    def get_item_count(self, order):
+        return sum(line.quantity for line in order.lines)
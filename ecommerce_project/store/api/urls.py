@@ -0,0 +1,24 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from . import views
+
+app_name = "api"
+
+router = DefaultRouter()
+router.register("products", views.ProductViewSet, basename="product")
+router.register("stores", views.StoreViewSet, basename="store")
+router.register("reviews", views.ReviewViewSet, basename="review")
+router.register("orders", views.OrderViewSet, basename="order")
+
+urlpatterns = [
+    # The logged-in buyer's cart
+    path("cart/", views.CartView.as_view(), name="cart"),
+    path("cart/items/", views.CartItemView.as_view(), name="cart_items"),
+    path(
+        "cart/items/<int:product_pk>/",
+        views.CartItemView.as_view(),
+        name="cart_item",
+    ),
+    path("", include(router.urls)),
+]
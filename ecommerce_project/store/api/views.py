@@ -0,0 +1,267 @@
+from hashlib import md5
+
+from django.db.models import Count, Prefetch
+from django.http import HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import mixins, status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .. import facets, stock_holds
+from ..cart import Cart
+from ..checkout import CheckoutError, place_order, send_invoice
+from ..models import Order, OrderItem, Product, Review, Store
+from ..roles import BUYER, get_role
+from .serializers import (
+    CartItemSerializer,
+    CartLineSerializer,
+    OrderSerializer,
+    ProductSerializer,
+    ReviewSerializer,
+    StoreSerializer,
+)
+
+
+class IsBuyer(BasePermission):
+    """Only logged-in buyers"""
+
+    message = "Only buyers can do that"
+
+    def has_permission(self, request, view):
+        # request.role comes from the session user; API clients may log in
+        # with Basic auth instead, so look the role up for request.user
+        return get_role(request.user) == BUYER
+
+
+class APIMixin:
+    """
+    What every API view does:
+
+    - ?fields=a,b,c returns only those fields
+    - GET responses get an ETag; a matching If-None-Match gets a 304
+    """
+
+    def get_fields(self):
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        return [name.strip() for name in fields.split(",") if name.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if (request.method not in ("GET", "HEAD")
+                or response.status_code != 200):
+            return response
+
+        response.render()
+        etag = quote_etag(md5(response.content).hexdigest())
+        response["ETag"] = etag
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and (
+            etag in parse_etags(if_none_match) or if_none_match == "*"
+        ):
+            not_modified = HttpResponseNotModified()
+            not_modified["ETag"] = etag
+            return not_modified
+
+        return response
+
+
+# ----- Catalog (read only) -----
+
+
+class ProductViewSet(APIMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Products, with the same filters and sorts as the browse page
+
+    Query string: store, price, stock, rating, sort (see store.facets)
+    """
+
+    serializer_class = ProductSerializer
+
+    def get_queryset(self):
+        products = Product.objects.select_related("store")
+        if self.action != "list":
+            return products
+        self.filters = facets.read_filters(self.request.query_params)
+        products, self.ordering = facets.filter_products(products,
+                                                         self.filters)
+        return products
+
+    def get_keyset_ordering(self):
+        return self.ordering
+
+
+class StoreViewSet(APIMixin, viewsets.ReadOnlyModelViewSet):
+    """Stores with their product counts"""
+
+    serializer_class = StoreSerializer
+    queryset = Store.objects.select_related("owner").annotate(
+        product_count=Count("product")
+    )
+
+    def get_keyset_ordering(self):
+        return ("-created_at", "-id")
+
+
+class ReviewViewSet(APIMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Reviews, newest first
+
+    Query string:
+        product: only this product's reviews
+        rating: only reviews with this many stars
+    """
+
+    serializer_class = ReviewSerializer
+
+    def get_queryset(self):
+        reviews = Review.objects.select_related("buyer")
+        product = self.request.query_params.get("product")
+        rating = self.request.query_params.get("rating")
+        if product:
+            try:
+                product_id = int(product)
+            except ValueError:
+                raise ValidationError({"product": "Must be a product id"})
+            reviews = reviews.filter(product_id=product_id)
+        if rating:
+            if rating not in ("1", "2", "3", "4", "5"):
+                raise ValidationError({"rating": "Must be 1 to 5"})
+            reviews = reviews.filter(rating=rating)
+        return reviews
+
+    def get_keyset_ordering(self):
+        return ("-created_at", "-id")
+
+
+# ----- The buyer's cart and orders -----
+
+
+class CartView(APIMixin, APIView):
+    """
+    GET: the cart - {"lines": [...], "count": items, "total": price}
+    DELETE: empty the cart
+    """
+
+    permission_classes = [IsBuyer]
+
+    def get(self, request):
+        cart = Cart(request.user)
+        lines = cart.lines()
+        summary = cart.summary()
+        return Response({
+            "lines": CartLineSerializer(lines, many=True).data,
+            "count": summary["count"],
+            "total": str(summary["total"]),
+        })
+
+    def delete(self, request):
+        Cart(request.user).clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CartItemView(APIView):
+    """
+    POST /cart/items/: add {"product": id, "quantity": n} to the cart
+    PUT /cart/items/<product id>/: set the quantity to {"quantity": n}
+    DELETE /cart/items/<product id>/: take the product out of the cart
+
+    Like the cart pages, the cart can't hold more than is in stock (less
+    what other buyers are holding, when stock holds are on).
+    """
+
+    permission_classes = [IsBuyer]
+
+    def post(self, request):
+        serializer = CartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product = serializer.validated_data["product"]
+        quantity = serializer.validated_data["quantity"]
+
+        cart = Cart(request.user)
+        self._check_stock(request.user, product,
+                          cart.quantity(product.pk) + quantity)
+        cart.add(product, quantity)
+        return Response({"product": product.pk,
+                         "quantity": cart.quantity(product.pk)},
+                        status=status.HTTP_201_CREATED)
+
+    def put(self, request, product_pk):
+        product = get_object_or_404(Product, pk=product_pk)
+        serializer = CartItemSerializer(
+            data={"product": product.pk, **request.data}
+        )
+        serializer.is_valid(raise_exception=True)
+        quantity = serializer.validated_data["quantity"]
+
+        self._check_stock(request.user, product, quantity)
+        Cart(request.user).set(product, quantity)
+        return Response({"product": product.pk, "quantity": quantity})
+
+    def delete(self, request, product_pk):
+        if not Cart(request.user).remove(product_pk):
+            return Response({"detail": "Product is not in your cart"},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def _check_stock(user, product, quantity):
+        if quantity > product.stock:
+            raise ValidationError(
+                {"quantity": f"Only {product.stock} units available"}
+            )
+        # Set the units aside, if stock holds are on
+        try:
+            stock_holds.hold(user, product, quantity)
+        except stock_holds.HoldError as error:
+            raise ValidationError({"quantity": str(error)})
+
+
+class OrderViewSet(APIMixin, mixins.ListModelMixin,
+                   mixins.RetrieveModelMixin, mixins.CreateModelMixin,
+                   viewsets.GenericViewSet):
+    """
+    The buyer's orders, newest first. POST (no body) checks out the cart.
+    """
+
+    serializer_class = OrderSerializer
+    permission_classes = [IsBuyer]
+
+    def get_queryset(self):
+        # Every order's items and products in one extra query per page
+        return Order.objects.filter(buyer=self.request.user).prefetch_related(
+            Prefetch(
+                "orderitem_set",
+                queryset=OrderItem.objects.select_related("product")
+                .order_by("id"),
+                to_attr="lines",
+            )
+        )
+
+    def get_keyset_ordering(self):
+        return ("-order_date", "-id")
+
+    def create(self, request, *args, **kwargs):
+        cart = Cart(request.user)
+        try:
+            order, items = place_order(request.user, cart.quantities())
+        except CheckoutError as error:
+            raise ValidationError({"cart": str(error)})
+
+        cart.clear()
+        send_invoice(request.user, order, items)
+
+        order.lines = items
+        return Response(self.get_serializer(order).data,
+                        status=status.HTTP_201_CREATED)
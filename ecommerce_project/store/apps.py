@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StoreConfig(AppConfig):
     name = "store"
+
+    def ready(self):
+        # Connect the signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,356 @@
+"""
+Storefront benchmark (see the benchmark management command)
+
+seed() fills the database with stores, products, reviews, buyers and
+orders (with store.seeding). run() then has a number of simulated
+clients (threads, each a logged-in buyer with its own
+django.test.Client) go through the shop:
+
+    browse     product list, with a random sort
+    detail     a random product page
+    cart       add a product to the cart, then view the cart
+    checkout   add a product to the cart and check out
+
+Requests go through the whole Django stack (middleware, views,
+templates, database) but not a web server, so the numbers show what our
+code costs, not the network's.
+
+Each request's time and number of SQL queries is recorded per step. The
+report has p50/p95/p99 latency, queries per request and throughput, and
+compare() checks it against a saved baseline.
+
+Timings are noisy, so a run is made steady before anyone compares it:
+each client first goes through the flows a few times without recording
+(warm-up: connections, caches, compiled templates), and the whole run is
+repeated; the report takes the median of each percentile over the
+repeats. compare() only calls a step slower when it is both a share
+(tolerance) and a number of milliseconds (min_delta_ms) slower.
+"""
+
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from . import facets, seeding
+from .metrics import RequestStats
+from .models import Product
+
+PREFIX = "bench-"
+
+# Data sizes for --scale
+SCALES = {
+    "small": {"stores": 5, "products": 500, "reviews": 2000,
+              "buyers": 20, "orders": 500},
+    "medium": {"stores": 20, "products": 5000, "reviews": 20000,
+               "buyers": 100, "orders": 5000},
+    "large": {"stores": 100, "products": 50000, "reviews": 200000,
+              "buyers": 1000, "orders": 50000},
+}
+
+FLOWS = ("browse", "detail", "cart", "checkout")
+
+# Defaults for run() and compare()
+ITERATIONS = 25
+WARMUP = 3
+REPEATS = 3
+TOLERANCE = 0.2
+MIN_DELTA_MS = 20
+
+# Enough stock that checkouts never run out during a run
+STOCK = 10 ** 6
+
+
+# ----- Data -----
+
+
+def seed(stores, products, reviews, buyers, orders, random_seed=1):
+    """
+    Add benchmark data (usernames start with "bench-", see store.seeding)
+
+    Returns:
+        {table: rows written}
+    """
+    plan = seeding.Plan(stores, products, reviews, buyers, orders,
+                        seed=random_seed, prefix=PREFIX.rstrip("-"),
+                        stock=STOCK)
+    written = seeding.generate(plan)
+    seeding.rebuild()
+    return written
+
+
+# ----- Running -----
+
+
+class Recorder:
+    """Request times and query counts per step, from every client"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def request(self, step, send):
+        """
+        Send one request and record how long it took
+
+        Args:
+            step: name of the step (e.g. "cart_add")
+            send: function that makes the request and returns the response
+        """
+        stats = RequestStats()
+        with connection.execute_wrapper(stats):
+            start = time.perf_counter()
+            response = send()
+            elapsed = time.perf_counter() - start
+
+        with self._lock:
+            if response.status_code >= 400:
+                self.errors[step] += 1
+            else:
+                self.samples[step].append((elapsed, stats.queries))
+        return response
+
+
+def _simulate(client, buyer, product_ids, flows, iterations, recorder,
+              rng, warmup=0):
+    """
+    One simulated client going through the flows: warmup times without
+    recording, then iterations times into recorder
+    """
+    client.force_login(buyer)
+    warming = Recorder()
+
+    def add_to_cart(step, recorder):
+        url = reverse("store:cart_add",
+                      kwargs={"product_pk": rng.choice(product_ids)})
+        recorder.request(step, lambda: client.post(url, {"quantity": 1}))
+
+    for i in range(warmup + iterations):
+        recorder_for_step = warming if i < warmup else recorder
+        for flow in flows:
+            if flow == "browse":
+                url = reverse("store:products_browse")
+                sort = rng.choice(list(facets.SORTS))
+                recorder_for_step.request(
+                    "browse", lambda: client.get(url, {"sort": sort})
+                )
+            elif flow == "detail":
+                url = reverse("store:product_detail",
+                              kwargs={"pk": rng.choice(product_ids)})
+                recorder_for_step.request("detail",
+                                          lambda: client.get(url))
+            elif flow == "cart":
+                add_to_cart("cart_add", recorder_for_step)
+                url = reverse("store:cart_view")
+                recorder_for_step.request("cart_view",
+                                          lambda: client.get(url))
+            elif flow == "checkout":
+                add_to_cart("checkout_cart_add", recorder_for_step)
+                url = reverse("store:checkout")
+                recorder_for_step.request("checkout",
+                                          lambda: client.post(url))
+
+
+def run(flows=FLOWS, clients=4, iterations=ITERATIONS, random_seed=1,
+        warmup=WARMUP, repeats=REPEATS):
+    """
+    Run the benchmark against the seeded data
+
+    Args:
+        flows: which flows each client goes through, in order
+        clients: number of simulated clients running at the same time
+        iterations: recorded times each client goes through all the flows
+        warmup: times each client goes through them first, not recorded
+        repeats: times the whole run is made; the report has the median
+        of each repeat's percentiles
+
+    Returns:
+        the report (see summarize() and combine())
+
+    Raises:
+        ValueError: if there is no benchmark data (run seed() first)
+    """
+    product_ids = list(
+        Product.objects.filter(store__owner__username__startswith=PREFIX)
+        .values_list("pk", flat=True)
+    )
+    buyers = list(User.objects.filter(username__startswith=f"{PREFIX}buyer"))
+    if not product_ids or not buyers:
+        raise ValueError("No benchmark data - seed it first")
+
+    reports = [
+        _run_once(product_ids, buyers, flows, clients, iterations, warmup,
+                  random_seed + repeat * clients)
+        for repeat in range(repeats)
+    ]
+    report = combine(reports)
+    report["clients"] = clients
+    report["iterations"] = iterations
+    report["warmup"] = warmup
+    report["repeats"] = repeats
+    return report
+
+
+def _run_once(product_ids, buyers, flows, clients, iterations, warmup,
+              random_seed):
+    """One repeat of run(): every client once, summarized"""
+    recorder = Recorder()
+
+    def client_thread(number):
+        try:
+            _simulate(
+                Client(raise_request_exception=False),
+                buyers[number % len(buyers)],
+                product_ids,
+                flows,
+                iterations,
+                recorder,
+                random.Random(random_seed + number),
+                warmup,
+            )
+        finally:
+            if clients > 1:
+                connections.close_all()
+
+    start = time.perf_counter()
+    if clients == 1:
+        # No thread: keeps the run inside the caller's transaction (tests)
+        client_thread(0)
+    else:
+        threads = [threading.Thread(target=client_thread, args=(number,))
+                   for number in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    return summarize(recorder, wall_seconds)
+
+
+# ----- Report -----
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers (0 if empty)"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(recorder, wall_seconds):
+    """
+    Returns:
+        {
+            "steps": {step: {"requests", "errors", "p50_ms", "p95_ms",
+                             "p99_ms", "queries_per_request"}},
+            "requests": total, "errors": total, "seconds": wall time,
+            "throughput": requests per second,
+        }
+    """
+    steps = {}
+    for step in sorted(set(recorder.samples) | set(recorder.errors)):
+        samples = recorder.samples[step]
+        times = [elapsed * 1000 for elapsed, queries in samples]
+        queries = [queries for elapsed, queries in samples]
+        steps[step] = {
+            "requests": len(samples),
+            "errors": recorder.errors[step],
+            "p50_ms": round(percentile(times, 50), 2),
+            "p95_ms": round(percentile(times, 95), 2),
+            "p99_ms": round(percentile(times, 99), 2),
+            "queries_per_request": (
+                round(sum(queries) / len(queries), 2) if queries else 0
+            ),
+        }
+
+    requests = sum(step["requests"] for step in steps.values())
+    return {
+        "steps": steps,
+        "requests": requests,
+        "errors": sum(step["errors"] for step in steps.values()),
+        "seconds": round(wall_seconds, 3),
+        "throughput": (round(requests / wall_seconds, 2)
+                       if wall_seconds else 0),
+    }
+
+
+def combine(reports):
+    """
+    Put the repeats of a run together: request and error counts are added
+    up, the percentiles and queries per request are the median over the
+    repeats (one slow repeat doesn't move them)
+
+    Returns:
+        a report like summarize()'s
+    """
+    steps = {}
+    for step in sorted({step for report in reports
+                        for step in report["steps"]}):
+        runs = [report["steps"][step] for report in reports
+                if step in report["steps"]]
+        steps[step] = {
+            "requests": sum(run["requests"] for run in runs),
+            "errors": sum(run["errors"] for run in runs),
+        }
+        for field in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+            steps[step][field] = round(
+                statistics.median(run[field] for run in runs), 2
+            )
+
+    requests = sum(report["requests"] for report in reports)
+    seconds = sum(report["seconds"] for report in reports)
+    return {
+        "steps": steps,
+        "requests": requests,
+        "errors": sum(report["errors"] for report in reports),
+        "seconds": round(seconds, 3),
+        "throughput": round(requests / seconds, 2) if seconds else 0,
+    }
+
+
+def compare(report, baseline, tolerance=TOLERANCE,
+            min_delta_ms=MIN_DELTA_MS):
+    """
+    Find what got worse since the baseline
+
+    Args:
+        report: this run's report
+        baseline: a saved report
+        tolerance: how much slower p95 may get (0.2 = 20%) - timings are
+        noisy; query counts must not go up at all
+        min_delta_ms: p95 must also be this many ms slower, so a fast
+        step going from 2 to 3 ms isn't a regression
+
+    Returns:
+        list of messages, empty if nothing regressed
+    """
+    regressions = []
+    for step, old in baseline["steps"].items():
+        new = report["steps"].get(step)
+        if new is None:
+            continue
+        if new["queries_per_request"] > old["queries_per_request"]:
+            regressions.append(
+                f"{step}: {new['queries_per_request']} queries per request "
+                f"(was {old['queries_per_request']})"
+            )
+        if (new["p95_ms"] > old["p95_ms"] * (1 + tolerance)
+                and new["p95_ms"] - old["p95_ms"] > min_delta_ms):
+            regressions.append(
+                f"{step}: p95 {new['p95_ms']} ms (was {old['p95_ms']} ms)"
+            )
+        if new["errors"] > old["errors"]:
+            regressions.append(
+                f"{step}: {new['errors']} errors (was {old['errors']})"
+            )
+    return regressions
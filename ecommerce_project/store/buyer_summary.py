@@ -0,0 +1,212 @@
+"""
+Buyer dashboard data, kept in the cache
+
+Two cache entries per buyer:
+
+    summary   order count, total spent, latest orders and the products
+              bought but not reviewed yet (the newest
+              STORE_PENDING_REVIEWS_SHOWN, and how many there are).
+              Worked out from the database on a miss. A new order drops
+              it (order_placed, once the checkout commits); the review
+              handlers change it in place (review_added).
+    viewed    the last STORE_RECENTLY_VIEWED products the buyer opened,
+              newest first (a fixed-size ring: the oldest falls off).
+              Also kept when the product page answers 304 Not Modified.
+
+The dashboard reads both with one get_many(), so it normally costs no
+query at all. Product and store names are copied in when they are added,
+so a rename shows up when the summary expires
+(STORE_BUYER_SUMMARY_TIMEOUT) or is rebuilt.
+"""
+
+from decimal import Decimal
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+
+from .models import Order, Product, Review
+from .roles import BUYER
+
+# Orders listed on the dashboard
+RECENT_ORDERS = 5
+
+
+def summary_key(user_id):
+    return f"store:buyer:summary:{user_id}"
+
+
+def viewed_key(user_id):
+    return f"store:buyer:viewed:{user_id}"
+
+
+def _product_entry(product):
+    """What the dashboard shows of a product (store must be loaded)"""
+    return {"id": product.pk, "name": product.name,
+            "store": product.store.name}
+
+
+# ----- Summary -----
+
+
+def build_summary(user):
+    """
+    Work out a buyer's summary from the database (a cache miss)
+
+    Returns:
+        {
+            "orders": number of orders,
+            "spent": Decimal total of every order,
+            "recent_orders": [{"id", "date", "total", "items"}] newest
+            first, up to RECENT_ORDERS,
+            "pending_reviews": [{"id", "name", "store"}] products bought
+            but not reviewed, most recently bought first, up to
+            STORE_PENDING_REVIEWS_SHOWN,
+            "pending_count": how many products are waiting for a review,
+        }
+    """
+    orders = Order.objects.filter(buyer=user)
+    totals = orders.aggregate(count=Count("id"), spent=Sum("total_price"))
+    recent = (
+        orders.annotate(items=Sum("orderitem__quantity"))
+        .order_by("-order_date", "-id")[:RECENT_ORDERS]
+    )
+    pending = (
+        Product.objects.filter(orderitem__order__buyer=user)
+        .exclude(review__buyer=user)
+        .annotate(bought=Max("orderitem__order__order_date"))
+        .select_related("store")
+        .order_by("-bought", "-id")
+    )
+    return {
+        "orders": totals["count"],
+        "spent": totals["spent"] or Decimal("0"),
+        "recent_orders": [
+            {"id": order.pk, "date": order.order_date,
+             "total": order.total_price, "items": order.items or 0}
+            for order in recent
+        ],
+        "pending_reviews": [
+            _product_entry(product)
+            for product in pending[:settings.STORE_PENDING_REVIEWS_SHOWN]
+        ],
+        "pending_count": pending.count(),
+    }
+
+
+def _save(user_id, summary):
+    cache.set(summary_key(user_id), summary,
+              settings.STORE_BUYER_SUMMARY_TIMEOUT)
+
+
+def order_placed(user_id):
+    """
+    Drop the buyer's cached summary after a new order: the next read
+    builds it from the database with the order in it
+
+    Call it once the checkout has committed (transaction.on_commit), so
+    a rolled back order never shows up. Dropping rather than changing it
+    in place means two checkouts at once can't lose each other's update.
+    """
+    forget([user_id])
+
+
+def review_added(user_id, product_id):
+    """Take a product the buyer just reviewed off their pending list"""
+    summary = cache.get(summary_key(user_id))
+    if summary is None:
+        return
+    if summary["pending_count"] > len(summary["pending_reviews"]):
+        # The list is cut short: the product may be past its end, and the
+        # next one waiting would have to move up. Build it again.
+        forget([user_id])
+        return
+    pending = [entry for entry in summary["pending_reviews"]
+               if entry["id"] != product_id]
+    if len(pending) != len(summary["pending_reviews"]):
+        summary["pending_reviews"] = pending
+        summary["pending_count"] = len(pending)
+        _save(user_id, summary)
+
+
+def forget(user_ids):
+    """Drop the cached summaries (rebuilt on the next read)"""
+    cache.delete_many([summary_key(user_id) for user_id in user_ids])
+
+
+# ----- Recently viewed -----
+
+
+def product_viewed(user, product_id, product=None):
+    """
+    Put a product at the front of the buyer's recently viewed list
+
+    Args:
+        user: a logged-in user
+        product_id: the product's id
+        product: the Product with store loaded, if the caller has it.
+        Without it, the name is taken from the list, or looked up (one
+        query) if the product isn't on it.
+    """
+    key = viewed_key(user.pk)
+    viewed = cache.get(key, [])
+    entry = next((entry for entry in viewed if entry["id"] == product_id),
+                 None)
+    if product is not None:
+        entry = _product_entry(product)
+    elif entry is None:
+        product = (Product.objects.select_related("store")
+                   .filter(pk=product_id).first())
+        if product is None:
+            return
+        entry = _product_entry(product)
+
+    viewed = [entry] + [old for old in viewed if old["id"] != product_id]
+    cache.set(key, viewed[:settings.STORE_RECENTLY_VIEWED],
+              settings.STORE_RECENTLY_VIEWED_TIMEOUT)
+
+
+def records_product_view(view):
+    """
+    Keep a product view the page didn't render: product_conditional
+    answers a repeat visit with 304 without running the view, so the view
+    can't record it itself
+
+    The wrapped view takes the product's pk.
+    """
+
+    @wraps(view)
+    def wrapper(request, pk, *args, **kwargs):
+        response = view(request, pk, *args, **kwargs)
+        if response.status_code == 304 and request.role == BUYER:
+            product_viewed(request.user, pk)
+        return response
+
+    return wrapper
+
+
+# ----- Dashboard -----
+
+
+def dashboard(user):
+    """
+    Everything the buyer dashboard shows, with one cache read (plus the
+    summary queries on a miss)
+
+    Returns:
+        the summary (see build_summary()) with "recently_viewed" and
+        "pending_more" (products waiting for a review but not listed)
+        added
+    """
+    keys = (summary_key(user.pk), viewed_key(user.pk))
+    found = cache.get_many(keys)
+
+    summary = found.get(keys[0])
+    if summary is None:
+        summary = build_summary(user)
+        _save(user.pk, summary)
+
+    listed = len(summary["pending_reviews"])
+    return dict(summary, recently_viewed=found.get(keys[1], []),
+                pending_more=summary["pending_count"] - listed)
@@ -0,0 +1,219 @@
+"""
+Shopping cart service
+
+Carts are kept per user in a cart store (see store.cart_stores), so every
+change writes a single cart line and the cart survives logout/login.
+Views use the Cart class instead of talking to the store themselves, so:
+
+- the whole cart is loaded with one query (in_bulk, store joined in)
+- products that were deleted are dropped from the cart
+- a small summary (item count and total) is cached, so the page header
+  can show it without touching the database
+"""
+
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import stock_holds
+from .cart_stores import get_cart_store
+from .models import Product
+
+# Carts from before the cart store existed were kept in the session
+LEGACY_SESSION_KEY = "cart"
+
+# Moved on when a product's price changes or a product is deleted: every
+# cart summary cached under an older version is worked out again
+PRICES_VERSION_KEY = "store:cart-prices-version"
+
+
+def prices_changed():
+    """
+    Make every cached cart summary stale, once the current transaction
+    commits (call it when a price changes or a product is deleted)
+    """
+    transaction.on_commit(_bump_prices_version)
+
+
+def _bump_prices_version():
+    version = f"{time.time():.6f}"
+    cache.set(PRICES_VERSION_KEY, version, None)
+    return version
+
+
+class CartLine:
+    """
+    One product in the cart
+
+    Fields:
+        product: the Product (with store loaded)
+        quantity: how many the buyer wants
+        subtotal: price x quantity
+    """
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.subtotal = product.price * quantity
+
+
+class Cart:
+    """
+    A user's shopping cart
+
+    Args:
+        user: the cart owner (must be logged in)
+    """
+
+    def __init__(self, user):
+        self.owner = user.pk
+        self.store = get_cart_store()
+        self._quantities = None
+
+    @classmethod
+    def summary_key(cls, owner):
+        return f"store:cart-summary:{owner}"
+
+    def __len__(self):
+        """Number of different products in the cart"""
+        return len(self.quantities())
+
+    def __bool__(self):
+        return bool(self.quantities())
+
+    def quantities(self):
+        """Return {product id: quantity} (read from the store once)"""
+        if self._quantities is None:
+            self._quantities = self.store.get(self.owner)
+        return self._quantities
+
+    def quantity(self, product_id):
+        """How many of a product are in the cart (0 if none)"""
+        return self.quantities().get(int(product_id), 0)
+
+    # ----- Changing the cart -----
+    # These don't check stock or hold it (store.stock_holds) - the views
+    # do that, so they can show the right message. Removing products does
+    # release their holds.
+
+    def add(self, product, quantity=1):
+        """Add quantity of a product, on top of what's already there"""
+        self.store.add(self.owner, product.pk, quantity)
+        self._changed()
+
+    def set(self, product, quantity):
+        """Set the quantity of a product"""
+        self.store.update(self.owner, product.pk, quantity)
+        self._changed()
+
+    def remove(self, product_id):
+        """
+        Take a product out of the cart
+
+        Returns:
+            True if it was in the cart
+        """
+        removed = self.store.remove(self.owner, int(product_id))
+        stock_holds.release(self.owner, [int(product_id)])
+        self._changed()
+        return removed
+
+    def clear(self):
+        """Empty the cart"""
+        self.store.clear(self.owner)
+        stock_holds.release(self.owner)
+        self._changed()
+
+    # ----- Reading the cart -----
+
+    def lines(self):
+        """
+        Load every product in the cart with one query
+
+        Products that no longer exist are removed from the cart.
+
+        Returns:
+            list of CartLine, in the order they were added
+        """
+        quantities = self.quantities()
+        products = Product.objects.select_related("store").in_bulk(
+            list(quantities)
+        )
+
+        lines = []
+        for product_id, quantity in quantities.items():
+            if product_id in products:
+                lines.append(CartLine(products[product_id], quantity))
+            else:
+                # Product was deleted, remove from cart
+                self.store.remove(self.owner, product_id)
+
+        if len(lines) != len(quantities):
+            self._changed()
+
+        return lines
+
+    def summary(self):
+        """
+        Item count and total for the page header
+
+        Comes from the cache; only worked out again (one small query)
+        after the cart changes or prices change (prices_changed()).
+
+        Returns:
+            {"count": int, "total": Decimal}
+        """
+        key = self.summary_key(self.owner)
+        found = cache.get_many([key, PRICES_VERSION_KEY])
+        prices_version = found.get(PRICES_VERSION_KEY)
+        if prices_version is None:
+            # Lost from the cache: start a new one, so no old summary
+            # is taken as current
+            prices_version = _bump_prices_version()
+
+        cached = found.get(key)
+        summary = None
+        if cached is not None and cached[0] == prices_version:
+            summary = cached[1]
+
+        if summary is None:
+            quantities = self.quantities()
+            prices = {}
+            if quantities:
+                prices = dict(
+                    Product.objects.filter(pk__in=list(quantities))
+                    .values_list("pk", "price")
+                )
+            count, total = 0, Decimal("0")
+            for product_id, quantity in quantities.items():
+                if product_id in prices:
+                    count += quantity
+                    total += prices[product_id] * quantity
+            summary = {"count": count, "total": total}
+            cache.set(key, (prices_version, summary))
+
+        return summary
+
+    # ----- Helpers -----
+
+    def _changed(self):
+        """Forget what we read so far - the cart is different now"""
+        self._quantities = None
+        cache.delete(self.summary_key(self.owner))
+
+
+def merge_session_cart(request, user):
+    """
+    Move a cart left in the session (e.g. from before the cart store) into
+    the user's stored cart
+    """
+    session_cart = request.session.pop(LEGACY_SESSION_KEY, None)
+    if not session_cart:
+        return
+
+    cart = Cart(user)
+    for product_id, quantity in session_cart.items():
+        cart.store.add(cart.owner, int(product_id), int(quantity))
+    cart._changed()
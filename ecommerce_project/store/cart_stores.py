@@ -0,0 +1,236 @@
+"""
+Cart storage backends
+
+A cart store keeps one cart per owner (the user id) as
+{product id: quantity}. Every change touches a single cart line, so adding
+one product never rewrites the whole cart the way a session cart does, and
+the cart follows the user across logins and devices.
+
+Pick a backend with the STORE_CART_BACKEND setting:
+
+- store.cart_stores.DatabaseCartStore - one CartItem row per line
+- store.cart_stores.RedisCartStore - one Redis hash per cart, plus a
+  sorted set keeping the lines in the order they were added (needs the
+  redis package and STORE_CART_REDIS_URL)
+- store.cart_stores.LocMemCartStore - in process memory, for tests
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import CartItem
+
+
+class BaseCartStore:
+    """
+    The cart store API. Owners are user ids, products are product ids.
+    """
+
+    def get(self, owner):
+        """Return the cart as {product id: quantity}, oldest line first"""
+        raise NotImplementedError
+
+    def add(self, owner, product_id, quantity):
+        """Add quantity on top of what is already in the cart"""
+        raise NotImplementedError
+
+    def update(self, owner, product_id, quantity):
+        """Set the quantity of a product"""
+        raise NotImplementedError
+
+    def remove(self, owner, product_id):
+        """Remove a product; return True if it was in the cart"""
+        raise NotImplementedError
+
+    def clear(self, owner):
+        """Empty the cart"""
+        raise NotImplementedError
+
+    def merge(self, source_owner, target_owner):
+        """
+        Move every line of one cart into another, adding quantities
+        together, then empty the source cart
+        """
+        for product_id, quantity in self.get(source_owner).items():
+            self.add(target_owner, product_id, quantity)
+        self.clear(source_owner)
+
+
+class LocMemCartStore(BaseCartStore):
+    """Carts in a dict in this process - for tests and development"""
+
+    def __init__(self):
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner):
+        with self._lock:
+            return dict(self._carts.get(owner, {}))
+
+    def add(self, owner, product_id, quantity):
+        with self._lock:
+            cart = self._carts.setdefault(owner, {})
+            cart[int(product_id)] = cart.get(int(product_id), 0) + quantity
+
+    def update(self, owner, product_id, quantity):
+        with self._lock:
+            self._carts.setdefault(owner, {})[int(product_id)] = quantity
+
+    def remove(self, owner, product_id):
+        with self._lock:
+            cart = self._carts.get(owner, {})
+            return cart.pop(int(product_id), None) is not None
+
+    def clear(self, owner):
+        with self._lock:
+            self._carts.pop(owner, None)
+
+
+class DatabaseCartStore(BaseCartStore):
+    """Carts in the CartItem table, one row per cart line"""
+
+    def get(self, owner):
+        return dict(
+            CartItem.objects.filter(user_id=owner)
+            .order_by("added_at", "id")
+            .values_list("product_id", "quantity")
+        )
+
+    def add(self, owner, product_id, quantity):
+        # quantity = quantity + n is done by the database, so two tabs
+        # adding at the same time both count
+        updated = CartItem.objects.filter(
+            user_id=owner, product_id=product_id
+        ).update(quantity=F("quantity") + quantity)
+
+        if not updated:
+            self._create_or(owner, product_id, quantity,
+                            F("quantity") + quantity)
+
+    def update(self, owner, product_id, quantity):
+        updated = CartItem.objects.filter(
+            user_id=owner, product_id=product_id
+        ).update(quantity=quantity)
+
+        if not updated:
+            self._create_or(owner, product_id, quantity, quantity)
+
+    def remove(self, owner, product_id):
+        deleted, details = CartItem.objects.filter(
+            user_id=owner, product_id=product_id
+        ).delete()
+        return deleted > 0
+
+    def clear(self, owner):
+        CartItem.objects.filter(user_id=owner).delete()
+
+    @staticmethod
+    def _create_or(owner, product_id, quantity, new_quantity):
+        """
+        Insert a new line; if another request just did, set its quantity
+        to new_quantity instead
+        """
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(
+                    user_id=owner, product_id=product_id, quantity=quantity
+                )
+        except IntegrityError:
+            CartItem.objects.filter(
+                user_id=owner, product_id=product_id
+            ).update(quantity=new_quantity)
+
+
+class RedisCartStore(BaseCartStore):
+    """
+    Carts in Redis (or anything speaking the Redis protocol), one hash per
+    cart: HINCRBY / HSET / HDEL are O(1) per line
+
+    A hash doesn't keep its fields in order, so each cart also has a
+    sorted set of its product ids scored by when they were first added
+    (ZADD NX keeps the first time). get() returns the lines in that order.
+
+    Settings:
+        STORE_CART_REDIS_URL: e.g. redis://localhost:6379/0
+        STORE_CART_REDIS_TTL: seconds an untouched cart is kept
+    """
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured(
+                "RedisCartStore needs the redis package: pip install redis"
+            )
+        self.client = redis.Redis.from_url(settings.STORE_CART_REDIS_URL)
+        self.ttl = settings.STORE_CART_REDIS_TTL
+
+    def _key(self, owner):
+        return f"store:cart:{owner}"
+
+    def _order_key(self, owner):
+        return f"store:cart-order:{owner}"
+
+    def get(self, owner):
+        with self.client.pipeline() as pipe:
+            pipe.hgetall(self._key(owner))
+            pipe.zrange(self._order_key(owner), 0, -1)
+            lines, order = pipe.execute()
+
+        quantities = {int(product_id): int(quantity)
+                      for product_id, quantity in lines.items()}
+        # Lines missing from the order (carts from before it was kept)
+        # go last
+        ordered = [int(product_id) for product_id in order
+                   if int(product_id) in quantities]
+        ordered += sorted(set(quantities) - set(ordered))
+        return {product_id: quantities[product_id] for product_id in ordered}
+
+    def _note_line(self, pipe, owner, product_id):
+        """
+        Queue noting when a line was first added, and keeping the cart
+        for another STORE_CART_REDIS_TTL
+        """
+        pipe.zadd(self._order_key(owner), {product_id: time.time()},
+                  nx=True)
+        pipe.expire(self._key(owner), self.ttl)
+        pipe.expire(self._order_key(owner), self.ttl)
+
+    def add(self, owner, product_id, quantity):
+        with self.client.pipeline() as pipe:
+            pipe.hincrby(self._key(owner), product_id, quantity)
+            self._note_line(pipe, owner, product_id)
+            pipe.execute()
+
+    def update(self, owner, product_id, quantity):
+        with self.client.pipeline() as pipe:
+            pipe.hset(self._key(owner), product_id, quantity)
+            self._note_line(pipe, owner, product_id)
+            pipe.execute()
+
+    def remove(self, owner, product_id):
+        with self.client.pipeline() as pipe:
+            pipe.hdel(self._key(owner), product_id)
+            pipe.zrem(self._order_key(owner), product_id)
+            removed, unordered = pipe.execute()
+        return removed > 0
+
+    def clear(self, owner):
+        self.client.delete(self._key(owner), self._order_key(owner))
+
+
+_cart_stores = {}
+
+
+def get_cart_store():
+    """Return the cart store chosen by STORE_CART_BACKEND (made once)"""
+    path = settings.STORE_CART_BACKEND
+    if path not in _cart_stores:
+        _cart_stores[path] = import_string(path)()
+    return _cart_stores[path]
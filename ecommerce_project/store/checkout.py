@@ -0,0 +1,187 @@
+"""
+Placing orders
+
+place_order() turns a cart into an Order in one database transaction:
+either the order, its items and every stock decrement are saved together,
+or nothing is.
+"""
+
+from django.db import transaction
+from django.db.models import F
+
+from . import buyer_summary, facets, inventory, sales_rollups, stock_holds
+from .outbox import enqueue_email
+from .models import Order, OrderItem, Product, Store
+
+
+class CheckoutError(Exception):
+    """Raised when an order can't be placed (message is safe to show)"""
+
+
+def place_order(user, cart):
+    """
+    Create an order from a cart and take the products out of stock
+
+    All cart products are locked with one SELECT ... FOR UPDATE, in primary
+    key order so two checkouts sharing products always lock them in the
+    same order and can't deadlock. Stock is then decremented with
+    "stock = stock - n WHERE stock >= n", so even a database without row
+    locks (SQLite) can never oversell.
+
+    Args:
+        user: the buyer
+        cart: dict of {product id: quantity}
+
+    Returns:
+        (order, items) - the new Order and its OrderItems, each with
+        product and product.store loaded
+
+    Raises:
+        CheckoutError: if the cart is empty, a product no longer exists or
+        there is not enough stock. Nothing is saved in that case.
+    """
+    quantities = {int(product_id): int(quantity)
+                  for product_id, quantity in cart.items()}
+
+    if not quantities:
+        raise CheckoutError("Your cart is empty")
+    if any(quantity < 1 for quantity in quantities.values()):
+        raise CheckoutError("Cart quantities must be at least 1")
+
+    with transaction.atomic():
+        # Lock every product in the cart with a single query
+        products = {
+            product.pk: product
+            for product in Product.objects.select_for_update()
+            .filter(pk__in=quantities)
+            .order_by("pk")
+        }
+
+        if len(products) != len(quantities):
+            raise CheckoutError("Some products in your cart no longer exist")
+
+        # Check stock and add up the total. Units other buyers are
+        # holding in their carts (stock holds, if on) aren't for sale.
+        available = stock_holds.available(products.values(), user)
+        total_price = 0
+        for product_id, quantity in sorted(quantities.items()):
+            product = products[product_id]
+            if quantity > available[product_id]:
+                raise CheckoutError(
+                    f"Not enough stock for {product.name}. "
+                    f"Only {available[product_id]} available"
+                )
+            total_price += product.price * quantity
+
+        order = Order.objects.create(buyer=user, total_price=total_price)
+
+        # Take the products out of stock. The stock__gte condition is the
+        # safety net: if another checkout got there first, 0 rows change
+        # and the whole order is rolled back.
+        for product_id, quantity in sorted(quantities.items()):
+            updated = Product.objects.filter(
+                pk=product_id, stock__gte=quantity
+            ).touch_update(stock=F("stock") - quantity)
+
+            if not updated:
+                raise CheckoutError(
+                    f"Not enough stock for {products[product_id].name}"
+                )
+
+            # update() skips the save signals, so move products that just
+            # sold out to the "out of stock" facet here
+            products[product_id].stock -= quantity
+            if products[product_id].stock == 0:
+                facets.adjust({("stock", "in")}, {("stock", "out")})
+
+        # Save all order items with one INSERT, price fixed at time of sale
+        items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=products[product_id],
+                quantity=quantity,
+                price=products[product_id].price,
+            )
+            for product_id, quantity in sorted(quantities.items())
+        ])
+
+        # One "sale" movement per product in the inventory ledger
+        inventory.record_sales(order, items, products)
+
+        # The buyer's held units are sold now
+        stock_holds.release(user.pk, quantities)
+
+        # Add the sale to the vendor dashboard's daily totals
+        sales_rollups.record_order(order, items)
+
+    # Stores are only needed for the invoice - load them in one query
+    # (outside the lock so vendors editing a store are never blocked)
+    stores = Store.objects.in_bulk({p.store_id for p in products.values()})
+    for product in products.values():
+        product.store = stores[product.store_id]
+
+    # The buyer's cached dashboard summary is out of date - drop it once
+    # the order is committed (a caller's outer transaction may still roll
+    # it back)
+    transaction.on_commit(lambda: buyer_summary.order_placed(user.pk))
+
+    return order, items
+
+
+def send_invoice(user, order, items):
+    """
+    Queue the order confirmation email for the buyer
+
+    Args:
+        user: the buyer
+        order: the new Order
+        items: its OrderItems, with product and product.store loaded
+    """
+    # Build invoice email
+    subject = f"Order Confirmation - Order #{order.id}"
+
+    body = f"""
+    Dear {user.username},
+
+    Thank you for your order! Your order has been confirmed.
+
+    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    ORDER DETAILS
+    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+    Order Number: #{order.id}
+    Order Date: {order.order_date.strftime('%B %d, %Y at %H:%M')}
+
+    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    ITEMS ORDERED
+    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+    """
+
+    # Add each item
+    for item in items:
+        body += f"""
+    Product: {item.product.name}
+    Store: {item.product.store.name}
+    Quantity: {item.quantity}
+    Price: R{item.price} each
+    Subtotal: R{item.price * item.quantity}
+    ─────────────────────────────────────────
+    """
+
+    body += f"""
+    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    TOTAL: R{order.total_price}
+    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+    Thank you for shopping with us!
+
+    If you have any questions about your order, please contact us.
+
+    Best regards,
+    The eCommerce Team
+    """
+
+    # Queue the email - the send_outbox worker sends it, so a slow mail
+    # server never holds up the checkout
+    enqueue_email(subject, body, [user.email])
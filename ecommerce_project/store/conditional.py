@@ -0,0 +1,173 @@
+"""
+HTTP conditional requests (ETag / Last-Modified) for catalog pages
+
+Browsers and CDNs that already have a page send If-None-Match /
+If-Modified-Since; if nothing changed we answer 304 without running the
+view. Working out the validators is cheap:
+
+- product page: one primary key lookup of the product's version and
+  updated_at
+- browse page: the catalog version, kept in the cache and moved on
+  whenever any product, store or review changes (no query at all)
+
+Pages also show who is logged in and their cart, so the ETag includes the
+user, their role, cart summary and CSRF cookie. When a flash message is
+waiting to be shown, no validators are given and the page is always
+rendered.
+"""
+
+from datetime import timezone as dt_timezone
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .cart import Cart
+from .models import Product
+from .roles import BUYER
+
+CATALOG_VERSION_KEY = "store:catalog-version"
+
+
+# ----- Catalog version -----
+
+
+def catalog_version():
+    """
+    Return (version, modified) for the whole catalog
+
+    If the cache lost it, a new version is started, so pages are rendered
+    again rather than wrongly reported unchanged.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = bump_catalog_version()
+    return version
+
+
+def catalog_changed():
+    """
+    Record that something in the catalog changed, once the current
+    transaction commits (so nobody can render the old data under the new
+    version)
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+def bump_catalog_version():
+    """Start a new catalog version now"""
+    now = timezone.now()
+    version = (f"{now.timestamp():.6f}", now)
+    cache.set(CATALOG_VERSION_KEY, version, None)
+    return version
+
+
+# ----- Validators -----
+
+
+def _viewer(request):
+    """What about the visitor shows on every page"""
+    if getattr(request, "_viewer", None) is None:
+        parts = [str(request.user.pk), str(request.role)]
+        if request.role == BUYER:
+            # Cart summary in the header (cached - no query when warm)
+            summary = Cart(request.user).summary()
+            parts += [str(summary["count"]), str(summary["total"])]
+        # Forms carry a CSRF token made from this cookie
+        parts.append(request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""))
+        request._viewer = md5("|".join(parts).encode()).hexdigest()[:16]
+    return request._viewer
+
+
+def _has_messages(request):
+    """True if a flash message is waiting (the page must show it)"""
+    return len(messages.get_messages(request)) > 0
+
+
+def _etag(*parts):
+    return md5("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def product_validator(request, pk):
+    """(version, updated_at) of a product - looked up once per request"""
+    if not hasattr(request, "_product_validator"):
+        request._product_validator = (
+            Product.objects.filter(pk=pk)
+            .values_list("version", "updated_at")
+            .first()
+        )
+    return request._product_validator
+
+
+def browse_etag(request, *args, **kwargs):
+    if _has_messages(request):
+        return None
+    version, modified = catalog_version()
+    return _etag("browse", version, request.GET.urlencode(),
+                 _viewer(request))
+
+
+def browse_last_modified(request, *args, **kwargs):
+    if _has_messages(request):
+        return None
+    # Only logged-out pages are the same for everyone
+    if request.user.is_authenticated:
+        return None
+    version, modified = catalog_version()
+    return modified
+
+
+def product_etag(request, pk, *args, **kwargs):
+    if _has_messages(request):
+        return None
+    found = product_validator(request, pk)
+    if found is None:
+        return None
+    version, updated_at = found
+    return _etag("product", pk, version, updated_at.timestamp(),
+                 request.GET.urlencode(), _viewer(request))
+
+
+def product_last_modified(request, pk, *args, **kwargs):
+    if _has_messages(request) or request.user.is_authenticated:
+        return None
+    found = product_validator(request, pk)
+    if found is None:
+        return None
+    return found[1].astimezone(dt_timezone.utc)
+
+
+# ----- Decorator -----
+
+
+def conditional_page(etag_func, last_modified_func):
+    """
+    Answer conditional GETs with 304 when the validators match, and tell
+    caches to check back every time (private when logged in)
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = condition(etag_func, last_modified_func)(view)(
+                request, *args, **kwargs
+            )
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, public=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+browse_conditional = conditional_page(browse_etag, browse_last_modified)
+product_conditional = conditional_page(product_etag, product_last_modified)
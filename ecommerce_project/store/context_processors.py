@@ -0,0 +1,14 @@
+from .cart import Cart
+from .roles import BUYER
+
+
+def cart_summary(request):
+    """
+    Add the cart item count and total to every template
+
+    Read from the cache, so it costs no database query on normal pages.
+    """
+    # Only buyers have a cart link in the header
+    if getattr(request, "role", None) != BUYER:
+        return {}
+    return {"cart_summary": Cart(request.user).summary()}
@@ -0,0 +1,61 @@
+"""
+View decorators for role checks
+
+Both use request.role (set by store.roles.RoleMiddleware), so the check
+costs no database query once the role is cached. Users who are not logged
+in are sent to the login page first.
+
+Usage:
+    @vendor_required
+    def view(request): ...
+
+    @buyer_required("Only buyers can checkout")
+    def checkout(request): ...
+"""
+
+from functools import wraps
+
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect
+
+from .roles import BUYER, VENDOR
+
+
+def role_required(role, message):
+    """
+    Make a decorator that only lets users with role through; everyone
+    else gets message and is sent to the home page
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.role != role:
+                messages.error(request, message)
+                return redirect("store:home")
+            return view(request, *args, **kwargs)
+
+        return login_required(wrapper, login_url="store:login")
+
+    return decorator
+
+
+def _role_decorator(role, default_message, message_or_view):
+    # Used bare (@vendor_required) or with a message
+    # (@vendor_required("..."))
+    if callable(message_or_view):
+        return role_required(role, default_message)(message_or_view)
+    return role_required(role, message_or_view or default_message)
+
+
+def vendor_required(message_or_view=None):
+    """Only let vendors use the view"""
+    return _role_decorator(VENDOR, "Only vendors can do that",
+                           message_or_view)
+
+
+def buyer_required(message_or_view=None):
+    """Only let buyers use the view"""
+    return _role_decorator(BUYER, "Only buyers can do that",
+                           message_or_view)
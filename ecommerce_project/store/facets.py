@@ -0,0 +1,325 @@
+"""
+Browse page filters, sorts and facet counts
+
+Facet counts ("In stock (1 204)") come from the FacetCount table instead of
+a GROUP BY over every product on each page view. The table is adjusted by
++1/-1 from the signal handlers in store.signals whenever a product or a
+review changes, and can be rebuilt with: python manage.py rebuild_facets
+"""
+
+from decimal import Decimal
+
+from django.db.models import Count, F
+from django.db import transaction
+
+from .models import FacetCount, Product, Store
+
+# (key, label, lowest price, price limit - not included, None = no limit)
+PRICE_BUCKETS = [
+    ("0-100", "Under R100", Decimal("0"), Decimal("100")),
+    ("100-500", "R100 - R500", Decimal("100"), Decimal("500")),
+    ("500-1000", "R500 - R1000", Decimal("500"), Decimal("1000")),
+    ("1000+", "R1000 and up", Decimal("1000"), None),
+]
+
+STOCK_OPTIONS = [
+    ("in", "In stock"),
+    ("out", "Out of stock"),
+]
+
+# "N stars & up" - minimum average rating
+RATING_OPTIONS = [4, 3, 2, 1]
+
+# Sort key -> (label, keyset ordering)
+SORTS = {
+    "newest": ("Newest", ("-created_at", "-id")),
+    "price_asc": ("Price: low to high", ("price", "id")),
+    "price_desc": ("Price: high to low", ("-price", "-id")),
+    "rating": ("Top rated", ("-rating_average", "-id")),
+}
+DEFAULT_SORT = "newest"
+
+# Most stores listed in the store filter (biggest stores first)
+STORE_FACET_LIMIT = 20
+
+
+# ----- Working out which facet values a product has -----
+
+
+def price_bucket(price):
+    """Return the PRICE_BUCKETS key a price falls in"""
+    price = Decimal(str(price))
+    for key, label, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return PRICE_BUCKETS[0][0]
+
+
+def product_keys(store_id, price, stock):
+    """
+    Facet values of a product that come from its own fields
+
+    Returns:
+        set of (facet, value) tuples
+    """
+    return {
+        ("store", str(store_id)),
+        ("price", price_bucket(price)),
+        ("stock", "in" if stock > 0 else "out"),
+    }
+
+
+def rating_key(average, count):
+    """
+    Rating facet value of a product (average rounded down), None if the
+    product has no reviews
+    """
+    if not count:
+        return None
+    return ("rating", str(int(average)))
+
+
+# ----- Keeping the counts up to date -----
+
+
+def adjust(removed, added):
+    """
+    Move products between facet values
+
+    Args:
+        removed: (facet, value) keys the product no longer has
+        added: (facet, value) keys the product now has
+    """
+    changes = {}
+    for key in removed:
+        if key is not None:
+            changes[key] = changes.get(key, 0) - 1
+    for key in added:
+        if key is not None:
+            changes[key] = changes.get(key, 0) + 1
+
+    for (facet, value), delta in changes.items():
+        if delta == 0:
+            continue
+
+        # F() makes the database do the maths, so two requests changing
+        # the same count at once can't overwrite each other
+        updated = FacetCount.objects.filter(facet=facet, value=value).update(
+            count=F("count") + delta
+        )
+        if not updated:
+            FacetCount.objects.get_or_create(facet=facet, value=value)
+            FacetCount.objects.filter(facet=facet, value=value).update(
+                count=F("count") + delta
+            )
+
+
+def rebuild():
+    """
+    Recount every facet from scratch (the only place that GROUPs BY
+    over the whole product table)
+
+    Returns:
+        number of facet rows written
+    """
+    counts = {}
+
+    # Store and stock counts
+    for store_id, count in (
+        Product.objects.values_list("store_id")
+        .annotate(count=Count("id"))
+        .order_by()
+    ):
+        counts[("store", str(store_id))] = count
+
+    counts[("stock", "in")] = Product.objects.filter(stock__gt=0).count()
+    counts[("stock", "out")] = Product.objects.filter(stock=0).count()
+
+    # Price bucket counts
+    for key, label, low, high in PRICE_BUCKETS:
+        products = Product.objects.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+        counts[("price", key)] = products.count()
+
+    # Rating counts (products with at least one review), from the rating
+    # totals kept on each product
+    averages = (
+        Product.objects.filter(rating_count__gt=0)
+        .order_by()
+        .values_list("rating_average", "rating_count")
+    )
+    for average, count in averages.iterator(chunk_size=2000):
+        key = rating_key(average, count)
+        counts[key] = counts.get(key, 0) + 1
+
+    rows = [
+        FacetCount(facet=facet, value=value, count=count)
+        for (facet, value), count in counts.items()
+    ]
+
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(rows, batch_size=1000)
+
+    return len(rows)
+
+
+# ----- Browse page helpers -----
+
+
+def _parse_int(value):
+    """An int from the query string, or None if it isn't one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_filters(params):
+    """
+    Read the filters and sort from the query string, ignoring bad values
+
+    Returns:
+        dict with store (int), price (bucket key), stock ("in"/"out"),
+        rating (int) and sort (SORTS key); missing filters are None
+    """
+    store = _parse_int(params.get("store"))
+    price = params.get("price")
+    stock = params.get("stock")
+    rating = _parse_int(params.get("rating"))
+    sort = params.get("sort")
+
+    bucket_keys = [key for key, label, low, high in PRICE_BUCKETS]
+    stock_keys = [key for key, label in STOCK_OPTIONS]
+
+    return {
+        "store": store if store is not None and store > 0 else None,
+        "price": price if price in bucket_keys else None,
+        "stock": stock if stock in stock_keys else None,
+        "rating": rating if rating in RATING_OPTIONS else None,
+        "sort": sort if sort in SORTS else DEFAULT_SORT,
+    }
+
+
+def filter_products(queryset, filters):
+    """
+    Apply the browse page filters to a Product queryset
+
+    Returns:
+        (queryset, keyset ordering) tuple
+    """
+    if filters["store"] is not None:
+        queryset = queryset.filter(store_id=filters["store"])
+
+    if filters["price"] is not None:
+        for key, label, low, high in PRICE_BUCKETS:
+            if key == filters["price"]:
+                queryset = queryset.filter(price__gte=low)
+                if high is not None:
+                    queryset = queryset.filter(price__lt=high)
+
+    if filters["stock"] == "in":
+        queryset = queryset.filter(stock__gt=0)
+    elif filters["stock"] == "out":
+        queryset = queryset.filter(stock=0)
+
+    # Products without reviews have rating_average 0, so never match
+    if filters["rating"] is not None:
+        queryset = queryset.filter(rating_average__gte=filters["rating"])
+
+    label, ordering = SORTS[filters["sort"]]
+    return queryset, ordering
+
+
+def _toggle_url(params, name, value):
+    """Query string that turns a filter option on, or off if already on"""
+    params = params.copy()
+    params.pop("cursor", None)
+    if params.get(name) == str(value):
+        params.pop(name, None)
+    else:
+        params[name] = str(value)
+    return "?" + params.urlencode()
+
+
+def facet_groups(params, filters):
+    """
+    Filter options with their counts, ready for the template
+
+    Costs three small queries: the biggest store counts, the other
+    counts, and the names of the listed stores.
+
+    Returns:
+        list of {"title", "options": [{"label", "count", "url", "active"}]}
+    """
+    store_counts = list(
+        FacetCount.objects.filter(facet="store", count__gt=0)
+        .order_by("-count")
+        .values_list("value", "count")[:STORE_FACET_LIMIT]
+    )
+    counts = {
+        (facet, value): count
+        for facet, value, count in FacetCount.objects.exclude(
+            facet="store"
+        ).values_list("facet", "value", "count")
+    }
+    store_names = Store.objects.in_bulk(
+        [int(value) for value, count in store_counts]
+    )
+
+    def option(name, value, label, count):
+        return {
+            "label": label,
+            "count": count,
+            "url": _toggle_url(params, name, value),
+            "active": filters[name] is not None
+            and str(filters[name]) == str(value),
+        }
+
+    stores = [
+        option("store", value, store_names[int(value)].name, count)
+        for value, count in store_counts
+        if int(value) in store_names
+    ]
+    prices = [
+        option("price", key, label, counts.get(("price", key), 0))
+        for key, label, low, high in PRICE_BUCKETS
+    ]
+    stock = [
+        option("stock", key, label, counts.get(("stock", key), 0))
+        for key, label in STOCK_OPTIONS
+    ]
+    # Rating buckets hold "average rounded down", so "N & up" adds up
+    # the buckets from N to 5
+    ratings = [
+        option(
+            "rating",
+            stars,
+            f"{stars} stars & up",
+            sum(counts.get(("rating", str(n)), 0) for n in range(stars, 6)),
+        )
+        for stars in RATING_OPTIONS
+    ]
+
+    return [
+        {"title": "Store", "options": stores},
+        {"title": "Price", "options": prices},
+        {"title": "Availability", "options": stock},
+        {"title": "Rating", "options": ratings},
+    ]
+
+
+def sort_options(params, filters):
+    """Sort links for the template"""
+    options = []
+    for key, (label, ordering) in SORTS.items():
+        query = params.copy()
+        query.pop("cursor", None)
+        query["sort"] = key
+        options.append({
+            "label": label,
+            "url": "?" + query.urlencode(),
+            "active": filters["sort"] == key,
+        })
+    return options
@@ -0,0 +1,216 @@
+"""
+Inventory ledger
+
+Every stock change is a StockMovement row: restocks and adjustments by
+vendors, sales at checkout and (later) cancellations. Product.stock is
+the running total of its movements, kept as a column so pages and
+checkout read it directly. Both are written in the same transaction, so
+they can't drift apart.
+
+Stock is only ever changed by adding to it (stock = stock + n), never by
+writing a number read earlier, so two people changing the same product's
+stock at once don't overwrite each other.
+
+Code that writes stock without a movement (bulk SQL, the admin before
+this ledger existed) shows up in reconcile(), run by:
+python manage.py reconcile_stock
+"""
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from . import facets
+from .models import Product, StockMovement
+
+
+class StockError(Exception):
+    """The change would take stock below zero (message is safe to show)"""
+
+
+def move(product, kind, quantity, user=None, order=None, note=""):
+    """
+    Add quantity (negative to take away) to a product's stock and record
+    the movement
+
+    Args:
+        product: the Product; its stock and version are updated in place
+        kind: a StockMovement kind (RESTOCK, ADJUSTMENT, ...)
+        quantity: units to add, or take away if negative
+        user, order, note: stored on the movement
+
+    Returns:
+        the new StockMovement
+
+    Raises:
+        StockError: if there isn't enough stock. Nothing is changed.
+    """
+    with transaction.atomic():
+        stock, version = (
+            Product.objects.select_for_update()
+            .filter(pk=product.pk)
+            .values_list("stock", "version")
+            .get()
+        )
+        if stock + quantity < 0:
+            raise StockError(
+                f"Not enough stock for {product.name}. Only {stock} left"
+            )
+
+        Product.objects.filter(pk=product.pk).touch_update(
+            stock=F("stock") + quantity
+        )
+        movement = StockMovement.objects.create(
+            product=product,
+            kind=kind,
+            quantity=quantity,
+            stock_after=stock + quantity,
+            user=user,
+            order=order,
+            note=note,
+        )
+
+        # update() skips the save signals - move the product between the
+        # in/out of stock facets here
+        old_keys = {("stock", "in" if stock > 0 else "out")}
+        new_keys = {("stock", "in" if stock + quantity > 0 else "out")}
+        facets.adjust(old_keys - new_keys, new_keys - old_keys)
+
+    product.stock = stock + quantity
+    product.version = version + 1
+    return movement
+
+
+def record_sales(order, items, products):
+    """
+    Add the sale movements of a new order (checkout has already taken the
+    stock, in the same transaction)
+
+    Args:
+        order: the new Order
+        items: its OrderItems
+        products: {product id: Product} with the stock after the sale
+    """
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            product_id=item.product_id,
+            kind=StockMovement.SALE,
+            quantity=-item.quantity,
+            stock_after=products[item.product_id].stock,
+            order=order,
+        )
+        for item in items
+    ])
+
+
+def record_saved_stock(product, old_stock):
+    """
+    Record a stock change made by Product.save() (new products, the admin,
+    the API) - called by the signal handlers
+
+    Args:
+        product: the saved Product
+        old_stock: its stock before the save, None for a new product
+    """
+    change = product.stock - (old_stock or 0)
+    if change:
+        StockMovement.objects.create(
+            product=product,
+            kind=(StockMovement.RESTOCK if old_stock is None
+                  else StockMovement.ADJUSTMENT),
+            quantity=change,
+            stock_after=product.stock,
+            note="Opening stock" if old_stock is None else "",
+        )
+
+
+def record_imported_stock(changes):
+    """
+    Record the stock changes of a bulk import in one INSERT
+
+    Args:
+        changes: (product id, old stock or None if new, new stock) tuples
+    """
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            product_id=product_id,
+            kind=(StockMovement.RESTOCK if old is None
+                  else StockMovement.ADJUSTMENT),
+            quantity=new - (old or 0),
+            stock_after=new,
+            note="Import",
+        )
+        for product_id, old, new in changes
+        if new != (old or 0)
+    ])
+
+
+# ----- Reconciliation -----
+
+
+def _ledger_totals(product_ids):
+    return dict(
+        StockMovement.objects.filter(product_id__in=product_ids)
+        .values_list("product_id")
+        .annotate(total=Sum("quantity"))
+        .order_by()
+    )
+
+
+def reconcile(batch_size=1000, fix=False):
+    """
+    Check that every product's movements add up to its stock, batch_size
+    products at a time (two queries per batch)
+
+    Args:
+        batch_size: products per batch
+        fix: add an adjustment movement for each difference, so the
+        ledger matches the stock again (the stock itself is not changed)
+
+    Yields:
+        (product id, stock, ledger total) for each product that doesn't
+        add up
+    """
+    last_id = 0
+    while True:
+        batch = list(
+            Product.objects.filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", "stock")[:batch_size]
+        )
+        if not batch:
+            return
+        last_id = batch[-1][0]
+
+        totals = _ledger_totals([product_id for product_id, stock in batch])
+        wrong = [product_id for product_id, stock in batch
+                 if totals.get(product_id, 0) != stock]
+        if not wrong:
+            continue
+
+        with transaction.atomic():
+            # Read again under lock: a sale between the two queries above
+            # looks like a difference that isn't there
+            stocks = dict(
+                Product.objects.select_for_update()
+                .filter(pk__in=wrong)
+                .values_list("pk", "stock")
+            )
+            totals = _ledger_totals(list(stocks))
+            differences = [
+                (product_id, stock, totals.get(product_id, 0))
+                for product_id, stock in sorted(stocks.items())
+                if totals.get(product_id, 0) != stock
+            ]
+            if fix:
+                StockMovement.objects.bulk_create([
+                    StockMovement(
+                        product_id=product_id,
+                        kind=StockMovement.ADJUSTMENT,
+                        quantity=stock - total,
+                        stock_after=stock,
+                        note="Reconciliation",
+                    )
+                    for product_id, stock, total in differences
+                ])
+
+        yield from differences
@@ -0,0 +1,193 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    """
+    Load-test the storefront with simulated buyers and report latency
+    (p50/p95/p99), throughput and SQL queries per request for each step
+    (see store/benchmark.py)
+
+    Runs against whatever database the settings point at. Use the bench
+    settings to keep it on a local SQLite file:
+
+    Usage:
+        export DJANGO_SETTINGS_MODULE=ecommerce_project.bench_settings
+        python manage.py migrate
+        python manage.py benchmark --seed
+        python manage.py benchmark --clients 8 --iterations 50
+        python manage.py benchmark --flows browse detail
+        python manage.py benchmark --save-baseline benchmark_baseline.json
+        python manage.py benchmark --baseline benchmark_baseline.json
+
+    Each client first goes through the flows --warmup times without
+    recording, and the run is made --repeats times; the report has the
+    median of each repeat's percentiles.
+
+    With --baseline the command fails if any step now runs more queries
+    per request, has more errors, or its p95 got slower by more than
+    --tolerance and by more than --min-delta-ms. Compare runs made with
+    the same options.
+    """
+
+    help = "Benchmark browse, product, cart and checkout pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            action="store_true",
+            help="Add benchmark data before running",
+        )
+        parser.add_argument(
+            "--scale",
+            choices=sorted(benchmark.SCALES),
+            default="small",
+            help="How much data --seed adds (default small)",
+        )
+        parser.add_argument(
+            "--flows",
+            nargs="+",
+            choices=benchmark.FLOWS,
+            default=list(benchmark.FLOWS),
+            help="Flows each client goes through (default all)",
+        )
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=4,
+            help="Simulated clients running at the same time (default 4)",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=benchmark.ITERATIONS,
+            help="Recorded times each client goes through the flows "
+                 f"(default {benchmark.ITERATIONS})",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=benchmark.WARMUP,
+            help="Times each client goes through the flows first, not "
+                 f"recorded (default {benchmark.WARMUP})",
+        )
+        parser.add_argument(
+            "--repeats",
+            type=int,
+            default=benchmark.REPEATS,
+            help="Times the whole run is made; percentiles are the median "
+                 f"over them (default {benchmark.REPEATS})",
+        )
+        parser.add_argument(
+            "--random-seed",
+            type=int,
+            default=1,
+            help="Seed for the random data and choices (default 1)",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the report to this JSON file",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            help="Write the report to this JSON file as the new baseline",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Compare with this saved report and fail on regressions",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=benchmark.TOLERANCE,
+            help="How much slower p95 may get than the baseline "
+                 "(default 0.2 = 20%%)",
+        )
+        parser.add_argument(
+            "--min-delta-ms",
+            type=float,
+            default=benchmark.MIN_DELTA_MS,
+            help="p95 must also be this many ms slower to count as a "
+                 f"regression (default {benchmark.MIN_DELTA_MS})",
+        )
+
+    def handle(self, *args, **options):
+        if (options["clients"] < 1 or options["iterations"] < 1
+                or options["repeats"] < 1):
+            raise CommandError(
+                "--clients, --iterations and --repeats must be at least 1"
+            )
+        if options["warmup"] < 0:
+            raise CommandError("--warmup can't be negative")
+
+        if options["seed"]:
+            counts = benchmark.seed(random_seed=options["random_seed"],
+                                    **benchmark.SCALES[options["scale"]])
+            self.stdout.write(
+                "Seeded " + ", ".join(f"{count} {name}"
+                                      for name, count in counts.items())
+            )
+
+        try:
+            report = benchmark.run(
+                flows=options["flows"],
+                clients=options["clients"],
+                iterations=options["iterations"],
+                random_seed=options["random_seed"],
+                warmup=options["warmup"],
+                repeats=options["repeats"],
+            )
+        except ValueError as error:
+            raise CommandError(f"{error} (use --seed)")
+
+        self.write_report(report)
+
+        for path in (options["output"], options["save_baseline"]):
+            if path:
+                with open(path, "w") as file:
+                    json.dump(report, file, indent=2)
+                self.stdout.write(f"Wrote {path}")
+
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Can't read the baseline: {error}")
+
+            regressions = benchmark.compare(report, baseline,
+                                            options["tolerance"],
+                                            options["min_delta_ms"])
+            if regressions:
+                for message in regressions:
+                    self.stderr.write(message)
+                raise CommandError(
+                    f"{len(regressions)} regression(s) against the baseline"
+                )
+            self.stdout.write(
+                self.style.SUCCESS("No regressions against the baseline")
+            )
+
+    def write_report(self, report):
+        self.stdout.write(
+            f"{'step':<20}{'requests':>9}{'errors':>8}{'p50 ms':>9}"
+            f"{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for step, numbers in report["steps"].items():
+            self.stdout.write(
+                f"{step:<20}{numbers['requests']:>9}{numbers['errors']:>8}"
+                f"{numbers['p50_ms']:>9}{numbers['p95_ms']:>9}"
+                f"{numbers['p99_ms']:>9}"
+                f"{numbers['queries_per_request']:>9}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{report['requests']} requests in {report['seconds']}s "
+                f"({report['throughput']} requests/s) with "
+                f"{report['clients']} clients, median of "
+                f"{report['repeats']} repeat(s)"
+            )
+        )
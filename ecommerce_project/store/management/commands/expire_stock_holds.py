@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import stock_holds
+
+
+class Command(BaseCommand):
+    """
+    Background worker that deletes expired cart stock holds, in batches
+    (expired holds are already ignored - this keeps the table small)
+
+    Usage:
+        python manage.py expire_stock_holds            # run forever
+        python manage.py expire_stock_holds --once     # sweep once and stop
+    """
+
+    help = "Delete expired cart stock holds"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Delete what has expired, then exit",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Holds deleted per DELETE",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60.0,
+            help="Seconds between sweeps (default 60)",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+
+        try:
+            while True:
+                deleted = stock_holds.expire(options["batch_size"])
+                total += deleted
+                if deleted:
+                    self.stdout.write(f"Deleted {deleted} expired holds")
+
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total} expired holds deleted"
+        ))
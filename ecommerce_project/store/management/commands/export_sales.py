@@ -0,0 +1,91 @@
+import sys
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from store import sales_export
+
+
+def _day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Not a YYYY-MM-DD date: {value}")
+
+
+class Command(BaseCommand):
+    """
+    Write every order line of a vendor's products to a CSV or JSON Lines
+    file, a chunk at a time (see store/sales_export.py)
+
+    Usage:
+        python manage.py export_sales vendor1 > sales.csv
+        python manage.py export_sales vendor1 --format jsonl -o sales.jsonl
+        python manage.py export_sales vendor1 --from 2026-01-01 --to 2026-03-31
+        python manage.py export_sales vendor1 --store 12
+    """
+
+    help = "Export a vendor's order lines as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("vendor", help="Username of the vendor")
+        parser.add_argument(
+            "--format",
+            choices=sorted(sales_export.FORMATS),
+            default="csv",
+            help="Output format (default csv)",
+        )
+        parser.add_argument(
+            "-o", "--output",
+            help="File to write (default: standard output)",
+        )
+        parser.add_argument("--store", type=int,
+                            help="Only this store's sales")
+        parser.add_argument("--from", dest="date_from",
+                            help="Only orders on or after this date")
+        parser.add_argument("--to", dest="date_to",
+                            help="Only orders on or before this date")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="Order lines read per query "
+                 "(default STORE_EXPORT_CHUNK_SIZE)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            vendor = User.objects.get(username=options["vendor"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user called {options['vendor']}")
+
+        start = end = None
+        if options["date_from"]:
+            start = sales_export.start_of_day(_day(options["date_from"]))
+        if options["date_to"]:
+            end = sales_export.start_of_day(_day(options["date_to"])
+                                            + timedelta(days=1))
+
+        lines = sales_export.sales_lines(vendor, store_id=options["store"],
+                                         start=start, end=end)
+        rows = sales_export.iter_rows(lines,
+                                      chunk_size=options["chunk_size"])
+
+        output = (open(options["output"], "w", newline="")
+                  if options["output"] else sys.stdout)
+        count = 0
+        try:
+            for text in sales_export.render(rows, options["format"]):
+                output.write(text)
+                count += 1
+        finally:
+            if options["output"]:
+                output.close()
+
+        if options["output"]:
+            # (The CSV header is a line too)
+            if options["format"] == "csv":
+                count -= 1
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {count} order lines to {options['output']}"
+            ))
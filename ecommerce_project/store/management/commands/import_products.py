@@ -0,0 +1,102 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import Store
+from store.product_import import (
+    FORMATS,
+    ImportFormatError,
+    import_products,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    """
+    Create or update a store's products from a CSV or JSON Lines file,
+    matched on SKU (see store/product_import.py)
+
+    The file is read one row at a time and saved in batches, so any size
+    of file works. Rejected rows are listed with their line number.
+
+    Usage:
+        python manage.py import_products 12 products.csv
+        python manage.py import_products 12 products.jsonl
+        python manage.py import_products 12 export.txt --format jsonl
+        python manage.py import_products 12 products.csv --errors bad.csv
+    """
+
+    help = "Bulk create or update a store's products from a file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("store_id", type=int, help="Store to import to")
+        parser.add_argument("path", help="CSV or JSON Lines file")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="File format (default: from the file name)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Rows saved per batch (default STORE_IMPORT_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--errors",
+            help="Write rejected rows to this CSV file (default: stderr)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(pk=options["store_id"])
+        except Store.DoesNotExist:
+            raise CommandError(f"No store with id {options['store_id']}")
+
+        path = options["path"]
+        file_format = options["format"] or (
+            "jsonl" if path.lower().endswith((".jsonl", ".ndjson"))
+            else "csv"
+        )
+
+        error_file = None
+        if options["errors"]:
+            error_file = open(options["errors"], "w", newline="")
+            errors = csv.writer(error_file)
+            errors.writerow(["line", "sku", "error"])
+        else:
+            errors = None
+
+        created = updated = rejected = 0
+        try:
+            with open(path, "rb") as file:
+                for report in import_products(
+                    store, read_rows(file, file_format),
+                    batch_size=options["batch_size"],
+                ):
+                    created += report.created
+                    updated += report.updated
+                    rejected += len(report.errors)
+                    self.stdout.write(
+                        f"Batch {report.number}: {report.rows} rows, "
+                        f"{report.created} added, {report.updated} updated, "
+                        f"{len(report.errors)} rejected"
+                    )
+                    for line, sku, message in report.errors:
+                        if errors:
+                            errors.writerow([line, sku, message])
+                        else:
+                            self.stderr.write(f"Line {line} ({sku or '-'}): "
+                                              f"{message}")
+        except OSError as error:
+            raise CommandError(f"Can't read {path}: {error}")
+        except ImportFormatError as error:
+            raise CommandError(str(error))
+        finally:
+            if error_file:
+                error_file.close()
+
+        style = self.style.SUCCESS if not rejected else self.style.WARNING
+        self.stdout.write(style(
+            f"Imported into {store.name}: {created} added, {updated} "
+            f"updated, {rejected} rejected"
+        ))
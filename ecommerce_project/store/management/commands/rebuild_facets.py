@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from store import facets
+
+
+class Command(BaseCommand):
+    """
+    Recount the browse page facet counts from scratch
+
+    Usage:
+        python manage.py rebuild_facets
+    """
+
+    help = "Recount the browse page facet counts"
+
+    def handle(self, *args, **options):
+        total = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} facet counts"))
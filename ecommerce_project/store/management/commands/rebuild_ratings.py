@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from store import facets, ratings
+
+
+class Command(BaseCommand):
+    """
+    Work out every product's rating totals (count, average, histogram)
+    again from its reviews, then recount the facets that use them
+
+    Usage:
+        python manage.py rebuild_ratings
+        python manage.py rebuild_ratings --batch-size 500
+    """
+
+    help = "Rebuild product rating totals from reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Product ids per UPDATE (default 1000)",
+        )
+
+    def handle(self, *args, **options):
+        reviewed = ratings.rebuild(batch_size=options["batch_size"])
+        total = facets.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt ratings for {reviewed} reviewed products "
+                f"and wrote {total} facet counts"
+            )
+        )
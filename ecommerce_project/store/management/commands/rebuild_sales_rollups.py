@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from store import sales_rollups
+
+
+class Command(BaseCommand):
+    """
+    Work out the vendor dashboard's daily sales totals again from every
+    order
+
+    Usage:
+        python manage.py rebuild_sales_rollups
+    """
+
+    help = "Rebuild the daily sales totals shown on the vendor dashboard"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows written per INSERT",
+        )
+
+    def handle(self, *args, **options):
+        stores, products, vendors = sales_rollups.rebuild(
+            batch_size=options["batch_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stores} store, {products} product and {vendors} "
+            f"vendor daily totals"
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store import search
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the product search index from scratch
+
+    Usage:
+        python manage.py rebuild_search_index [--batch-size 1000]
+    """
+
+    help = "Rebuild the product search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Products indexed per batch (default 1000)",
+        )
+
+    def handle(self, *args, **options):
+        total = search.rebuild_index(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} products"))
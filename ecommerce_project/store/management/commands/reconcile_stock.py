@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import inventory
+
+
+class Command(BaseCommand):
+    """
+    Check that every product's stock movements add up to its stock, in
+    batches over the whole catalog (see store/inventory.py)
+
+    Exits with an error if any product doesn't add up, unless --fix is
+    given: then an adjustment movement is added for each difference.
+
+    Usage:
+        python manage.py reconcile_stock
+        python manage.py reconcile_stock --fix
+    """
+
+    help = "Check the stock ledger against product stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Products checked per batch",
+        )
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Add adjustment movements so the ledger matches the stock",
+        )
+
+    def handle(self, *args, **options):
+        differences = 0
+        for product_id, stock, total in inventory.reconcile(
+            batch_size=options["batch_size"], fix=options["fix"]
+        ):
+            differences += 1
+            self.stdout.write(
+                f"Product {product_id}: stock {stock}, movements add up "
+                f"to {total}"
+            )
+
+        if not differences:
+            self.stdout.write(self.style.SUCCESS("Stock ledger adds up"))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(
+                f"Added adjustments for {differences} products"
+            ))
+        else:
+            raise CommandError(
+                f"{differences} products don't add up "
+                f"(run with --fix to record the differences)"
+            )
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import seeding
+
+
+class Command(BaseCommand):
+    """
+    Fill the database with made-up vendors, buyers, stores, products,
+    reviews and orders for load tests and scaling work (see
+    store/seeding.py)
+
+    The same options always give the same data. Rows are added to what is
+    already there (usernames start with --prefix).
+
+    Usage:
+        python manage.py seed_store
+        python manage.py seed_store --products 1000000 --orders 1000000 \\
+            --items-per-order 5 --workers 4
+        python manage.py seed_store --seed 7 --chunk-size 20000
+        python manage.py seed_store --skip-rebuild
+
+    Use --workers 1 with SQLite (it has one writer at a time).
+    """
+
+    help = "Generate a large, repeatable set of made-up store data"
+
+    def add_arguments(self, parser):
+        for name, default, text in (
+            ("stores", 100, "stores"),
+            ("products", 10000, "products"),
+            ("reviews", 50000, "reviews"),
+            ("buyers", 1000, "buyer accounts"),
+            ("orders", 20000, "orders"),
+            ("items-per-order", 3, "order items in each order"),
+        ):
+            parser.add_argument(
+                f"--{name}",
+                type=int,
+                default=default,
+                help=f"Number of {text} (default {default})",
+            )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="Random seed - the same seed gives the same data "
+                 "(default 1)",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="seed",
+            help='Start of every username (default "seed")',
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="Rows written per transaction (default 10000)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes writing at the same time (default 1)",
+        )
+        parser.add_argument(
+            "--skip-rebuild",
+            action="store_true",
+            help="Don't rebuild the search index, ratings and facets "
+                 "(run the rebuild commands later)",
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        if options["stores"] < 1 or options["products"] < 1:
+            raise CommandError("Need at least one store and one product")
+        if options["buyers"] < 1 and (options["reviews"]
+                                      or options["orders"]):
+            raise CommandError("Reviews and orders need at least one buyer")
+        if options["chunk_size"] < 1 or options["workers"] < 1:
+            raise CommandError("--chunk-size and --workers must be positive")
+
+        plan = seeding.Plan(
+            stores=options["stores"],
+            products=options["products"],
+            reviews=options["reviews"],
+            buyers=options["buyers"],
+            orders=options["orders"],
+            items_per_order=options["items_per_order"],
+            seed=options["seed"],
+            prefix=options["prefix"],
+            chunk_size=options["chunk_size"],
+        )
+
+        started = time.monotonic()
+        written = seeding.generate(plan, workers=options["workers"],
+                                   progress=self.progress)
+        self.stdout.write(
+            "Wrote " + ", ".join(f"{count} {table}"
+                                 for table, count in written.items())
+            + f" in {time.monotonic() - started:.1f}s"
+        )
+
+        if not options["skip_rebuild"]:
+            started = time.monotonic()
+            seeding.rebuild()
+            self.stdout.write(
+                f"Rebuilt the search index, ratings and facets in "
+                f"{time.monotonic() - started:.1f}s"
+            )
+
+        self.stdout.write(self.style.SUCCESS("Seeding done"))
+
+    def progress(self, table, done, total):
+        if self.verbosity > 1 or done == total:
+            self.stdout.write(f"  {table}: {done}/{total}")
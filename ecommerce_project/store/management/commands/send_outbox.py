@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    """
+    Background worker that sends queued emails
+
+    Usage:
+        python manage.py send_outbox            # run forever
+        python manage.py send_outbox --once     # send what's due and stop
+    """
+
+    help = "Send queued emails from the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Send everything that is due, then exit",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.STORE_OUTBOX_BATCH_SIZE,
+            help="Emails sent per mail server connection",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait when the outbox is empty (default 5)",
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+
+        try:
+            while True:
+                sent, failed = outbox.send_pending(options["batch_size"])
+                total_sent += sent
+                total_failed += failed
+
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent}, failed {failed}")
+                    # More may be waiting - go straight to the next batch
+                    continue
+
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total_sent} sent, {total_failed} failed"
+        ))
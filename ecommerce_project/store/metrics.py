@@ -0,0 +1,303 @@
+"""
+Per-request query, database and template timing
+
+MetricsMiddleware measures every request:
+
+- number of SQL queries, total time spent in the database and the
+  slowest query
+- time spent rendering templates
+- total time
+
+and
+
+- adds a Server-Timing header (shown in the browser's network tab)
+- logs a warning (logger "store.metrics") when a view goes over its query
+  or database time budget
+- adds the numbers up per view for the /metrics page, in Prometheus text
+  format, together with the page cache hit counters
+
+Turned on with STORE_METRICS_ENABLED. When off, the middleware removes
+itself at startup (MiddlewareNotUsed) and /metrics answers 404, so there is
+no cost per request.
+
+Totals are kept per server process - Prometheus adds them up across
+processes when each one is scraped.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.template.base import Template
+from django.utils.crypto import constant_time_compare
+
+from . import page_cache
+
+logger = logging.getLogger(__name__)
+
+# Stats of the request being handled by this thread, if any
+_current = ContextVar("store_metrics_request", default=None)
+
+_totals = defaultdict(lambda: defaultdict(float))
+_slowest = defaultdict(float)
+_totals_lock = threading.Lock()
+
+
+class RequestStats:
+    """
+    What one request spent its time on
+
+    Fields:
+        queries: number of SQL queries
+        db_seconds: time spent waiting for the database
+        slowest_sql / slowest_seconds: the slowest query
+        template_seconds: time spent rendering templates
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_sql = ""
+        self.slowest_seconds = 0.0
+        self.template_seconds = 0.0
+        self._template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Time one query (used with connection.execute_wrapper)"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            if elapsed > self.slowest_seconds:
+                self.slowest_seconds = elapsed
+                self.slowest_sql = sql
+
+
+# ----- Template timing -----
+
+# Template.render is only wrapped while requests are inside the middleware
+# (see _template_timing), so management commands, emails and anything else
+# rendering outside a request never go through it
+_render_lock = threading.Lock()
+_requests_rendering = 0
+_original_render = Template.render
+
+
+def _timed_render(self, context):
+    stats = _current.get()
+    if stats is None:
+        return _original_render(self, context)
+
+    # {% include %} renders templates inside templates - only time the
+    # outermost one so nothing is counted twice
+    stats._template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        stats._template_depth -= 1
+        if stats._template_depth == 0:
+            stats.template_seconds += time.perf_counter() - start
+
+
+@contextmanager
+def _template_timing():
+    """
+    Wrap Template.render while this request is handled
+
+    The first request in puts the wrapper in place and the last one out
+    puts the original back.
+    """
+    global _requests_rendering, _original_render
+    with _render_lock:
+        if _requests_rendering == 0:
+            _original_render = Template.render
+            Template.render = _timed_render
+        _requests_rendering += 1
+    try:
+        yield
+    finally:
+        with _render_lock:
+            _requests_rendering -= 1
+            if _requests_rendering == 0:
+                Template.render = _original_render
+
+
+# ----- Middleware -----
+
+
+def query_budget(view_name):
+    """Most queries a view may run before it is flagged"""
+    return settings.STORE_METRICS_QUERY_BUDGETS.get(
+        view_name, settings.STORE_METRICS_QUERY_BUDGET
+    )
+
+
+class MetricsMiddleware:
+    """
+    Measure every request (see the module docstring)
+
+    Put it first in MIDDLEWARE so the whole request is timed.
+    """
+
+    def __init__(self, get_response):
+        if not settings.STORE_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            # Connections are set up per thread but don't connect until
+            # the first query, so wrapping every alias costs nothing
+            with ExitStack() as stack:
+                stack.enter_context(_template_timing())
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_seconds = time.perf_counter() - start
+
+        match = request.resolver_match
+        view_name = match.view_name if match else "unmatched"
+        if view_name == "metrics":
+            return response
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={stats.db_seconds * 1000:.1f};'
+            f'desc="{stats.queries} queries"',
+            f"tpl;dur={stats.template_seconds * 1000:.1f}",
+            f"total;dur={total_seconds * 1000:.1f}",
+        ])
+
+        over_budget = (
+            stats.queries > query_budget(view_name)
+            or stats.db_seconds * 1000
+            > settings.STORE_METRICS_DB_TIME_BUDGET_MS
+        )
+        if over_budget:
+            logger.warning(
+                "%s went over budget: %d queries, %.1f ms in the database "
+                "(slowest %.1f ms: %s)",
+                view_name, stats.queries, stats.db_seconds * 1000,
+                stats.slowest_seconds * 1000, stats.slowest_sql,
+            )
+
+        _record(view_name, stats, total_seconds, over_budget)
+        return response
+
+
+def _record(view_name, stats, total_seconds, over_budget):
+    with _totals_lock:
+        totals = _totals[view_name]
+        totals["requests"] += 1
+        totals["seconds"] += total_seconds
+        totals["queries"] += stats.queries
+        totals["db_seconds"] += stats.db_seconds
+        totals["template_seconds"] += stats.template_seconds
+        totals["over_budget"] += over_budget
+        _slowest[view_name] = max(_slowest[view_name],
+                                  stats.slowest_seconds)
+
+
+def reset_metrics():
+    with _totals_lock:
+        _totals.clear()
+        _slowest.clear()
+
+
+# ----- /metrics -----
+
+# (name in _totals, Prometheus metric, type, help)
+METRICS = [
+    ("requests", "store_requests_total", "counter",
+     "Requests handled"),
+    ("seconds", "store_request_seconds_total", "counter",
+     "Time spent handling requests"),
+    ("queries", "store_db_queries_total", "counter",
+     "SQL queries run"),
+    ("db_seconds", "store_db_seconds_total", "counter",
+     "Time spent waiting for the database"),
+    ("template_seconds", "store_template_seconds_total", "counter",
+     "Time spent rendering templates"),
+    ("over_budget", "store_over_budget_total", "counter",
+     "Requests over their query or database time budget"),
+]
+
+
+def _label(value):
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render_metrics():
+    """All totals in Prometheus text format"""
+    with _totals_lock:
+        totals = {view: dict(values) for view, values in _totals.items()}
+        slowest = dict(_slowest)
+
+    lines = []
+    for key, name, kind, help_text in METRICS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for view in sorted(totals):
+            value = totals[view].get(key, 0)
+            lines.append(f'{name}{{view="{_label(view)}"}} {_number(value)}')
+
+    name = "store_db_slowest_query_seconds"
+    lines += [f"# HELP {name} Slowest SQL query since the process started",
+              f"# TYPE {name} gauge"]
+    for view in sorted(slowest):
+        lines.append(
+            f'{name}{{view="{_label(view)}"}} {_number(slowest[view])}'
+        )
+
+    stats = page_cache.cache_stats()
+    for key, name in (("hits", "store_cache_hits_total"),
+                      ("misses", "store_cache_misses_total")):
+        lines += [f"# HELP {name} Page cache {key} (see store.page_cache)",
+                  f"# TYPE {name} counter"]
+        for cache_name, counts in stats.items():
+            lines.append(
+                f'{name}{{cache="{_label(cache_name)}"}} {counts[key]}'
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint
+
+    Open to staff users, or to anyone sending
+    "Authorization: Bearer <STORE_METRICS_TOKEN>" when a token is set.
+    """
+    if not settings.STORE_METRICS_ENABLED:
+        raise Http404
+
+    token = settings.STORE_METRICS_TOKEN
+    sent = request.headers.get("Authorization", "")
+    allowed = request.user.is_staff or (
+        token and constant_time_compare(sent, f"Bearer {token}")
+    )
+    if not allowed:
+        return HttpResponseForbidden("Not allowed")
+
+    return HttpResponse(render_metrics(),
+                        content_type="text/plain; version=0.0.4")
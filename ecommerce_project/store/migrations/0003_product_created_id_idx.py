@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0002_passwordresettoken"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["created_at", "id"], name="product_created_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0004_productsearchterm"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacetCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("facet", models.CharField(max_length=20)),
+                ("value", models.CharField(max_length=40)),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["price", "id"], name="product_price_id_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="facetcount",
+            constraint=models.UniqueConstraint(
+                fields=("facet", "value"), name="unique_facet_value"
+            ),
+        ),
+    ]
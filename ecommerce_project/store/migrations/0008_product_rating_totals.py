@@ -0,0 +1,84 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:29
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_rating_totals(apps, schema_editor):
+    """Work out the rating totals of products that already have reviews"""
+    Product = apps.get_model("store", "Product")
+    Review = apps.get_model("store", "Review")
+
+    totals = (
+        Review.objects.values("product")
+        .annotate(
+            count=Count("id"),
+            total=Sum("rating"),
+            **{f"stars_{n}": Count("id", filter=Q(rating=n)) for n in range(1, 6)},
+        )
+        .order_by()
+    )
+    for row in totals.iterator():
+        Product.objects.filter(pk=row["product"]).update(
+            rating_count=row["count"],
+            rating_sum=row["total"],
+            rating_average=row["total"] / row["count"],
+            **{f"rating_{n}": row[f"stars_{n}"] for n in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0007_cartitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="rating_1",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_2",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_3",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_4",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_5",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_average",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["rating_average", "id"], name="product_rating_id_idx"
+            ),
+        ),
+        migrations.RunPython(fill_rating_totals, migrations.RunPython.noop),
+    ]
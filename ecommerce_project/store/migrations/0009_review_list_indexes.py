@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0008_product_rating_totals"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "created_at", "id"],
+                name="review_product_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "verified", "created_at", "id"],
+                name="review_product_verified_idx",
+            ),
+        ),
+    ]
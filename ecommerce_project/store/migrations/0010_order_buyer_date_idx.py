@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0009_review_list_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["buyer", "order_date", "id"], name="order_buyer_date_idx"
+            ),
+        ),
+    ]
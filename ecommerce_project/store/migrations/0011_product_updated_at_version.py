@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:40
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def updated_at_from_created_at(apps, schema_editor):
+    """Existing products count as last changed when they were created"""
+    Product = apps.get_model("store", "Product")
+    Product.objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0010_order_buyer_date_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(updated_at_from_created_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-17 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0011_product_updated_at_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="sku",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="product",
+            constraint=models.UniqueConstraint(
+                fields=("store", "sku"), name="unique_store_sku"
+            ),
+        ),
+    ]
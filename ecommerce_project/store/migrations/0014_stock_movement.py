@@ -0,0 +1,112 @@
+# Generated by Django 6.0.2 on 2026-10-17 05:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    """
+    Start every product's ledger with one movement for its current stock,
+    so the movements add up to the stock from the start
+    """
+    Product = apps.get_model("store", "Product")
+    StockMovement = apps.get_model("store", "StockMovement")
+
+    last_id = 0
+    while True:
+        batch = list(
+            Product.objects.filter(pk__gt=last_id, stock__gt=0)
+            .order_by("pk")
+            .values_list("pk", "stock")[:2000]
+        )
+        if not batch:
+            return
+        StockMovement.objects.bulk_create(
+            [
+                StockMovement(
+                    product_id=product_id,
+                    kind="adjustment",
+                    quantity=stock,
+                    stock_after=stock,
+                    note="Opening balance",
+                )
+                for product_id, stock in batch
+            ]
+        )
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0013_daily_sales"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockMovement",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("restock", "Restock"),
+                            ("sale", "Sale"),
+                            ("adjustment", "Adjustment"),
+                            ("cancellation", "Cancellation"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("quantity", models.IntegerField()),
+                ("stock_after", models.PositiveIntegerField()),
+                ("note", models.CharField(blank=True, max_length=200)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "order",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="store.order",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stock_movements",
+                        to="store.product",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["product", "id"], name="stock_movement_product_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 6.0.2 on 2026-10-17 05:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def vendor_orders(apps, schema_editor):
+    """Count every vendor's orders per day from the order lines"""
+    OrderItem = apps.get_model("store", "OrderItem")
+    VendorDailySales = apps.get_model("store", "VendorDailySales")
+
+    totals = (
+        OrderItem.objects.annotate(day=TruncDate("order__order_date"))
+        .values("product__store__owner_id", "day")
+        .annotate(orders=Count("order_id", distinct=True))
+        .order_by()
+    )
+    batch = []
+    for row in totals.iterator(chunk_size=2000):
+        batch.append(
+            VendorDailySales(
+                vendor_id=row["product__store__owner_id"],
+                day=row["day"],
+                orders=row["orders"],
+            )
+        )
+        if len(batch) >= 2000:
+            VendorDailySales.objects.bulk_create(batch)
+            batch = []
+    VendorDailySales.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0015_stock_hold"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VendorDailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("orders", models.IntegerField(default=0)),
+                (
+                    "vendor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_sales",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("vendor", "day"), name="unique_vendor_day"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(vendor_orders, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 
 
 class Store(models.Model):
@@ -28,6 +29,29 @@ class Store(models.Model):
         ordering = ["-created_at"]
 
 
+class ProductQuerySet(models.QuerySet):
+    def touch_update(self, **kwargs):
+        """
+        update() that also marks the products as changed
+
+        update() skips save(), so use this for any update that changes
+        what a product page shows (stock, review totals, ...): it moves
+        updated_at and version on, so cached copies of the pages are
+        not reused.
+
+        Returns:
+            number of products updated
+        """
+        from .conditional import catalog_changed
+
+        updated = self.update(
+            updated_at=timezone.now(), version=models.F("version") + 1,
+            **kwargs
+        )
+        catalog_changed()
+        return updated
+
+
 class Product(models.Model):
     """
     Model representing product in a store
@@ -40,7 +64,21 @@ class Product(models.Model):
         stock: (PositiveIntegerField) - the quantity of the product
         store: (ForeignKey to Store, cascade delete) the store which the
         product belongs to
+        sku: (CharField, max 64, optional) - the vendor's own product code,
+        unique within the store (bulk imports match products by it)
         created_at: (DateTimeField, auto-filled) - when the product was created
+        updated_at: (DateTimeField, auto-filled) - when the product last
+        changed
+        version: (PositiveIntegerField) - goes up by one on every change
+        rating_count: (PositiveIntegerField) - number of reviews
+        rating_sum: (PositiveIntegerField) - all review stars added together
+        rating_1 ... rating_5: (PositiveIntegerField) - number of 1 to 5
+        star reviews (the rating histogram)
+        rating_average: (FloatField) - rating_sum / rating_count, 0 if there
+        are no reviews
+
+    The rating fields are kept up to date by store.ratings whenever a
+    review is saved or deleted - never set them by hand.
     """
 
     name = models.CharField(max_length=200, blank=False, null=False)
@@ -50,15 +88,274 @@ class Product(models.Model):
     # ForeignKey to store. If store is deleted, all its products are deleted
     #  too
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    # Empty (NULL) for products added without one
+    sku = models.CharField(max_length=64, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Together these say "has this product changed?" (page ETags)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)
+    # Review totals, so listings don't have to aggregate reviews
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    rating_average = models.FloatField(default=0)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         """Return the product name when the object is printed"""
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Save, moving the version on (and updated_at, even when only some
+        fields are saved)"""
+        if self.pk is not None and not kwargs.get("force_insert"):
+            self.version += 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"updated_at",
+                                                            "version"}
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """List of (stars, number of reviews), 5 stars first"""
+        return [(stars, getattr(self, f"rating_{stars}"))
+                for stars in range(5, 0, -1)]
+
     class Meta:
         # newest product first
         ordering = ["-created_at"]
+        indexes = [
+            # Backs keyset pagination on the browse page
+            # (ORDER BY created_at DESC, id DESC)
+            models.Index(fields=["created_at", "id"],
+                         name="product_created_id_idx"),
+            # Backs the price sorts on the browse page
+            models.Index(fields=["price", "id"],
+                         name="product_price_id_idx"),
+            # Backs the "Top rated" sort and the rating filter
+            models.Index(fields=["rating_average", "id"],
+                         name="product_rating_id_idx"),
+        ]
+        constraints = [
+            # Also the conflict target of bulk imports (upserts)
+            models.UniqueConstraint(fields=["store", "sku"],
+                                    name="unique_store_sku"),
+        ]
+
+
+class ProductSearchTerm(models.Model):
+    """
+    One word of the product search index (an inverted index: word -> products)
+
+    Rows are written by store.search whenever a product or store is saved,
+    so a search is an indexed lookup on term instead of a
+    LIKE '%...%' scan over every product description.
+
+    Fields:
+        term: (CharField, max 40) - lowercased word from the product name,
+        description or store name
+        product: (ForeignKey to Product, cascade) - product containing the word
+        weight: (PositiveIntegerField) - how strongly the word describes the
+        product (name counts more than description)
+    """
+
+    term = models.CharField(max_length=40)
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="search_terms"
+    )
+    weight = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        """Return {term} -> {product id}"""
+        return f"{self.term} -> {self.product_id}"
+
+    class Meta:
+        indexes = [
+            # term first: exact and prefix (LIKE 'abc%') lookups use it
+            models.Index(fields=["term", "product"],
+                         name="search_term_product_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "term"], name="unique_product_search_term"
+            ),
+        ]
+
+
+class FacetCount(models.Model):
+    """
+    Precomputed number of products for one filter option on the browse page
+
+    Kept up to date by store.facets whenever products or reviews change,
+    so showing "Electronics (1 204)" never needs a GROUP BY over products.
+
+    Fields:
+        facet: (CharField) - which filter: store, price, stock or rating
+        value: (CharField) - the option: store id, price bucket key,
+        "in"/"out" for stock, 1-5 for average rating (rounded down)
+        count: (IntegerField) - number of products with that value
+    """
+
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=40)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        """Return {facet}={value}: {count}"""
+        return f"{self.facet}={self.value}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["facet", "value"], name="unique_facet_value"
+            ),
+        ]
+
+
+class StoreDailySales(models.Model):
+    """
+    One store's sales on one day (in TIME_ZONE)
+
+    Added to at checkout by store.sales_rollups, so the vendor dashboard
+    adds up at most one row per store per day instead of every order
+    line.
+
+    Fields:
+        store: (ForeignKey) - the store
+        day: (DateField) - the day the orders were placed
+        orders: (IntegerField) - orders with at least one of its products
+        units: (IntegerField) - products sold
+        revenue: (DecimalField) - money taken (price x quantity)
+    """
+
+    store = models.ForeignKey(
+        Store, on_delete=models.CASCADE, related_name="daily_sales"
+    )
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2,
+                                  default=0)
+
+    def __str__(self):
+        """Return {store} {day}: R{revenue}"""
+        return f"{self.store} {self.day}: R{self.revenue}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "day"], name="unique_store_day"
+            ),
+        ]
+
+
+class VendorDailySales(models.Model):
+    """
+    The number of orders a vendor got on one day (in TIME_ZONE)
+
+    An order with products from two of the vendor's stores is one order
+    for the vendor but one for each store, so the vendor's count can't be
+    added up from StoreDailySales.
+
+    Fields:
+        vendor: (ForeignKey to User) - the stores' owner
+        day: (DateField) - the day the orders were placed
+        orders: (IntegerField) - orders with at least one of the vendor's
+        products
+    """
+
+    vendor = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="daily_sales"
+    )
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+
+    def __str__(self):
+        """Return {vendor} {day}: {orders} orders"""
+        return f"{self.vendor} {self.day}: {self.orders} orders"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["vendor", "day"], name="unique_vendor_day"
+            ),
+        ]
+
+
+class ProductDailySales(models.Model):
+    """
+    One product's sales on one day (in TIME_ZONE)
+
+    Kept next to StoreDailySales for the dashboard's top sellers.
+
+    Fields:
+        product: (ForeignKey) - the product
+        store: (ForeignKey) - the product's store (copied, so a vendor's
+        rows are found without a join)
+        day: (DateField) - the day the orders were placed
+        units: (IntegerField) - number sold
+        revenue: (DecimalField) - money taken (price x quantity)
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="daily_sales"
+    )
+    store = models.ForeignKey(
+        Store, on_delete=models.CASCADE, related_name="product_daily_sales"
+    )
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2,
+                                  default=0)
+
+    def __str__(self):
+        """Return {product} {day}: {units} sold"""
+        return f"{self.product} {self.day}: {self.units} sold"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "day"], name="unique_product_day"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["store", "day"],
+                         name="product_sales_store_day"),
+        ]
+
+
+class CartItem(models.Model):
+    """
+    One line of a user's shopping cart (used by DatabaseCartStore)
+
+    Fields:
+        user: (ForeignKey to User, cascade) - whose cart it is
+        product: (ForeignKey to Product, cascade) - the product
+        quantity: (PositiveIntegerField) - how many they want
+        added_at: (DateTimeField, auto) - when the line was added
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """Return {quantity}x {product id} in {user id}'s cart"""
+        return f"{self.quantity}x {self.product_id} in {self.user_id}'s cart"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="unique_cart_item"
+            ),
+        ]
 
 
 class Review(models.Model):
@@ -91,6 +388,14 @@ class Review(models.Model):
     class Meta:
         # newest review first
         ordering = ["-created_at"]
+        indexes = [
+            # Back the product page review list (keyset pages, newest
+            # first), with and without verified reviews first
+            models.Index(fields=["product", "created_at", "id"],
+                         name="review_product_created_idx"),
+            models.Index(fields=["product", "verified", "created_at", "id"],
+                         name="review_product_verified_idx"),
+        ]
 
 
 class Order(models.Model):
@@ -115,6 +420,11 @@ class Order(models.Model):
     class Meta:
         # newest order first
         ordering = ["-order_date"]
+        indexes = [
+            # Backs the order history pages (one buyer, newest first)
+            models.Index(fields=["buyer", "order_date", "id"],
+                         name="order_buyer_date_idx"),
+        ]
 
 
 class OrderItem(models.Model):
@@ -145,6 +455,117 @@ class OrderItem(models.Model):
         ordering = ["order", "product__name"]
 
 
+class StockMovement(models.Model):
+    """
+    One change to a product's stock (the inventory ledger)
+
+    Rows are only ever added: a product's movements add up to its stock,
+    and Product.stock is moved on in the same transaction as each new row
+    (see store.inventory). Mistakes are fixed with another movement.
+
+    Fields:
+        product: (ForeignKey to Product, cascade) - the product
+        kind: (CharField) - restock, sale, adjustment or cancellation
+        quantity: (IntegerField) - units added (positive) or taken out
+        (negative)
+        stock_after: (PositiveIntegerField) - the product's stock after
+        this movement
+        order: (ForeignKey to Order, optional) - the order, for sales and
+        cancellations
+        user: (ForeignKey to User, optional) - who made the change
+        note: (CharField, max 200, optional) - why
+        created_at: (DateTimeField, auto) - when
+    """
+
+    RESTOCK = "restock"
+    SALE = "sale"
+    ADJUSTMENT = "adjustment"
+    CANCELLATION = "cancellation"
+    KINDS = [
+        (RESTOCK, "Restock"),
+        (SALE, "Sale"),
+        (ADJUSTMENT, "Adjustment"),
+        (CANCELLATION, "Cancellation"),
+    ]
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="stock_movements"
+    )
+    kind = models.CharField(max_length=20, choices=KINDS)
+    quantity = models.IntegerField()
+    stock_after = models.PositiveIntegerField()
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True,
+                              blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True,
+                             blank=True)
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """Return {product}: {+/-quantity} ({kind})"""
+        return f"{self.product}: {self.quantity:+d} ({self.kind})"
+
+    def save(self, *args, **kwargs):
+        """Add the movement (saving an existing one is refused)"""
+        if not self._state.adding:
+            raise ValueError(
+                "Stock movements can't be changed - add another one"
+            )
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # A product's history, and the ledger totals per product
+            models.Index(fields=["product", "id"],
+                         name="stock_movement_product_idx"),
+        ]
+
+
+class StockHold(models.Model):
+    """
+    Units of a product set aside for a buyer's cart for a short time
+    (only used when STORE_STOCK_HOLDS_ENABLED is on, see store.stock_holds)
+
+    Other buyers can't add held units to their carts or buy them until
+    the hold expires. Expired holds are ignored, and deleted by the
+    expire_stock_holds command.
+
+    Fields:
+        product: (ForeignKey to Product, cascade) - the product
+        user: (ForeignKey to User, cascade) - the buyer holding it
+        quantity: (PositiveIntegerField) - units held
+        expires_at: (DateTimeField) - when the hold runs out
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="stock_holds"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        """Return {quantity}x {product} held by {user}"""
+        return f"{self.quantity}x {self.product} held by {self.user}"
+
+    class Meta:
+        constraints = [
+            # One hold per buyer per product (its quantity is the cart's)
+            models.UniqueConstraint(
+                fields=["product", "user"], name="unique_stock_hold"
+            ),
+        ]
+        indexes = [
+            # Units held per product (WHERE product IN ... AND
+            # expires_at > now)
+            models.Index(fields=["product", "expires_at"],
+                         name="stock_hold_product_idx"),
+            # The expiry sweep
+            models.Index(fields=["expires_at"],
+                         name="stock_hold_expires_idx"),
+        ]
+
+
 class PasswordResetToken(models.Model):
     """
     Model for password reset tokens
@@ -174,3 +595,64 @@ class PasswordResetToken(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent (the "outbox")
+
+    Views only save a row here; the send_outbox worker sends them in
+    batches over one SMTP connection, so a slow mail server never slows
+    down a page.
+
+    Fields:
+        subject: (CharField) - email subject
+        body: (TextField) - plain text body
+        from_email: (CharField) - sender address
+        to: (TextField) - recipient addresses, comma separated
+        status: (CharField) - pending, sent or failed (gave up)
+        attempts: (PositiveIntegerField) - how many times sending was tried
+        last_error: (TextField) - error from the last failed attempt
+        next_attempt_at: (DateTimeField) - don't try again before this time
+        created_at: (DateTimeField, auto) - when the email was queued
+        sent_at: (DateTimeField) - when it was sent
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.TextField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """Return {subject} to {to} ({status})"""
+        return f"{self.subject} to {self.to} ({self.status})"
+
+    @property
+    def recipients(self):
+        """List of recipient addresses"""
+        return [address for address in self.to.split(",") if address]
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            # The worker asks for "pending and due" rows
+            models.Index(fields=["status", "next_attempt_at"],
+                         name="outbox_status_due_idx"),
+        ]
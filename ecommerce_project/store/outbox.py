@@ -0,0 +1,139 @@
+"""
+Email outbox
+
+Views call enqueue_email() which only saves an OutboxEmail row. The
+send_outbox management command runs as a background worker and calls
+send_pending(), which sends due emails in batches over one reused SMTP
+connection, and retries failures with exponential backoff.
+
+Run the worker with: python manage.py send_outbox
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(subject, body, to, from_email="noreply@ecommerce.com"):
+    """
+    Queue an email to be sent by the worker
+
+    Args:
+        subject: email subject
+        body: plain text body
+        to: list of recipient addresses
+        from_email: sender address
+
+    Returns:
+        the new OutboxEmail
+    """
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        to=",".join(to),
+    )
+
+
+def retry_delay(attempts):
+    """
+    How long to wait before the next try: base, 2x base, 4x base, ...
+    up to STORE_OUTBOX_RETRY_MAX_SECONDS
+    """
+    seconds = settings.STORE_OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    return timedelta(
+        seconds=min(seconds, settings.STORE_OUTBOX_RETRY_MAX_SECONDS)
+    )
+
+
+def send_pending(batch_size=None):
+    """
+    Send one batch of due emails over a single mail server connection
+
+    Rows are locked while they are sent (skipping rows another worker has
+    locked), so several workers can run at once without sending an email
+    twice.
+
+    Returns:
+        (sent, failed) - number of emails sent and number that failed
+    """
+    batch_size = batch_size or settings.STORE_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+
+    skip_locked = connection.features.has_select_for_update_skip_locked
+
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=skip_locked)
+            .filter(status=OutboxEmail.STATUS_PENDING,
+                    next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if not emails:
+            return 0, 0
+
+        sent_ids = []
+        failures = []
+
+        mail_connection = get_connection()
+        try:
+            mail_connection.open()
+        except Exception as error:
+            # Mail server is down - every email in the batch failed
+            failures = [(email, error) for email in emails]
+        else:
+            for email in emails:
+                message = EmailMessage(
+                    email.subject,
+                    email.body,
+                    email.from_email,
+                    email.recipients,
+                    connection=mail_connection,
+                )
+                try:
+                    message.send()
+                    sent_ids.append(email.pk)
+                except Exception as error:
+                    failures.append((email, error))
+        finally:
+            mail_connection.close()
+
+        # One UPDATE for every email that went out
+        if sent_ids:
+            OutboxEmail.objects.filter(pk__in=sent_ids).update(
+                status=OutboxEmail.STATUS_SENT,
+                sent_at=timezone.now(),
+                attempts=F("attempts") + 1,
+            )
+
+        for email, error in failures:
+            _record_failure(email, error)
+
+    return len(sent_ids), len(failures)
+
+
+def _record_failure(email, error):
+    """Schedule a retry, or give up after STORE_OUTBOX_MAX_ATTEMPTS"""
+    email.attempts += 1
+    email.last_error = str(error)[:1000]
+
+    if email.attempts >= settings.STORE_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.STATUS_FAILED
+        logger.error("Giving up on email %s to %s: %s",
+                     email.pk, email.to, error)
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        logger.warning("Email %s to %s failed (attempt %s): %s",
+                       email.pk, email.to, email.attempts, error)
+
+    email.save(update_fields=["attempts", "last_error", "status",
+                              "next_attempt_at"])
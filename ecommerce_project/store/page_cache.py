@@ -0,0 +1,200 @@
+"""
+Cached HTML: product fragments and whole pages for logged-out visitors
+
+Fragments
+    {% productcache "card" product %} ... {% endproductcache %} (from
+    store_cache template tags) keeps the rendered HTML of one product's
+    card or detail body. Entries are per product and role, and remember
+    the product's version and updated_at: a product changed by update()
+    (checkout, review totals) no longer matches and is rendered again.
+    The signal handlers in store.signals also delete a product's entries
+    when it, its store or one of its reviews changes.
+
+    Never put a form with {% csrf_token %} inside a cached fragment.
+
+Pages
+    @anonymous_page_cache(version_func) keeps whole responses for
+    logged-out visitors, keyed by the URL and a version from version_func
+    (the catalog version for browse, the product's version for its page).
+
+Works with any cache backend: locmem in tests, a shared cache (Redis,
+Memcached) in production. Hit/miss counters are kept per process - see
+cache_stats().
+"""
+
+import threading
+from collections import Counter
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .conditional import catalog_version, product_validator
+from .roles import BUYER, VENDOR
+
+FRAGMENTS = ("card", "detail")
+ROLES = (VENDOR, BUYER, None)
+
+_hits = Counter()
+_misses = Counter()
+_stats_lock = threading.Lock()
+
+
+# ----- Hit/miss counters -----
+
+
+def _count(name, hit):
+    with _stats_lock:
+        (_hits if hit else _misses)[name] += 1
+
+
+def cache_stats():
+    """
+    Hits and misses in this process since it started
+
+    Returns:
+        {name: {"hits": int, "misses": int}} for each fragment name and
+        "page"
+    """
+    with _stats_lock:
+        names = set(_hits) | set(_misses)
+        return {name: {"hits": _hits[name], "misses": _misses[name]}
+                for name in sorted(names)}
+
+
+def reset_stats():
+    with _stats_lock:
+        _hits.clear()
+        _misses.clear()
+
+
+# ----- Product fragments -----
+
+
+def fragment_key(name, product_id, role):
+    return f"store:fragment:{name}:{product_id}:{role or 'anonymous'}"
+
+
+def _stamp(product):
+    """What a cached fragment must match to still be up to date"""
+    return (product.version, product.updated_at.timestamp())
+
+
+def warm_fragments(request, name, products):
+    """
+    Fetch the cached fragments for a whole page of products with one
+    cache call (instead of one per product card)
+    """
+    role = getattr(request, "role", None)
+    keys = [fragment_key(name, product.pk, role) for product in products]
+    found = getattr(request, "_fragments", {})
+    found.update(cache.get_many(keys))
+    request._fragments = found
+
+
+def fragment(request, name, product, render):
+    """
+    Return the cached HTML of a product fragment, or render() and cache it
+
+    Args:
+        request: the current request (for the role and warmed fragments)
+        name: "card" or "detail"
+        product: the Product shown
+        render: function returning the HTML
+    """
+    role = getattr(request, "role", None)
+    key = fragment_key(name, product.pk, role)
+
+    warmed = getattr(request, "_fragments", None)
+    if warmed is not None and key in warmed:
+        cached = warmed[key]
+    elif warmed is not None:
+        # Warmed and not there - no need to ask the cache again
+        cached = None
+    else:
+        cached = cache.get(key)
+
+    if cached is not None and cached[0] == _stamp(product):
+        _count(name, hit=True)
+        return cached[1]
+
+    _count(name, hit=False)
+    html = render()
+    cache.set(key, (_stamp(product), html),
+              settings.STORE_FRAGMENT_CACHE_TIMEOUT)
+    return html
+
+
+def forget_products(product_ids):
+    """Delete every cached fragment of these products"""
+    cache.delete_many([
+        fragment_key(name, product_id, role)
+        for product_id in product_ids
+        for name in FRAGMENTS
+        for role in ROLES
+    ])
+
+
+# ----- Whole pages for logged-out visitors -----
+
+
+def anonymous_page_cache(version_func):
+    """
+    Cache a view's whole response for logged-out visitors
+
+    Args:
+        version_func: called like the view; returns a string that changes
+        whenever the page would, or None to not use the cache
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method != "GET" or request.user.is_authenticated
+                    or len(messages.get_messages(request))):
+                return view(request, *args, **kwargs)
+
+            version = version_func(request, *args, **kwargs)
+            if version is None:
+                return view(request, *args, **kwargs)
+
+            path = md5(request.get_full_path().encode()).hexdigest()
+            key = f"store:page:{view.__name__}:{version}:{path}"
+
+            cached = cache.get(key)
+            if cached is not None:
+                _count("page", hit=True)
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            _count("page", hit=False)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(
+                    key,
+                    (response.content, response["Content-Type"]),
+                    settings.STORE_PAGE_CACHE_TIMEOUT,
+                )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def browse_page_version(request, *args, **kwargs):
+    """Browse pages change with the catalog"""
+    version, modified = catalog_version()
+    return version
+
+
+def product_page_version(request, pk, *args, **kwargs):
+    """A product page changes with its product"""
+    found = product_validator(request, pk)
+    if found is None:
+        return None
+    version, updated_at = found
+    return f"{version}-{updated_at.timestamp()}"
@@ -0,0 +1,208 @@
+"""
+Keyset (cursor) pagination
+
+Offset pagination (LIMIT 20 OFFSET 100000) gets slower the deeper you go,
+because the database still walks every skipped row. Keyset pagination
+remembers the sort values of the last row on the page and asks for the
+rows that come "after" it, so every page is one index range scan no matter
+how big the table is.
+
+Cursors are opaque to the browser: a base64 string holding the direction,
+the ordering and the sort values of the boundary row.
+"""
+
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor from the query string cannot be decoded"""
+
+
+def encode_cursor(values, direction="next", ordering=()):
+    """
+    Turn the sort values of a boundary row into an opaque cursor string
+
+    Args:
+        values: list of sort values (datetimes, decimals, ints, strings)
+        direction: "next" or "prev"
+        ordering: the ordering the values belong to, so a cursor from one
+        sort order is not used with another
+    """
+    payload = {
+        "d": direction,
+        "o": ",".join(ordering),
+        "v": [_to_json(value) for value in values],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Read a cursor made by encode_cursor()
+
+    Returns:
+        (direction, values, ordering) tuple
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction = payload["d"]
+        values = payload["v"]
+        ordering = tuple(payload.get("o", "").split(","))
+    except (binascii.Error, ValueError, KeyError, TypeError,
+            AttributeError):
+        raise InvalidCursor(cursor)
+
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+
+    return direction, values, ordering
+
+
+def _to_json(value):
+    """Keep full precision (DjangoJSONEncoder cuts microseconds off)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPage:
+    """
+    One page of results from KeysetPaginator
+
+    Fields:
+        object_list: the rows on this page
+        next_cursor: cursor for the following page (None on the last page)
+        previous_cursor: cursor for the page before (None on the first page)
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by a unique ordering, e.g. ("-created_at", "-id")
+
+    The last field of the ordering must be unique (normally the primary
+    key) so that rows with the same timestamp are never skipped or shown
+    twice. Ordering fields must not be NULL.
+
+    Args:
+        queryset: the rows to paginate
+        ordering: tuple of field names, "-" prefix for descending
+        page_size: number of rows per page
+    """
+
+    def __init__(self, queryset, ordering=("-created_at", "-id"),
+                 page_size=20):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+
+    def page(self, cursor=None):
+        """
+        Return the page that a cursor points at (first page if None)
+
+        Raises:
+            InvalidCursor: if the cursor is malformed
+        """
+        direction, values = "next", None
+        if cursor:
+            direction, values, ordering = decode_cursor(cursor)
+            if ordering != self.ordering or len(values) != len(ordering):
+                raise InvalidCursor(cursor)
+
+        backwards = direction == "prev"
+
+        # Walking backwards = flip the ordering, then flip the rows back
+        ordering = self.ordering
+        if backwards:
+            ordering = tuple(_flip(field) for field in ordering)
+
+        # Fetch one extra row to know whether there is another page.
+        # A tampered cursor value (e.g. not a date or a number) fails
+        # here, when the filter is built or when it is run.
+        try:
+            queryset = self.queryset.order_by(*ordering)
+            if values is not None:
+                queryset = queryset.filter(self._after(ordering, values))
+            rows = list(queryset[: self.page_size + 1])
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(
+                self._values(rows[-1]), "next", self.ordering
+            )
+        if rows and has_previous:
+            previous_cursor = encode_cursor(
+                self._values(rows[0]), "prev", self.ordering
+            )
+
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def _values(self, row):
+        """Sort values of a row, in ordering order"""
+        return [getattr(row, field.lstrip("-")) for field in self.ordering]
+
+    @staticmethod
+    def _after(ordering, values):
+        """
+        Build "row comes after these values" for a multi-column ordering
+
+        (a, b) after (x, y) means: a > x OR (a = x AND b > y)
+        """
+        condition = Q()
+        equal_so_far = Q()
+
+        for field, value in zip(ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal_so_far & Q(**{f"{name}__{lookup}": value})
+            equal_so_far &= Q(**{name: value})
+
+        return condition
+
+
+def _flip(field):
+    """Reverse the direction of one ordering field"""
+    return field[1:] if field.startswith("-") else f"-{field}"
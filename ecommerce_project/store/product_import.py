@@ -0,0 +1,328 @@
+"""
+Product data checks and bulk product import
+
+clean_product() holds the rules for a product's fields. The add/edit
+product pages and the importer all use it.
+
+Importing reads a CSV or JSON Lines file one row at a time and writes
+products in batches, so memory use stays the same however big the file
+is. Products are matched on their SKU within the store: a known SKU
+updates that product, a new one creates it (one bulk_create upsert per
+batch). Each batch is its own transaction and returns a BatchReport
+listing the rows that were rejected and why.
+
+File layout (CSV header or JSON keys): sku, name, description, price,
+stock. Other columns are ignored.
+"""
+
+import csv
+import io
+import json
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import facets, inventory, page_cache, search
+from .cart import prices_changed
+from .conditional import catalog_changed
+from .models import Product
+
+COLUMNS = ("sku", "name", "description", "price", "stock")
+FORMATS = ("csv", "jsonl")
+
+NAME_MAX_LENGTH = Product._meta.get_field("name").max_length
+SKU_MAX_LENGTH = Product._meta.get_field("sku").max_length
+# DecimalField(max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal("99999999.99")
+# PositiveIntegerField
+MAX_STOCK = 2147483647
+
+
+class ProductDataError(ValueError):
+    """A product field is missing or not valid (message is for people)"""
+
+
+class ImportFormatError(ValueError):
+    """The file can't be read at all (wrong format, missing columns)"""
+
+
+# ----- Field rules -----
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else value
+
+
+def clean_product(data, sku_required=False):
+    """
+    Check a product's fields and turn them into model values
+
+    Args:
+        data: dict with name, description, price, stock and (optional)
+        sku - strings from a form or file, or numbers from JSON
+        sku_required: True to reject rows without a SKU (imports)
+
+    Returns:
+        {"name", "description", "price" (Decimal), "stock" (int),
+         "sku" (str, or None if there is none)}
+
+    Raises:
+        ProductDataError: with a message to show the vendor
+    """
+    name = _text(data.get("name"))
+    description = _text(data.get("description"))
+    price = _text(data.get("price"))
+    stock = _text(data.get("stock"))
+    sku = _text(data.get("sku")) or None
+
+    if name in (None, "") or description in (None, "") \
+            or price in (None, "") or stock in (None, ""):
+        raise ProductDataError("All fields are required")
+    if sku_required and sku is None:
+        raise ProductDataError("SKU is required")
+    if not isinstance(name, str) or len(name) > NAME_MAX_LENGTH:
+        raise ProductDataError(
+            f"Name must be text of at most {NAME_MAX_LENGTH} characters"
+        )
+    if sku is not None and len(str(sku)) > SKU_MAX_LENGTH:
+        raise ProductDataError(
+            f"SKU can be at most {SKU_MAX_LENGTH} characters"
+        )
+
+    # Price: a positive amount in Rand, rounded to cents
+    try:
+        price = Decimal(str(price))
+    except InvalidOperation:
+        raise ProductDataError("Price must be a valid number")
+    if not price.is_finite():
+        raise ProductDataError("Price must be a valid number")
+    price = price.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    if price <= 0:
+        raise ProductDataError("Price must be greater than 0")
+    if price > MAX_PRICE:
+        raise ProductDataError(f"Price can be at most {MAX_PRICE}")
+
+    # Stock: a whole number, not negative
+    try:
+        if isinstance(stock, float) or isinstance(stock, bool):
+            raise ValueError
+        stock = int(stock)
+    except ValueError:
+        raise ProductDataError("Stock must be a valid number")
+    if stock < 0:
+        raise ProductDataError("Stock cannot be negative")
+    if stock > MAX_STOCK:
+        raise ProductDataError(f"Stock can be at most {MAX_STOCK}")
+
+    return {
+        "name": name,
+        "description": str(description),
+        "price": price,
+        "stock": stock,
+        "sku": None if sku is None else str(sku),
+    }
+
+
+# ----- Reading files -----
+
+
+def read_rows(file, file_format):
+    """
+    Read a CSV or JSON Lines file one row at a time
+
+    Args:
+        file: binary file object (an upload or an open file)
+        file_format: "csv" or "jsonl"
+
+    Yields:
+        (line number, dict of fields), or (line number, ProductDataError)
+        for a line that can't be read
+
+    Raises:
+        ImportFormatError: unknown format, missing CSV columns or a file
+        that isn't UTF-8 text
+    """
+    if file_format not in FORMATS:
+        raise ImportFormatError(f"Unknown file format: {file_format}")
+
+    # utf-8-sig: skip the byte order mark spreadsheet programs add
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if file_format == "csv":
+            yield from _read_csv(text)
+        else:
+            yield from _read_jsonl(text)
+    except UnicodeDecodeError:
+        raise ImportFormatError("The file must be UTF-8 text")
+    finally:
+        # Don't let the wrapper close the caller's file
+        text.detach()
+
+
+def _read_csv(text):
+    reader = csv.DictReader(text)
+    header = [name.strip().lower() for name in reader.fieldnames or []]
+    missing = [column for column in COLUMNS if column not in header]
+    if missing:
+        raise ImportFormatError(
+            "The CSV header is missing: " + ", ".join(missing)
+        )
+    reader.fieldnames = header
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _read_jsonl(text):
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, ProductDataError("Not valid JSON")
+            continue
+        if not isinstance(row, dict):
+            yield number, ProductDataError("Each line must be a JSON object")
+            continue
+        yield number, row
+
+
+# ----- Importing -----
+
+
+class BatchReport:
+    """
+    What happened to one batch of rows
+
+    Fields:
+        number: batch number, from 1
+        rows: rows read (including rejected ones)
+        created: new products
+        updated: existing products changed
+        errors: list of (line number, sku, message) for rejected rows
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+
+def import_products(store, rows, batch_size=None):
+    """
+    Create or update a store's products from rows, a batch at a time
+
+    Args:
+        store: the Store the products belong to
+        rows: (line number, fields) pairs, e.g. from read_rows()
+        batch_size: rows per batch (default STORE_IMPORT_BATCH_SIZE)
+
+    Yields:
+        a BatchReport after each batch is saved
+    """
+    batch_size = batch_size or settings.STORE_IMPORT_BATCH_SIZE
+    report = BatchReport(1)
+    batch = {}
+
+    for line, data in rows:
+        report.rows += 1
+        if isinstance(data, ProductDataError):
+            report.errors.append((line, "", str(data)))
+        else:
+            try:
+                fields = clean_product(data, sku_required=True)
+            except ProductDataError as error:
+                report.errors.append((line, _text(data.get("sku")) or "",
+                                      str(error)))
+            else:
+                sku = fields["sku"]
+                if sku in batch:
+                    # One upsert can't change a row twice - keep the last
+                    report.errors.append(
+                        (batch[sku][0], sku,
+                         f"SKU appears again on line {line}, which was "
+                         f"used instead")
+                    )
+                batch[sku] = (line, fields)
+
+        if report.rows >= batch_size:
+            _save_batch(store, batch, report)
+            yield report
+            report = BatchReport(report.number + 1)
+            batch = {}
+
+    if report.rows:
+        _save_batch(store, batch, report)
+        yield report
+
+
+def _save_batch(store, batch, report):
+    """Upsert one batch of cleaned rows and update what depends on them"""
+    if not batch:
+        return
+
+    skus = list(batch)
+    with transaction.atomic():
+        # Lock the products being replaced: their old price and stock
+        # come out of the facet counts and their version moves on
+        existing = {
+            sku: (price, stock, version)
+            for sku, price, stock, version in (
+                Product.objects.select_for_update()
+                .filter(store=store, sku__in=skus)
+                .values_list("sku", "price", "stock", "version")
+            )
+        }
+
+        products = []
+        for sku, (line, fields) in batch.items():
+            old = existing.get(sku)
+            products.append(Product(
+                store=store,
+                version=old[2] + 1 if old else 1,
+                **fields,
+            ))
+
+        options = {
+            "update_conflicts": True,
+            "update_fields": ["name", "description", "price", "stock",
+                              "updated_at", "version"],
+        }
+        # MySQL/MariaDB upsert on any unique key and don't take the
+        # conflict columns
+        if connection.features.supports_update_conflicts_with_target:
+            options["unique_fields"] = ["store", "sku"]
+        Product.objects.bulk_create(products, **options)
+
+        # bulk_create() skips the signal handlers - do their work (facets,
+        # stock ledger, search index, cached pages) for the whole batch
+        facets.adjust(
+            [key for price, stock, version in existing.values()
+             for key in facets.product_keys(store.pk, price, stock)],
+            [key for product in products
+             for key in facets.product_keys(store.pk, product.price,
+                                            product.stock)],
+        )
+        saved = list(
+            Product.objects.filter(store=store, sku__in=skus)
+            .select_related("store")
+        )
+        inventory.record_imported_stock([
+            (product.pk,
+             existing[product.sku][1] if product.sku in existing else None,
+             product.stock)
+            for product in saved
+        ])
+        search.index_products(saved)
+        page_cache.forget_products([product.pk for product in saved])
+        catalog_changed()
+        if any(batch[sku][1]["price"] != price
+               for sku, (price, stock, version) in existing.items()):
+            # Cart totals in page headers use the old prices
+            prices_changed()
+
+    report.updated = len(existing)
+    report.created = len(batch) - len(existing)
@@ -0,0 +1,134 @@
+"""
+Product rating totals
+
+Each Product carries its review count, star total, histogram and average
+(see the Product model), so listings, sorting and filtering by rating never
+aggregate the Review table. The signal handlers in store.signals call
+record() whenever a review is saved or deleted.
+
+If the totals ever drift (e.g. reviews changed with update() or raw SQL),
+rebuild them with: python manage.py rebuild_ratings
+"""
+
+from django.db import transaction
+from django.db.models import (
+    Avg,
+    Count,
+    F,
+    FloatField,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+)
+from django.db.models.functions import Coalesce
+
+from . import facets
+from .models import Product, Review
+
+STARS = range(1, 6)
+
+
+def average(rating_sum, rating_count):
+    """Average rating, 0 if there are no reviews"""
+    return rating_sum / rating_count if rating_count else 0
+
+
+def record(product_id, removed=None, added=None):
+    """
+    Update a product's rating totals for one review change
+
+    The product page shows the review itself, so the product is marked as
+    changed even when the rating stays the same (only the text edited).
+
+    Args:
+        product_id: the reviewed product
+        removed: the old star rating (review edited or deleted), or None
+        added: the new star rating (review created or edited), or None
+    """
+    if removed == added:
+        Product.objects.filter(pk=product_id).touch_update()
+        return
+
+    with transaction.atomic():
+        # Lock the product so the average and facets are worked out from
+        # totals nobody else is changing at the same time
+        current = (
+            Product.objects.select_for_update()
+            .filter(pk=product_id)
+            .values_list("rating_sum", "rating_count")
+            .first()
+        )
+        if current is None:
+            # Product is being deleted along with its reviews
+            return
+        rating_sum, rating_count = current
+
+        changes = {}
+        new_sum, new_count = rating_sum, rating_count
+        if removed is not None:
+            changes[f"rating_{removed}"] = F(f"rating_{removed}") - 1
+            new_sum -= removed
+            new_count -= 1
+        if added is not None:
+            changes[f"rating_{added}"] = F(f"rating_{added}") + 1
+            new_sum += added
+            new_count += 1
+
+        Product.objects.filter(pk=product_id).touch_update(
+            rating_sum=F("rating_sum") + (new_sum - rating_sum),
+            rating_count=F("rating_count") + (new_count - rating_count),
+            rating_average=average(new_sum, new_count),
+            **changes,
+        )
+
+        old_key = facets.rating_key(average(rating_sum, rating_count),
+                                    rating_count)
+        new_key = facets.rating_key(average(new_sum, new_count), new_count)
+        if old_key != new_key:
+            facets.adjust({old_key}, {new_key})
+
+
+def _from_reviews(aggregate, output_field=None):
+    """
+    A product's reviews reduced to one value (0 if it has none), as a
+    subquery for Product updates
+    """
+    reviews = (
+        Review.objects.filter(product=OuterRef("pk"))
+        .values("product")
+        .annotate(value=aggregate)
+        .values("value")
+    )
+    return Coalesce(Subquery(reviews), 0,
+                    output_field=output_field or IntegerField())
+
+
+def rebuild(batch_size=1000):
+    """
+    Work out every product's rating totals again from its reviews
+
+    Each batch is one UPDATE of batch_size consecutive product ids, with
+    the totals worked out by subqueries over the reviews, so nothing is
+    read into Python and a batch only locks its own products.
+
+    Returns:
+        number of products with reviews
+    """
+    totals = {
+        "rating_count": _from_reviews(Count("id")),
+        "rating_sum": _from_reviews(Sum("rating")),
+        "rating_average": _from_reviews(Avg("rating"), FloatField()),
+        **{f"rating_{n}": _from_reviews(Count("id", filter=Q(rating=n)))
+           for n in STARS},
+    }
+
+    last_pk = Product.objects.aggregate(last=Max("pk"))["last"] or 0
+    for start in range(0, last_pk, batch_size):
+        Product.objects.filter(
+            pk__gt=start, pk__lte=start + batch_size
+        ).touch_update(**totals)
+
+    return Review.objects.values("product").distinct().count()
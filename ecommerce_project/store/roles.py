@@ -0,0 +1,68 @@
+"""
+User roles (Vendor or Buyer)
+
+A user's role is the name of their Vendors/Buyers group. Looking it up
+costs a query on the groups table, so it is cached per user and dropped by
+the signal handlers in store/signals.py whenever group membership changes.
+
+RoleMiddleware puts the role on every request as request.role, so views
+(through store.decorators) and templates check it without any query.
+"""
+
+from django.core.cache import cache
+
+VENDOR = "Vendors"
+BUYER = "Buyers"
+ROLES = (VENDOR, BUYER)
+
+# Stored for users in neither group (the cache can't tell None from a miss)
+NO_ROLE = ""
+
+
+def role_key(user_id):
+    return f"store:role:{user_id}"
+
+
+def get_role(user):
+    """
+    Return the user's role: VENDOR, BUYER or None (anonymous or no group)
+
+    Read once per user object, then from the cache; only a cache miss
+    queries the database.
+    """
+    if not user.is_authenticated:
+        return None
+
+    if not hasattr(user, "_store_role"):
+        role = cache.get(role_key(user.pk))
+        if role is None:
+            role = (
+                user.groups.filter(name__in=ROLES)
+                .order_by("name")
+                .values_list("name", flat=True)
+                .first()
+            ) or NO_ROLE
+            cache.set(role_key(user.pk), role)
+        user._store_role = role
+
+    return user._store_role or None
+
+
+def forget_roles(user_ids):
+    """Drop the cached role of each user (their groups changed)"""
+    cache.delete_many([role_key(user_id) for user_id in user_ids])
+
+
+class RoleMiddleware:
+    """
+    Set request.role for every request
+
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role = get_role(request.user)
+        return self.get_response(request)
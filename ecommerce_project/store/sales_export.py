@@ -0,0 +1,130 @@
+"""
+Vendor sales export: one row per order line of the vendor's products
+
+Rows are read in primary key order, chunk_size at a time, and written out
+as they are read (CSV or JSON Lines). The export view streams them with a
+StreamingHttpResponse and the export_sales command writes them to a file,
+so memory use stays the same for any number of order lines and the first
+rows go out straight away.
+
+Chunks are keyset pages (WHERE id > last id ORDER BY id LIMIT n) rather
+than QuerySet.iterator(): the MySQL drivers read a whole result into
+memory before returning the first row, and a keyset page is a short
+query on every database.
+"""
+
+import csv
+import json
+from datetime import datetime, time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import OrderItem
+
+COLUMNS = (
+    "order_id", "order_date", "store_id", "store", "product_id", "sku",
+    "product", "quantity", "unit_price", "line_total", "buyer",
+)
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+def start_of_day(day):
+    """Midnight at the start of a day, in the site's time zone"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def sales_lines(vendor, store_id=None, start=None, end=None):
+    """
+    The vendor's order lines, as a values_list of COLUMNS (less
+    line_total)
+
+    Args:
+        vendor: the vendor (User)
+        store_id: only this store's lines
+        start, end: only orders placed at or after start and before end
+        (aware datetimes)
+    """
+    lines = OrderItem.objects.filter(product__store__owner=vendor)
+    if store_id is not None:
+        lines = lines.filter(product__store_id=store_id)
+    if start is not None:
+        lines = lines.filter(order__order_date__gte=start)
+    if end is not None:
+        lines = lines.filter(order__order_date__lt=end)
+    return lines.values_list(
+        "id",
+        "order_id",
+        "order__order_date",
+        "product__store_id",
+        "product__store__name",
+        "product_id",
+        "product__sku",
+        "product__name",
+        "quantity",
+        "price",
+        "order__buyer__username",
+    )
+
+
+def iter_rows(lines, chunk_size=None):
+    """
+    Yield a dict per order line, reading chunk_size lines per query
+
+    Args:
+        lines: a queryset from sales_lines()
+        chunk_size: lines per query (default STORE_EXPORT_CHUNK_SIZE)
+    """
+    chunk_size = chunk_size or settings.STORE_EXPORT_CHUNK_SIZE
+    last_id = 0
+    while True:
+        chunk = list(lines.filter(id__gt=last_id).order_by("id")[:chunk_size])
+        for (line_id, order_id, order_date, store_id, store, product_id,
+             sku, product, quantity, price, buyer) in chunk:
+            yield {
+                "order_id": order_id,
+                "order_date": order_date.isoformat(),
+                "store_id": store_id,
+                "store": store,
+                "product_id": product_id,
+                "sku": sku or "",
+                "product": product,
+                "quantity": quantity,
+                "unit_price": str(price),
+                "line_total": str(price * quantity),
+                "buyer": buyer,
+            }
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+class _Echo:
+    """File-like object whose write() hands back what was written"""
+
+    def write(self, value):
+        return value
+
+
+def render(rows, file_format):
+    """
+    Turn rows from iter_rows() into text, one line at a time
+
+    Args:
+        rows: iterable of row dicts
+        file_format: "csv" (with a header line) or "jsonl"
+
+    Yields:
+        str lines, ready to send or write
+    """
+    if file_format == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow([row[column] for column in COLUMNS])
+    else:
+        for row in rows:
+            yield json.dumps(row) + "\n"
@@ -0,0 +1,323 @@
+"""
+Daily sales totals for the vendor dashboard
+
+Each checkout adds its lines to three small tables: StoreDailySales (one
+row per store per day), ProductDailySales (one row per product per day)
+and VendorDailySales (the vendor's order count per day - an order from
+two of a vendor's stores is one order for the vendor). The dashboard only
+reads those, so it costs the same however many orders there are - a 30
+day window is at most 30 rows per store plus one row per product sold
+per day.
+
+Days are calendar days in TIME_ZONE. The tables can be worked out again
+from the order history with: python manage.py rebuild_sales_rollups
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    OrderItem,
+    ProductDailySales,
+    Store,
+    StoreDailySales,
+    VendorDailySales,
+)
+from .sales_export import start_of_day
+
+# Dashboard window -> (label, number of days counting today)
+WINDOWS = {
+    "day": ("Today", 1),
+    "week": ("Last 7 days", 7),
+    "month": ("Last 30 days", 30),
+}
+DEFAULT_WINDOW = "week"
+
+# Products listed under top sellers
+TOP_SELLERS = 10
+
+
+# ----- Keeping the totals up to date -----
+
+
+def _add(model, keys, **amounts):
+    """Add amounts to the row for keys, creating it if it's the first"""
+    # F() makes the database do the maths, so two checkouts adding to the
+    # same row at once can't overwrite each other
+    changes = {name: F(name) + amount for name, amount in amounts.items()}
+    if not model.objects.filter(**keys).update(**changes):
+        model.objects.get_or_create(**keys)
+        model.objects.filter(**keys).update(**changes)
+
+
+def record_order(order, items):
+    """
+    Add a new order to the daily totals (call it inside the checkout's
+    transaction, so the totals and the order are saved together)
+
+    Args:
+        order: the new Order
+        items: its OrderItems, with product loaded
+    """
+    day = timezone.localdate(order.order_date)
+
+    stores = {}
+    for item in items:
+        line_total = item.price * item.quantity
+        _add(ProductDailySales,
+             {"product_id": item.product_id, "day": day,
+              "store_id": item.product.store_id},
+             units=item.quantity, revenue=line_total)
+
+        units, revenue = stores.get(item.product.store_id, (0, 0))
+        stores[item.product.store_id] = (units + item.quantity,
+                                         revenue + line_total)
+
+    for store_id, (units, revenue) in sorted(stores.items()):
+        _add(StoreDailySales, {"store_id": store_id, "day": day},
+             orders=1, units=units, revenue=revenue)
+
+    # One order per vendor, however many of their stores it bought from
+    vendors = {
+        owner_id for owner_id in Store.objects.filter(pk__in=stores)
+        .values_list("owner_id", flat=True)
+    }
+    for vendor_id in sorted(vendors):
+        _add(VendorDailySales, {"vendor_id": vendor_id, "day": day},
+             orders=1)
+
+
+def forget_product(product):
+    """
+    Take a product that is being deleted out of its store's units and
+    revenue (its order lines are deleted with it, so a rebuild wouldn't
+    count them) - call it before the delete
+
+    Returns:
+        the days it sold on: pass them to recount_orders() once the
+        product and its order lines are gone
+    """
+    days = []
+    for day, units, revenue in ProductDailySales.objects.filter(
+        product=product
+    ).values_list("day", "units", "revenue"):
+        StoreDailySales.objects.filter(store_id=product.store_id,
+                                       day=day).update(
+            units=F("units") - units, revenue=F("revenue") - revenue
+        )
+        days.append(day)
+    return days
+
+
+def recount_orders(store_id, days):
+    """
+    Count a store's and its vendor's orders on some days again from the
+    order lines left
+
+    An order that bought a deleted product may still have other lines in
+    the store (or the vendor's other stores), so the counts can't just be
+    taken down by one. Counting after the delete is also right when
+    several products of one order are deleted together.
+    """
+    if not days:
+        return
+    vendor_id = Store.objects.filter(pk=store_id).values_list(
+        "owner_id", flat=True
+    ).first()
+    # Half-open ranges on order_date itself (not a function of it), so
+    # the database can use its indexes; the day is only worked out for
+    # the grouping
+    in_days = Q()
+    for day in days:
+        in_days |= Q(
+            order__order_date__gte=start_of_day(day),
+            order__order_date__lt=start_of_day(day + timedelta(days=1)),
+        )
+    lines = (
+        OrderItem.objects.filter(in_days)
+        .annotate(day=TruncDate("order__order_date"))
+        .order_by()
+    )
+
+    totals = [(StoreDailySales, {"store_id": store_id},
+               {"product__store_id": store_id})]
+    if vendor_id is not None:
+        totals.append((VendorDailySales, {"vendor_id": vendor_id},
+                       {"product__store__owner_id": vendor_id}))
+
+    for model, keys, line_filter in totals:
+        counts = dict(
+            lines.filter(**line_filter).values_list("day")
+            .annotate(orders=Count("order_id", distinct=True))
+        )
+        for day in days:
+            model.objects.filter(day=day, **keys).update(
+                orders=counts.get(day, 0)
+            )
+        # A day with no orders left has nothing left to show (and a
+        # rebuild wouldn't write it)
+        model.objects.filter(day__in=days, orders=0, **keys).delete()
+
+
+def rebuild(batch_size=1000):
+    """
+    Work out every daily total again from the order lines (the only place
+    that reads the whole order history)
+
+    Returns:
+        (store rows, product rows, vendor rows) written
+    """
+    lines = OrderItem.objects.annotate(
+        day=TruncDate("order__order_date")
+    ).order_by()
+    revenue = Sum(F("price") * F("quantity"),
+                  output_field=DecimalField(max_digits=14, decimal_places=2))
+
+    product_totals = lines.values(
+        "product_id", "product__store_id", "day"
+    ).annotate(units=Sum("quantity"), revenue=revenue)
+    store_totals = lines.values("product__store_id", "day").annotate(
+        orders=Count("order_id", distinct=True),
+        units=Sum("quantity"),
+        revenue=revenue,
+    )
+    vendor_totals = lines.values("product__store__owner_id", "day").annotate(
+        orders=Count("order_id", distinct=True)
+    )
+
+    with transaction.atomic():
+        ProductDailySales.objects.all().delete()
+        StoreDailySales.objects.all().delete()
+        VendorDailySales.objects.all().delete()
+
+        product_rows = _write(ProductDailySales, (
+            ProductDailySales(
+                product_id=row["product_id"],
+                store_id=row["product__store_id"],
+                day=row["day"],
+                units=row["units"],
+                revenue=row["revenue"],
+            )
+            for row in product_totals.iterator(chunk_size=batch_size)
+        ), batch_size)
+        store_rows = _write(StoreDailySales, (
+            StoreDailySales(
+                store_id=row["product__store_id"],
+                day=row["day"],
+                orders=row["orders"],
+                units=row["units"],
+                revenue=row["revenue"],
+            )
+            for row in store_totals.iterator(chunk_size=batch_size)
+        ), batch_size)
+        vendor_rows = _write(VendorDailySales, (
+            VendorDailySales(
+                vendor_id=row["product__store__owner_id"],
+                day=row["day"],
+                orders=row["orders"],
+            )
+            for row in vendor_totals.iterator(chunk_size=batch_size)
+        ), batch_size)
+
+    return store_rows, product_rows, vendor_rows
+
+
+def _write(model, rows, batch_size):
+    """bulk_create rows batch_size at a time, return how many"""
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+# ----- Dashboard -----
+
+
+def window_start(window, today=None):
+    """First day (inclusive) of a WINDOWS key, counting today"""
+    today = today or timezone.localdate()
+    return today - timedelta(days=WINDOWS[window][1] - 1)
+
+
+def vendor_summary(vendor, window=DEFAULT_WINDOW, today=None):
+    """
+    A vendor's sales over a dashboard window, from the daily totals
+
+    Args:
+        vendor: the vendor (User)
+        window: a WINDOWS key
+        today: last day of the window (default: today in TIME_ZONE)
+
+    Returns:
+        {
+            "orders", "units", "revenue": totals over all stores,
+            "stores": [{"store_id", "name", "orders", "units",
+                        "revenue"}], most revenue first,
+            "top_products": [{"product_id", "name", "store_name",
+                              "units", "revenue"}], up to TOP_SELLERS,
+            "days": [{"day", "revenue", "units", "percent"}] for every
+            day in the window, oldest first (percent of the best day)
+        }
+    """
+    today = today or timezone.localdate()
+    start = window_start(window, today)
+
+    store_days = StoreDailySales.objects.filter(
+        store__owner=vendor, day__gte=start, day__lte=today
+    )
+    stores = list(
+        store_days.values("store_id", name=F("store__name"))
+        .annotate(orders=Sum("orders"), units=Sum("units"),
+                  revenue=Sum("revenue"))
+        .order_by("-revenue", "name")
+    )
+    by_day = {
+        row["day"]: row
+        for row in store_days.values("day")
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+        .order_by()
+    }
+    top_products = list(
+        ProductDailySales.objects.filter(
+            store__owner=vendor, day__gte=start, day__lte=today
+        )
+        .values("product_id", name=F("product__name"),
+                store_name=F("store__name"))
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+        .order_by("-revenue", "-units", "product_id")[:TOP_SELLERS]
+    )
+    # Not the stores' orders added up: one order can be in two stores
+    orders = VendorDailySales.objects.filter(
+        vendor=vendor, day__gte=start, day__lte=today
+    ).aggregate(total=Sum("orders"))["total"] or 0
+
+    days = []
+    for offset in range(WINDOWS[window][1]):
+        day = start + timedelta(days=offset)
+        row = by_day.get(day, {"units": 0, "revenue": 0})
+        days.append({"day": day, "units": row["units"],
+                     "revenue": row["revenue"]})
+    best = max((day["revenue"] for day in days), default=0)
+    for day in days:
+        day["percent"] = int(day["revenue"] * 100 / best) if best else 0
+
+    return {
+        "orders": orders,
+        "units": sum(store["units"] for store in stores),
+        "revenue": sum((store["revenue"] for store in stores), 0),
+        "stores": stores,
+        "top_products": top_products,
+        "days": days,
+    }
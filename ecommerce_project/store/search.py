@@ -0,0 +1,208 @@
+"""
+Product search
+
+Search works on a local inverted index (ProductSearchTerm): every word of a
+product's name, description and store name is stored in its own row with a
+weight. Looking a word up is an index seek on the term column, and a prefix
+("lapt" -> "laptop") is an index range scan (LIKE 'lapt%'), so searches
+stay fast without a LIKE '%...%' scan over the Product table.
+
+The index is kept current by the signal handlers in store.signals, and can
+be rebuilt from scratch with: python manage.py rebuild_search_index
+"""
+
+import re
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Max, Q, When
+
+from .models import Product, ProductSearchTerm
+
+# How much a word counts depending on where it appears
+NAME_WEIGHT = 10
+STORE_WEIGHT = 4
+DESCRIPTION_WEIGHT = 1
+
+# A word typed in full scores more than a word that only starts with it
+EXACT_MATCH_BOOST = 2
+
+# Only look at this many words of a query
+MAX_QUERY_TERMS = 8
+
+# Longest word kept in the index (matches ProductSearchTerm.term)
+MAX_TERM_LENGTH = 40
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in",
+    "is", "it", "of", "on", "or", "the", "to", "with",
+}
+
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase search words
+
+    Single characters and common stop words are dropped.
+    """
+    words = []
+    for word in WORD_RE.findall((text or "").lower()):
+        if len(word) < 2 or word in STOP_WORDS:
+            continue
+        words.append(word[:MAX_TERM_LENGTH])
+    return words
+
+
+def build_terms(product):
+    """
+    Work out the index rows for one product
+
+    Returns:
+        dict of {term: weight}
+    """
+    terms = {}
+    fields = [
+        (product.name, NAME_WEIGHT),
+        (product.store.name, STORE_WEIGHT),
+        (product.description, DESCRIPTION_WEIGHT),
+    ]
+    for text, weight in fields:
+        for word in tokenize(text):
+            terms[word] = terms.get(word, 0) + weight
+    return terms
+
+
+def index_products(products, batch_size=1000):
+    """
+    (Re)build the index rows for some products
+
+    Args:
+        products: iterable of Product objects with their store loaded
+        (use select_related("store") when passing a queryset)
+        batch_size: products handled per delete/insert round trip
+    """
+    batch = []
+    for product in products:
+        batch.append(product)
+        if len(batch) >= batch_size:
+            _index_batch(batch)
+            batch = []
+
+    if batch:
+        _index_batch(batch)
+
+
+def _index_batch(products):
+    """Replace the index rows of a list of products"""
+    # Replace the old rows instead of diffing them - simpler, and a
+    # product only has a few dozen words
+    ProductSearchTerm.objects.filter(product__in=products).delete()
+
+    rows = []
+    for product in products:
+        for term, weight in build_terms(product).items():
+            rows.append(
+                ProductSearchTerm(product=product, term=term, weight=weight)
+            )
+
+    ProductSearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+
+def index_product(product):
+    """(Re)build the index rows for a single product"""
+    index_products([product])
+
+
+def search_products(query, min_price=None, max_price=None, in_stock=False,
+                    store_id=None):
+    """
+    Find products matching every word of the query, best matches first
+
+    Each query word matches index words that start with it, so partial
+    words work. A product's score is the sum, over the query words, of its
+    best matching index word.
+
+    Args:
+        query: text typed by the buyer
+        min_price / max_price: optional Decimal price range
+        in_stock: only products with stock > 0
+        store_id: only products from this store
+
+    Returns:
+        list of (product_id, score) tuples, highest score first (at most
+        STORE_SEARCH_MAX_RESULTS)
+    """
+    words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not words:
+        return []
+
+    # Filters are applied in the same query as the term lookup
+    filters = {}
+    if min_price is not None:
+        filters["product__price__gte"] = min_price
+    if max_price is not None:
+        filters["product__price__lte"] = max_price
+    if in_stock:
+        filters["product__stock__gt"] = 0
+    if store_id is not None:
+        filters["product__store_id"] = store_id
+
+    # One grouped query over the index rows matching any of the words:
+    # per product, the best weight for each word (NULL if the word has no
+    # match). Products missing a word are dropped by the HAVING, and only
+    # the best scoring STORE_SEARCH_MAX_RESULTS are read.
+    matches = Q()
+    best = {}
+    for number, word in enumerate(words):
+        # Terms are stored lowercase, and istartswith becomes a plain
+        # LIKE 'word%' on MySQL, which can use the term index
+        matches |= Q(term__istartswith=word)
+        best[f"word_{number}"] = Max(Case(
+            When(term=word, then=F("weight") * EXACT_MATCH_BOOST),
+            When(term__istartswith=word, then=F("weight")),
+            output_field=IntegerField(),
+        ))
+
+    score = None
+    for name in best:
+        score = F(name) if score is None else score + F(name)
+
+    rows = (
+        ProductSearchTerm.objects.filter(matches, **filters)
+        .values("product_id")
+        .annotate(**best)
+        .filter(**{f"{name}__isnull": False for name in best})
+        .annotate(score=score)
+        # Highest score first, newest product first on a tie
+        .order_by("-score", "-product_id")
+        .values_list("product_id", "score")
+    )
+    return list(rows[:settings.STORE_SEARCH_MAX_RESULTS])
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Rebuild the whole search index, batch_size products at a time
+
+    Returns:
+        number of products indexed
+    """
+    total = 0
+    last_pk = 0
+
+    # Walk the table by primary key so each batch is a cheap range scan
+    while True:
+        batch = list(
+            Product.objects.select_related("store")
+            .filter(pk__gt=last_pk)
+            .order_by("pk")[:batch_size]
+        )
+        if not batch:
+            break
+
+        _index_batch(batch)
+        total += len(batch)
+        last_pk = batch[-1].pk
+
+    return total
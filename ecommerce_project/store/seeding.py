@@ -0,0 +1,371 @@
+"""
+Fast made-up data for load tests and scaling work (see the seed_store
+command)
+
+Rows are written with bulk_create in chunks, each chunk in its own
+transaction, so a big run doesn't hold one huge transaction open and
+a failed run keeps the chunks already written. Every row gets an
+explicit primary key, worked out before anything is written, so chunks
+don't depend on each other: they can run in any order, in several
+processes at once, and foreign keys are known without reading anything
+back.
+
+The data is deterministic: each chunk has its own random generator,
+seeded from the seed, the table and the chunk number, so the same
+options always produce the same rows however many processes write them.
+
+bulk_create() skips the model signal handlers, so rebuild() builds
+what they would have kept up to date (search index, rating totals,
+facet counts) once at the end. Products are written with their opening
+stock movement; seeded orders are history and don't take stock.
+"""
+
+import multiprocessing
+import random
+from decimal import Decimal
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+
+from . import facets, ratings, sales_rollups, search
+from .conditional import bump_catalog_version
+from .models import (
+    Order, OrderItem, Product, Review, StockMovement, Store,
+)
+from .roles import BUYER, VENDOR
+
+# Stores per vendor account
+STORES_PER_VENDOR = 10
+
+PRODUCT_WORDS = (
+    "Classic", "Organic", "Wireless", "Handmade", "Compact", "Deluxe",
+    "Vintage", "Smart", "Portable", "Premium", "Eco", "Mini",
+)
+PRODUCT_NOUNS = (
+    "Lamp", "Backpack", "Speaker", "Mug", "Notebook", "Jacket", "Kettle",
+    "Headphones", "Chair", "Blender", "Watch", "Candle",
+)
+REVIEW_TEXTS = (
+    "Terrible, broke after a day.",
+    "Not great, would not buy again.",
+    "Does the job.",
+    "Good value, happy with it.",
+    "Excellent, exactly as described!",
+)
+
+
+class Plan:
+    """
+    What to create and the first primary key of each table
+
+    Fields:
+        stores, products, reviews, buyers, orders: number of rows (at most
+        one review per buyer and product)
+        items_per_order: order items per order
+        reviews_per_buyer: reviews written by each buyer (the last one
+        may write fewer)
+        seed: random seed
+        prefix: start of every username (e.g. "seed" -> "seed-buyer-12")
+        stock: stock of every product, or None for random stock
+        chunk_size: rows per chunk (one transaction each)
+        first: {model name: first primary key}
+    """
+
+    def __init__(self, stores, products, reviews, buyers, orders,
+                 items_per_order=3, seed=1, prefix="seed", stock=None,
+                 chunk_size=10000):
+        self.stores = stores
+        self.products = products
+        self.reviews = min(reviews, buyers * products)
+        self.buyers = buyers
+        self.orders = orders
+        self.items_per_order = min(items_per_order, products)
+        self.reviews_per_buyer = -(-self.reviews // buyers) if buyers else 0
+        self.vendors = -(-stores // STORES_PER_VENDOR)
+        self.seed = seed
+        self.prefix = prefix
+        self.stock = stock
+        self.chunk_size = chunk_size
+        self.first = {}
+        self.password = None
+        self.groups = {}
+
+    def allocate(self):
+        """Find the first free primary key of every table"""
+        self.first = {
+            model.__name__: (model.objects.aggregate(top=Max("pk"))["top"]
+                             or 0) + 1
+            for model in (User, Store, Product, Review, Order, OrderItem)
+        }
+        # Logins use a reset password; one hash for everyone
+        self.password = make_password(None)
+        self.groups = {
+            name: Group.objects.get_or_create(name=name)[0].pk
+            for name in (VENDOR, BUYER)
+        }
+
+    def chunks(self, table, count):
+        """(table, chunk number, first index, rows) for count rows"""
+        return [
+            (table, number, start, min(self.chunk_size, count - start))
+            for number, start in enumerate(range(0, count, self.chunk_size))
+        ]
+
+    # Primary keys by row number (0 based)
+
+    def vendor_pk(self, index):
+        return self.first["User"] + index
+
+    def buyer_pk(self, index):
+        return self.first["User"] + self.vendors + index
+
+    def store_pk(self, index):
+        return self.first["Store"] + index
+
+    def product_pk(self, index):
+        return self.first["Product"] + index
+
+    def price(self, index):
+        """A product's price - the same wherever it is needed"""
+        cents = (index * 7919 + self.seed * 104729) % 99900 + 100
+        return Decimal(cents) / 100
+
+
+# ----- Rows for one chunk -----
+
+
+def _users(plan, rng, start, count):
+    users, memberships = [], []
+    Membership = User.groups.through
+    for index in range(start, start + count):
+        if index < plan.vendors:
+            username = f"{plan.prefix}-vendor-{plan.vendor_pk(index)}"
+            group = plan.groups[VENDOR]
+        else:
+            buyer = index - plan.vendors
+            username = f"{plan.prefix}-buyer-{plan.buyer_pk(buyer)}"
+            group = plan.groups[BUYER]
+        pk = plan.first["User"] + index
+        users.append(User(pk=pk, username=username,
+                          email=f"{username}@example.com",
+                          password=plan.password))
+        memberships.append(Membership(user_id=pk, group_id=group))
+    User.objects.bulk_create(users)
+    Membership.objects.bulk_create(memberships)
+
+
+def _stores(plan, rng, start, count):
+    Store.objects.bulk_create([
+        Store(
+            pk=plan.store_pk(index),
+            name=f"Store {plan.store_pk(index)}",
+            description="A store made up by seed_store",
+            owner_id=plan.vendor_pk(index // STORES_PER_VENDOR),
+        )
+        for index in range(start, start + count)
+    ])
+
+
+def _products(plan, rng, start, count):
+    products = Product.objects.bulk_create([
+        Product(
+            pk=plan.product_pk(index),
+            name=(f"{rng.choice(PRODUCT_WORDS)} "
+                  f"{rng.choice(PRODUCT_NOUNS)} {plan.product_pk(index)}"),
+            description="A product made up by seed_store",
+            price=plan.price(index),
+            stock=(plan.stock if plan.stock is not None
+                   else rng.randint(0, 200)),
+            store_id=plan.store_pk(rng.randrange(plan.stores)),
+        )
+        for index in range(start, start + count)
+    ])
+    # Start each product's stock ledger (store.inventory)
+    StockMovement.objects.bulk_create([
+        StockMovement(product_id=product.pk, kind=StockMovement.RESTOCK,
+                      quantity=product.stock, stock_after=product.stock,
+                      note="Opening stock")
+        for product in products
+        if product.stock
+    ])
+
+
+def _reviewed_products(plan, buyer):
+    """
+    The products a buyer reviews, all different
+
+    Picked with the buyer's own generator so every chunk holding some of
+    the buyer's reviews gets the same list.
+    """
+    rng = random.Random(f"{plan.seed}:reviewed:{buyer}")
+    return rng.sample(range(plan.products), plan.reviews_per_buyer)
+
+
+def _reviews(plan, rng, start, count):
+    # Reviews are numbered buyer by buyer, so a chunk only works out the
+    # product lists of the few buyers it covers
+    reviews = []
+    reviewed = {}
+    for index in range(start, start + count):
+        buyer, number = divmod(index, plan.reviews_per_buyer)
+        if buyer not in reviewed:
+            reviewed[buyer] = _reviewed_products(plan, buyer)
+        rating = rng.randint(1, 5)
+        reviews.append(Review(
+            pk=plan.first["Review"] + index,
+            content=REVIEW_TEXTS[rating - 1],
+            rating=rating,
+            product_id=plan.product_pk(reviewed[buyer][number]),
+            buyer_id=plan.buyer_pk(buyer),
+            verified=rng.random() < 0.6,
+        ))
+    Review.objects.bulk_create(reviews)
+
+
+def _orders(plan, rng, start, count):
+    orders, items = [], []
+    for index in range(start, start + count):
+        order_pk = plan.first["Order"] + index
+        total = Decimal(0)
+        products = rng.sample(range(plan.products), plan.items_per_order)
+        for number, product in enumerate(products):
+            quantity = rng.randint(1, 3)
+            price = plan.price(product)
+            total += price * quantity
+            items.append(OrderItem(
+                pk=(plan.first["OrderItem"]
+                    + index * plan.items_per_order + number),
+                order_id=order_pk,
+                product_id=plan.product_pk(product),
+                quantity=quantity,
+                price=price,
+            ))
+        orders.append(Order(pk=order_pk,
+                            buyer_id=plan.buyer_pk(rng.randrange(plan.buyers)),
+                            total_price=total))
+    Order.objects.bulk_create(orders)
+    OrderItem.objects.bulk_create(items)
+
+
+WRITERS = {
+    "users": _users,
+    "stores": _stores,
+    "products": _products,
+    "reviews": _reviews,
+    "orders": _orders,
+}
+
+
+def _write_chunk(plan, chunk):
+    table, number, start, count = chunk
+    rng = random.Random(f"{plan.seed}:{table}:{number}")
+    with transaction.atomic():
+        WRITERS[table](plan, rng, start, count)
+    return table, count
+
+
+# ----- Worker processes -----
+
+_worker_plan = None
+
+
+def _start_worker(plan):
+    global _worker_plan
+    # Fresh processes ("spawn") need Django set up; forked ones must not
+    # share the parent's database connection
+    django.setup()
+    connections.close_all()
+    _worker_plan = plan
+
+
+def _write_chunk_in_worker(chunk):
+    return _write_chunk(_worker_plan, chunk)
+
+
+# ----- Generating -----
+
+
+def generate(plan, workers=1, progress=None):
+    """
+    Write all the rows of a plan
+
+    Args:
+        plan: a Plan
+        workers: processes writing chunks at the same time (1 = write in
+        this process). Each table is finished before the next one starts.
+        progress: called with (table, rows written so far, total rows)
+
+    Returns:
+        {table: rows written}
+    """
+    plan.allocate()
+
+    tables = [
+        ("users", plan.vendors + plan.buyers),
+        ("stores", plan.stores),
+        ("products", plan.products),
+        ("reviews", plan.reviews),
+        ("orders", plan.orders),
+    ]
+
+    pool = None
+    if workers > 1:
+        # Children open their own connections
+        connections.close_all()
+        pool = multiprocessing.Pool(workers, initializer=_start_worker,
+                                    initargs=(plan,))
+
+    written = {}
+    try:
+        for table, total in tables:
+            chunks = plan.chunks(table, total)
+            if pool is not None:
+                results = pool.imap_unordered(_write_chunk_in_worker, chunks)
+            else:
+                results = (_write_chunk(plan, chunk) for chunk in chunks)
+
+            written[table] = 0
+            for table_name, count in results:
+                written[table] += count
+                if progress:
+                    progress(table, written[table], total)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    _reset_sequences()
+    written["order items"] = plan.orders * plan.items_per_order
+    return written
+
+
+def _reset_sequences():
+    """
+    Move the id sequences past the explicit primary keys (PostgreSQL and
+    Oracle keep separate sequences; MySQL and SQLite follow the rows)
+    """
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [User, Store, Product, Review, Order, OrderItem]
+    )
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def rebuild(batch_size=1000):
+    """
+    Build what the signal handlers and checkout would have kept up to
+    date: the search index, product rating totals, facet counts and daily
+    sales totals. Then start a new catalog version so cached pages show
+    the new data.
+    """
+    search.rebuild_index(batch_size=batch_size)
+    ratings.rebuild(batch_size=batch_size)
+    facets.rebuild()
+    sales_rollups.rebuild(batch_size=batch_size)
+    bump_catalog_version()
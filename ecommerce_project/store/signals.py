@@ -0,0 +1,218 @@
+"""
+Signal handlers that keep derived data in step with the models
+
+Connected in StoreConfig.ready(). Handlers skip raw saves (loaddata) so
+fixtures load exactly as dumped.
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth.models import Group, User
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from . import (
+    buyer_summary,
+    facets,
+    inventory,
+    page_cache,
+    ratings,
+    roles,
+    sales_rollups,
+    search,
+)
+from .conditional import catalog_changed
+from .cart import merge_session_cart, prices_changed
+from .models import Product, Review, Store
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, **kwargs):
+    """
+    Remember the product's old facet values, price and stock before an
+    edit
+    """
+    if raw or instance.pk is None:
+        return
+    old = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list("store_id", "price", "stock")
+        .first()
+    )
+    instance._old_facet_keys = facets.product_keys(*old) if old else set()
+    instance._old_price = old[1] if old else None
+    instance._old_stock = old[2] if old else None
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, update_fields=None,
+                  **kwargs):
+    """
+    Re-index a product, update facet counts, record any stock change in
+    the inventory ledger and make cart totals stale if the price changed
+    after it is saved
+    """
+    if raw:
+        return
+    if created or update_fields is None or "stock" in update_fields:
+        inventory.record_saved_stock(
+            instance,
+            None if created else getattr(instance, "_old_stock", None),
+        )
+    search.index_product(instance)
+    page_cache.forget_products([instance.pk])
+    catalog_changed()
+    old_price = getattr(instance, "_old_price", None)
+    if not created and old_price != Decimal(str(instance.price)):
+        # Cart totals in page headers use the old price
+        prices_changed()
+
+    old_keys = set() if created else getattr(instance, "_old_facet_keys",
+                                             set())
+    new_keys = facets.product_keys(
+        instance.store_id, instance.price, instance.stock
+    )
+    facets.adjust(old_keys - new_keys, new_keys - old_keys)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance, **kwargs):
+    """Take a product's sales out of its store's daily totals"""
+    # Before the delete: its daily rows go with it in the cascade
+    instance._sales_days = sales_rollups.forget_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """Take a deleted product out of the facet counts and order counts"""
+    # (Search rows are removed by the database cascade, and the rating
+    # count by the review handlers as its reviews are deleted)
+    facets.adjust(
+        facets.product_keys(instance.store_id, instance.price,
+                            instance.stock),
+        set(),
+    )
+    page_cache.forget_products([instance.pk])
+    catalog_changed()
+    prices_changed()
+    # Its order lines are gone now - count the orders of its days again
+    sales_rollups.recount_orders(instance.store_id,
+                                 getattr(instance, "_sales_days", []))
+
+
+@receiver(pre_save, sender=Store)
+def store_saving(sender, instance, raw=False, **kwargs):
+    """Remember the old store name so we know if products need re-indexing"""
+    if raw or instance.pk is None:
+        return
+    instance._old_name = (
+        Store.objects.filter(pk=instance.pk)
+        .values_list("name", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Store)
+def store_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    The store name is part of every product's index and page - re-index
+    and mark the products changed on rename
+    """
+    if raw or created:
+        return
+    if getattr(instance, "_old_name", instance.name) == instance.name:
+        return
+
+    products = Product.objects.filter(store=instance)
+    products.touch_update()
+    page_cache.forget_products(products.values_list("pk", flat=True))
+    search.index_products(
+        products.select_related("store").iterator(chunk_size=1000)
+    )
+
+
+@receiver(pre_save, sender=Review)
+def review_saving(sender, instance, raw=False, **kwargs):
+    """Remember the review's old product and rating before an edit"""
+    if raw or instance.pk is None:
+        return
+    instance._old_rating = (
+        Review.objects.filter(pk=instance.pk)
+        .values_list("product_id", "rating")
+        .first()
+    )
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Add the review to its product's rating totals and take the product off
+    the buyer's "waiting for a review" list
+    """
+    if raw:
+        return
+    if created:
+        buyer_summary.review_added(instance.buyer_id, instance.product_id)
+    old = getattr(instance, "_old_rating", None)
+    if old is None:
+        ratings.record(instance.product_id, added=instance.rating)
+    elif old[0] != instance.product_id:
+        # Review moved to another product
+        ratings.record(old[0], removed=old[1])
+        ratings.record(instance.product_id, added=instance.rating)
+        page_cache.forget_products([old[0]])
+    else:
+        ratings.record(instance.product_id, removed=old[1],
+                       added=instance.rating)
+    page_cache.forget_products([instance.product_id])
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    """Take the review out of its product's rating totals"""
+    ratings.record(instance.product_id, removed=instance.rating)
+    page_cache.forget_products([instance.product_id])
+    # The product is waiting for a review again
+    buyer_summary.forget([instance.buyer_id])
+
+
+@receiver(user_logged_in)
+def user_logged_in_merge_cart(sender, request, user, **kwargs):
+    """Move a cart kept in the session into the user's stored cart"""
+    if request is not None and hasattr(request, "session"):
+        merge_session_cart(request, user)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Forget cached roles when users join or leave groups"""
+    if not reverse:
+        # user.groups.add(...) - one user changed
+        if action in ("post_add", "post_remove", "post_clear"):
+            roles.forget_roles([instance.pk])
+    elif action == "pre_clear":
+        # group.user_set.clear() - remember the members before they go
+        instance._old_member_ids = list(
+            instance.user_set.values_list("pk", flat=True)
+        )
+    elif action == "post_clear":
+        roles.forget_roles(getattr(instance, "_old_member_ids", []))
+    elif action in ("post_add", "post_remove"):
+        # group.user_set.add(...) - pk_set holds the users
+        roles.forget_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    """A renamed or deleted group changes the role of all its members"""
+    if raw or instance.pk is None:
+        return
+    roles.forget_roles(instance.user_set.values_list("pk", flat=True))
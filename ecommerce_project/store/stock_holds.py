@@ -0,0 +1,162 @@
+"""
+Cart stock holds (for flash sales)
+
+With STORE_STOCK_HOLDS_ENABLED on, adding a product to the cart also
+sets aside those units for STORE_STOCK_HOLD_SECONDS: a StockHold row per
+buyer and product, with the cart's quantity. Units held by other buyers
+don't count as available when adding to a cart or checking out, so a
+buyer finds out a product is gone when they add it, not at checkout.
+
+Available to sell = stock - units in unexpired holds of other buyers.
+The held units come from one SUM over the (product, expires_at) index.
+
+Holds are never extended in the background: changing the cart renews
+the product's hold, checkout and removing it from the cart release it,
+and an expired hold is simply ignored. The expire_stock_holds command
+deletes expired rows in batches so the table stays small.
+
+With the setting off (the default) every function here does nothing and
+stock works as before.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Product, StockHold
+
+
+class HoldError(Exception):
+    """Not enough unheld stock (message is safe to show)"""
+
+
+def enabled():
+    return settings.STORE_STOCK_HOLDS_ENABLED
+
+
+def held(product_ids, exclude_user=None):
+    """
+    Units in unexpired holds, per product (one query)
+
+    Args:
+        product_ids: the products
+        exclude_user: leave out this buyer's own holds
+
+    Returns:
+        {product id: units held} (products with no holds are left out)
+    """
+    if not enabled():
+        return {}
+    holds = StockHold.objects.filter(
+        product_id__in=list(product_ids), expires_at__gt=timezone.now()
+    )
+    if exclude_user is not None:
+        holds = holds.exclude(user=exclude_user)
+    return dict(
+        holds.values_list("product_id")
+        .annotate(total=Sum("quantity"))
+        .order_by()
+    )
+
+
+def available(products, user=None):
+    """
+    Units each product has left to sell to user: stock less what other
+    buyers are holding
+
+    Returns:
+        {product id: units}
+    """
+    holds = held([product.pk for product in products], exclude_user=user)
+    return {product.pk: max(product.stock - holds.get(product.pk, 0), 0)
+            for product in products}
+
+
+def hold(user, product, quantity):
+    """
+    Hold quantity units of a product for the buyer (replacing their old
+    hold on it) for another STORE_STOCK_HOLD_SECONDS
+
+    The product row is locked while checking, so two buyers can't both
+    take the last units.
+
+    Raises:
+        HoldError: if fewer than quantity units are available. The old
+        hold is kept.
+    """
+    if not enabled():
+        return
+    with transaction.atomic():
+        stock = (
+            Product.objects.select_for_update()
+            .filter(pk=product.pk)
+            .values_list("stock", flat=True)
+            .get()
+        )
+        others = held([product.pk], exclude_user=user).get(product.pk, 0)
+        if quantity > stock - others:
+            raise HoldError(
+                f"Only {max(stock - others, 0)} units available right now"
+            )
+        StockHold.objects.update_or_create(
+            user=user,
+            product=product,
+            defaults={
+                "quantity": quantity,
+                "expires_at": timezone.now() + timedelta(
+                    seconds=settings.STORE_STOCK_HOLD_SECONDS
+                ),
+            },
+        )
+
+
+def release(user_id, product_ids=None):
+    """Drop a buyer's holds (on product_ids, or all of them)"""
+    if not enabled():
+        return
+    holds = StockHold.objects.filter(user_id=user_id)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=list(product_ids))
+    holds.delete()
+
+
+def user_holds(user):
+    """
+    When each of a buyer's unexpired holds runs out
+
+    Returns:
+        {product id: expires_at}
+    """
+    if not enabled():
+        return {}
+    return dict(
+        StockHold.objects.filter(user=user, expires_at__gt=timezone.now())
+        .values_list("product_id", "expires_at")
+    )
+
+
+def expire(batch_size=1000):
+    """
+    Delete expired holds, batch_size rows per DELETE
+
+    Returns:
+        number of holds deleted
+    """
+    deleted = 0
+    while True:
+        now = timezone.now()
+        batch = list(
+            StockHold.objects.filter(expires_at__lte=now)
+            .order_by("expires_at")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not batch:
+            return deleted
+        # expires_at again: a buyer may have renewed a hold since
+        count, by_model = StockHold.objects.filter(
+            pk__in=batch, expires_at__lte=now
+        ).delete()
+        deleted += count
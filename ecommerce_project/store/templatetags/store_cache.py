@@ -0,0 +1,46 @@
+"""
+{% productcache "card" product %} ... {% endproductcache %}
+
+Caches the HTML in between for this product and the visitor's role (see
+store.page_cache). Don't put forms with {% csrf_token %} inside.
+"""
+
+from django import template
+
+from .. import page_cache
+
+register = template.Library()
+
+
+class ProductCacheNode(template.Node):
+    def __init__(self, nodelist, name, product):
+        self.nodelist = nodelist
+        self.name = name
+        self.product = product
+
+    def render(self, context):
+        request = context.get("request")
+        product = self.product.resolve(context)
+        if request is None:
+            return self.nodelist.render(context)
+        return page_cache.fragment(
+            request,
+            self.name.resolve(context),
+            product,
+            lambda: self.nodelist.render(context),
+        )
+
+
+@register.tag
+def productcache(parser, token):
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(
+            f"{bits[0]} takes a fragment name and a product"
+        )
+    nodelist = parser.parse(("endproductcache",))
+    parser.delete_first_token()
+    return ProductCacheNode(
+        nodelist, parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+    )
@@ -1,3 +1,2161 @@
-from django.test import TestCase
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from smtplib import SMTPException
+from unittest import mock
+
+from django.contrib.auth.models import User, Group
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.template.base import Template
+from django.test import (
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    benchmark,
+    buyer_summary,
+    facets,
+    inventory,
+    metrics,
+    outbox,
+    page_cache,
+    product_import,
+    ratings,
+    sales_export,
+    sales_rollups,
+    search,
+    seeding,
+    stock_holds,
+)
+from .cart import Cart
+from .cart_stores import DatabaseCartStore, LocMemCartStore
+from .checkout import CheckoutError, place_order
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+from .roles import BUYER, VENDOR, get_role
+from .models import (
+    FacetCount,
+    Store,
+    Product,
+    Order,
+    OrderItem,
+    OutboxEmail,
+    ProductDailySales,
+    Review,
+    StockHold,
+    StockMovement,
+    StoreDailySales,
+    VendorDailySales,
+)
+
+
+def make_user(username, group_name):
+    """Create a user and put them in the Vendors or Buyers group"""
+    user = User.objects.create_user(
+        username, f"{username}@example.com", "password123"
+    )
+    group, created = Group.objects.get_or_create(name=group_name)
+    user.groups.add(group)
+    return user
+
+
+def make_products(store, count, stock=5):
+    """Create count products in a store"""
+    return [
+        Product.objects.create(
+            name=f"Product {i}",
+            description="A product",
+            price="10.00",
+            stock=stock,
+            store=store,
+        )
+        for i in range(count)
+    ]
+
+
+class ListingQueryBudgetTests(TestCase):
+    """
+    Listing pages must cost a fixed number of queries, however many
+    products are on the page (no N+1 queries per product card)
+    """
+
+    # Session, user, groups, the products themselves, ...
+    QUERY_BUDGET = 10
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+
+    def count_queries(self, url):
+        """Return how many queries a GET to url ran"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_fixed_queries(self, url):
+        """Query count must not grow when more products are listed"""
+        make_products(self.store, 2)
+        # First visit fills per-user caches (e.g. the cart summary)
+        self.client.get(url)
+        few = self.count_queries(url)
+
+        make_products(self.store, 15)
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, self.QUERY_BUDGET)
+
+    def test_products_browse_anonymous(self):
+        self.assert_fixed_queries(reverse("store:products_browse"))
+
+    def test_products_browse_buyer(self):
+        self.client.force_login(self.buyer)
+        self.assert_fixed_queries(reverse("store:products_browse"))
+
+    def test_products_browse_bad_filters(self):
+        make_products(self.store, 2)
+        for value in ("\u00b2", "abc", "-1", "9"):
+            response = self.client.get(reverse("store:products_browse"),
+                                       {"store": value, "rating": value})
+            self.assertEqual(response.status_code, 200)
+        filters = facets.read_filters({"store": "\u00b2", "rating": "\u00b3"})
+        self.assertIsNone(filters["store"])
+        self.assertIsNone(filters["rating"])
+        filters = facets.read_filters({"store": "7", "rating": "4"})
+        self.assertEqual((filters["store"], filters["rating"]), (7, 4))
+
+    def test_vendor_products_list(self):
+        self.client.force_login(self.vendor)
+        self.assert_fixed_queries(reverse("store:vendor_products_list"))
+
+    def test_vendor_store_detail(self):
+        self.client.force_login(self.vendor)
+        self.assert_fixed_queries(
+            reverse("store:vendor_store_detail", kwargs={"pk": self.store.pk})
+        )
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages never skip or repeat rows, and bad cursors are safe"""
+
+    def setUp(self):
+        cache.clear()
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.products = make_products(store, 10)
+        # Ties on every sort value but the id
+        Product.objects.update(created_at=timezone.now())
+        Product.objects.filter(
+            pk__in=[p.pk for p in self.products[:4]]
+        ).update(price="5.00")
+
+    def walk(self, ordering):
+        """Every page forwards, then every page backwards from the end"""
+        paginator = KeysetPaginator(Product.objects.all(), ordering, 3)
+        forwards = []
+        page = paginator.page()
+        self.assertFalse(page.has_previous)
+        pages = [page]
+        while page.has_next:
+            page = paginator.page(page.next_cursor)
+            pages.append(page)
+        for page in pages:
+            forwards += [product.pk for product in page]
+
+        backwards = [[product.pk for product in page]]
+        while page.has_previous:
+            page = paginator.page(page.previous_cursor)
+            backwards.insert(0, [product.pk for product in page])
+        return forwards, [pk for rows in backwards for pk in rows]
+
+    def test_walk_next_and_prev_with_ties(self):
+        for ordering in (("-created_at", "-id"), ("price", "id"),
+                         ("-price", "-id")):
+            expected = list(Product.objects.order_by(*ordering)
+                            .values_list("pk", flat=True))
+            forwards, backwards = self.walk(ordering)
+            self.assertEqual(forwards, expected, ordering)
+            self.assertEqual(backwards, expected, ordering)
+
+    def test_bad_cursor(self):
+        paginator = KeysetPaginator(Product.objects.all(), ("price", "id"))
+        for cursor in ("not a cursor!", "e30",
+                       encode_cursor(["abc", 1], "next", ("price", "id")),
+                       encode_cursor([1], "next", ("price", "id"))):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+
+        # The browse page shows the first page instead
+        url = reverse("store:products_browse")
+        first = self.client.get(url, {"sort": "price_asc"})
+        for cursor in ("not a cursor!",
+                       encode_cursor(["abc", 1], "next", ("price", "id"))):
+            response = self.client.get(url, {"sort": "price_asc",
+                                             "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context["products"]),
+                             list(first.context["products"]))
+
+    @override_settings(STORE_PRODUCTS_PAGE_SIZE=3)
+    def test_cursor_across_sort_change(self):
+        url = reverse("store:products_browse")
+        first = self.client.get(url, {"sort": "price_asc"})
+        cursor = first.context["page"].next_cursor
+        second = self.client.get(url, {"sort": "price_asc",
+                                       "cursor": cursor})
+        self.assertEqual(
+            [p.pk for p in second.context["products"]],
+            list(Product.objects.order_by("price", "id")
+                 .values_list("pk", flat=True)[3:6]),
+        )
+
+        # Still the right page after the product it points past changes
+        moved = first.context["products"].object_list[-1]
+        Product.objects.filter(pk=moved.pk).update(price="50.00")
+        cache.clear()
+        again = self.client.get(url, {"sort": "price_asc",
+                                      "cursor": cursor})
+        self.assertEqual([p.pk for p in again.context["products"]],
+                         [p.pk for p in second.context["products"]])
+
+        # Under another sort it is the first page of that sort
+        other = self.client.get(url, {"sort": "newest", "cursor": cursor})
+        self.assertEqual(
+            [p.pk for p in other.context["products"]],
+            list(Product.objects.order_by("-created_at", "-id")
+                 .values_list("pk", flat=True)[:3]),
+        )
+
+
+class FacetTests(TestCase):
+    """Facet counts kept by the handlers match a rebuild; browse filters"""
+
+    def setUp(self):
+        cache.clear()
+        vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.other_store = Store.objects.create(
+            name="Other Store", description="A store", owner=vendor
+        )
+
+    def product(self, price, stock=5, store=None):
+        return Product.objects.create(
+            name="Product", description="A product", price=price,
+            stock=stock, store=store or self.store,
+        )
+
+    def counts(self):
+        return {
+            (facet, value): count
+            for facet, value, count in FacetCount.objects.filter(
+                count__gt=0
+            ).values_list("facet", "value", "count")
+        }
+
+    def assert_matches_rebuild(self, step):
+        incremental = self.counts()
+        facets.rebuild()
+        self.assertEqual(incremental, self.counts(), step)
+
+    def test_incremental_counts_match_rebuild(self):
+        cheap = self.product("50.00")
+        dear = self.product("700.00", stock=1)
+        other = self.product("1500.00", stock=0, store=self.other_store)
+        self.assert_matches_rebuild("create")
+
+        cheap.price = Decimal("250.00")
+        cheap.save()
+        self.assert_matches_rebuild("price band")
+        cheap.store = self.other_store
+        cheap.save()
+        self.assert_matches_rebuild("store")
+        other.stock = 3
+        other.save()
+        self.assert_matches_rebuild("stock")
+
+        place_order(self.buyer, {str(dear.pk): 1})
+        self.assertEqual(Product.objects.get(pk=dear.pk).stock, 0)
+        self.assert_matches_rebuild("sold out")
+
+        review = Review.objects.create(content="Good", rating=5,
+                                       product=other, buyer=self.buyer)
+        self.assert_matches_rebuild("review added")
+        review.delete()
+        self.assert_matches_rebuild("review deleted")
+
+        other.delete()
+        self.assert_matches_rebuild("delete")
+
+    @override_settings(STORE_PRODUCTS_PAGE_SIZE=2)
+    def test_browse_filters_and_sorts(self):
+        for price, stock, store in (("50.00", 5, None), ("50.00", 0, None),
+                                    ("250.00", 2, self.other_store),
+                                    ("700.00", 0, None),
+                                    ("1500.00", 1, self.other_store)):
+            self.product(price, stock, store)
+        rated = Product.objects.get(price="250.00")
+        Review.objects.create(content="Good", rating=4, product=rated,
+                              buyer=self.buyer)
+
+        everything = Product.objects.all()
+        cases = [
+            ({"store": self.other_store.pk},
+             everything.filter(store=self.other_store)),
+            ({"price": "0-100"}, everything.filter(price__lt=100)),
+            ({"price": "1000+"}, everything.filter(price__gte=1000)),
+            ({"stock": "in"}, everything.filter(stock__gt=0)),
+            ({"stock": "out"}, everything.filter(stock=0)),
+            ({"rating": 4}, everything.filter(pk=rated.pk)),
+            ({"stock": "in", "price": "100-500"},
+             everything.filter(stock__gt=0, price__gte=100,
+                               price__lt=500)),
+        ]
+        for sort, (label, ordering) in facets.SORTS.items():
+            cases.append(({"sort": sort}, everything.order_by(*ordering)))
+
+        url = reverse("store:products_browse")
+        for params, expected in cases:
+            label, ordering = facets.SORTS[
+                params.get("sort", facets.DEFAULT_SORT)
+            ]
+            shown = []
+            response = self.client.get(url, params)
+            while True:
+                page = response.context["page"]
+                shown += [product.pk for product in page]
+                if not page.has_next:
+                    break
+                response = self.client.get(
+                    url, dict(params, cursor=page.next_cursor)
+                )
+            self.assertEqual(
+                shown,
+                list(expected.order_by(*ordering)
+                     .values_list("pk", flat=True)),
+                params,
+            )
+
+
+class RoleTests(TestCase):
+    """Roles are cached per user and forgotten when groups change"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user("buyer", "Buyers")
+
+    def fresh_user(self):
+        """A new User object for the same row (nothing remembered on it)"""
+        return User(pk=self.user.pk, username=self.user.username)
+
+    def test_role_cached(self):
+        self.assertEqual(get_role(self.fresh_user()), BUYER)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_role(self.fresh_user()), BUYER)
+
+    def test_group_change_forgets_role(self):
+        get_role(self.fresh_user())
+
+        self.user.groups.clear()
+        self.user.groups.add(Group.objects.create(name="Vendors"))
+        self.assertEqual(get_role(self.fresh_user()), VENDOR)
+
+        Group.objects.get(name="Vendors").user_set.clear()
+        self.assertIsNone(get_role(self.fresh_user()))
+
+    def test_decorator_redirects_other_roles(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("store:vendor_products_list"))
+        self.assertRedirects(response, reverse("store:home"))
+
+
+class RatingTotalsTests(TestCase):
+    """Review changes keep the product's rating totals and facets right"""
+
+    def setUp(self):
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.product, self.other = make_products(store, 2)
+        self.buyers = [make_user(f"buyer{i}", "Buyers") for i in range(3)]
+
+    def review(self, buyer, rating, product=None):
+        return Review.objects.create(
+            content="Review",
+            rating=rating,
+            product=product or self.product,
+            buyer=buyer,
+        )
+
+    def totals(self, product=None):
+        product = Product.objects.get(pk=(product or self.product).pk)
+        return (product.rating_count, product.rating_sum,
+                product.rating_average, product.rating_histogram)
+
+    def facet_counts(self):
+        return dict(
+            FacetCount.objects.filter(facet="rating", count__gt=0)
+            .values_list("value", "count")
+        )
+
+    def test_create_edit_delete(self):
+        first = self.review(self.buyers[0], 5)
+        second = self.review(self.buyers[1], 2)
+        self.assertEqual(
+            self.totals(),
+            (2, 7, 3.5, [(5, 1), (4, 0), (3, 0), (2, 1), (1, 0)]),
+        )
+
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.totals()[:3], (2, 9, 4.5))
+
+        first.delete()
+        self.assertEqual(
+            self.totals(),
+            (1, 4, 4.0, [(5, 0), (4, 1), (3, 0), (2, 0), (1, 0)]),
+        )
+        self.assertEqual(self.facet_counts(), {"4": 1})
+
+        # Moving a review to another product moves its stars too
+        second.product = self.other
+        second.save()
+        self.assertEqual(self.totals()[:3], (0, 0, 0))
+        self.assertEqual(self.totals(self.other)[:3], (1, 4, 4.0))
+
+    def test_rebuild_matches_incremental(self):
+        self.review(self.buyers[0], 5)
+        self.review(self.buyers[1], 1)
+        self.review(self.buyers[2], 3, product=self.other)
+        incremental = [self.totals(), self.totals(self.other)]
+        incremental_facets = self.facet_counts()
+
+        Product.objects.update(rating_count=0, rating_sum=0, rating_5=0)
+        ratings.rebuild()
+        facets.rebuild()
+
+        self.assertEqual([self.totals(), self.totals(self.other)],
+                         incremental)
+        self.assertEqual(self.facet_counts(), incremental_facets)
+
+
+@override_settings(STORE_REVIEWS_PAGE_SIZE=3)
+class ProductReviewsTests(TestCase):
+    """The product page shows one page of reviews; the rest load on demand"""
+
+    def setUp(self):
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.product = make_products(store, 1)[0]
+
+    def add_reviews(self, count):
+        for i in range(count):
+            Review.objects.create(
+                content=f"review-{i}",
+                rating=i % 5 + 1,
+                product=self.product,
+                buyer=make_user(f"buyer{Review.objects.count()}", "Buyers"),
+                verified=i % 3 == 0,
+            )
+
+    def detail_queries(self):
+        url = reverse("store:product_detail", kwargs={"pk": self.product.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["reviews"]), 3)
+        return len(queries)
+
+    def test_detail_queries_do_not_grow(self):
+        self.add_reviews(3)
+        few = self.detail_queries()
+        self.add_reviews(20)
+        self.assertEqual(self.detail_queries(), few)
+
+    def test_load_more_walks_every_review(self):
+        self.add_reviews(8)
+        url = reverse("store:product_reviews", kwargs={"pk": self.product.pk})
+
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            data = self.client.get(url, {"sort": "verified",
+                                         "cursor": cursor}).json()
+            seen += [line for line in data["html"].split()
+                     if line.startswith("review-")]
+            cursor = data["next_cursor"]
+
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+
+    def test_rating_filter(self):
+        self.add_reviews(10)
+        response = self.client.get(
+            reverse("store:product_detail", kwargs={"pk": self.product.pk}),
+            {"rating": "5"},
+        )
+        self.assertEqual(
+            {review.rating for review in response.context["reviews"]}, {5}
+        )
+
+
+class OrderDetailQueryTests(TestCase):
+    """Order detail costs the same number of queries for any order size"""
+
+    QUERY_BUDGET = 10
+
+    def setUp(self):
+        cache.clear()
+        vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+
+    def order_queries(self, lines):
+        """Place an order with lines products (half reviewed), count queries"""
+        products = make_products(self.store, lines)
+        order, items = place_order(
+            self.buyer, {product.pk: 1 for product in products}
+        )
+        for product in products[::2]:
+            Review.objects.create(content="Good", rating=5,
+                                  product=product, buyer=self.buyer)
+
+        self.client.force_login(self.buyer)
+        url = reverse("store:order_detail", kwargs={"pk": order.pk})
+        self.client.get(url)  # fill per-user caches
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(
+            [line["has_reviewed"]
+             for line in response.context["order_items_with_status"]],
+            [i % 2 == 0 for i in range(lines)],
+        )
+        return len(queries)
+
+    def test_fixed_queries(self):
+        few = self.order_queries(2)
+        many = self.order_queries(20)
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, self.QUERY_BUDGET)
+
+
+@override_settings(STORE_ORDERS_PAGE_SIZE=3)
+class OrderHistoryTests(TestCase):
+    """Order history is paged, filterable by date and costs fixed queries"""
+
+    def setUp(self):
+        cache.clear()
+        vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.products = make_products(store, 3, stock=100)
+        self.client.force_login(self.buyer)
+
+    def place_orders(self, count):
+        for i in range(count):
+            place_order(self.buyer, {p.pk: 2 for p in self.products})
+
+    def get(self, **params):
+        return self.client.get(reverse("store:order_history"), params)
+
+    def test_pages_and_item_counts(self):
+        self.place_orders(5)
+
+        first = self.get()
+        self.assertEqual(len(first.context["orders"]), 3)
+        self.assertEqual(first.context["orders"].object_list[0].item_count, 6)
+
+        second = self.get(cursor=first.context["page"].next_cursor)
+        ids = [o.pk for o in first.context["orders"]] + [
+            o.pk for o in second.context["orders"]
+        ]
+        self.assertEqual(
+            ids, list(Order.objects.order_by("-order_date", "-id")
+                      .values_list("pk", flat=True))
+        )
+
+    def test_fixed_queries(self):
+        self.place_orders(1)
+        self.get()
+        with CaptureQueriesContext(connection) as few:
+            self.get()
+        self.place_orders(5)
+        with CaptureQueriesContext(connection) as many:
+            self.get()
+        self.assertEqual(len(few), len(many))
+
+    def test_date_filter(self):
+        self.place_orders(2)
+        old = Order.objects.order_by("id").first()
+        Order.objects.filter(pk=old.pk).update(
+            order_date=timezone.make_aware(datetime(2020, 6, 15, 12))
+        )
+
+        response = self.get(**{"from": "2021-01-01"})
+        self.assertEqual(len(response.context["orders"]), 1)
+        response = self.get(**{"from": "2020-06-15", "to": "2020-06-15"})
+        self.assertEqual([o.pk for o in response.context["orders"]],
+                         [old.pk])
+
+
+class ConditionalGetTests(TestCase):
+    """Unchanged catalog pages are answered with 304 Not Modified"""
+
+    def setUp(self):
+        cache.clear()
+        vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.product = make_products(self.store, 1)[0]
+        self.detail_url = reverse("store:product_detail",
+                                  kwargs={"pk": self.product.pk})
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_product_page(self):
+        first = self.client.get(self.detail_url)
+
+        # One primary key lookup, no render
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.revalidate(self.detail_url, first).status_code, 304
+            )
+
+        # A review changes the product's totals (update(), no save())
+        Review.objects.create(content="Good", rating=5,
+                              product=self.product, buyer=self.buyer)
+        self.assertEqual(
+            self.revalidate(self.detail_url, first).status_code, 200
+        )
+
+    def test_review_text_edit(self):
+        review = Review.objects.create(content="Good", rating=5,
+                                       product=self.product, buyer=self.buyer)
+        first = self.client.get(self.detail_url)
+        self.assertContains(first, "Good")
+
+        # Same rating, new text: the cached page and ETag are not reused
+        with self.captureOnCommitCallbacks(execute=True):
+            review.content = "Changed my mind"
+            review.save()
+        response = self.revalidate(self.detail_url, first)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Changed my mind")
+
+    def test_browse_page(self):
+        url = reverse("store:products_browse")
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, first).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store.name = "Renamed Store"
+            self.store.save()
+        self.assertEqual(self.revalidate(url, first).status_code, 200)
+
+    def test_page_differs_per_user(self):
+        first = self.client.get(self.detail_url)
+        self.client.force_login(self.buyer)
+        self.assertEqual(
+            self.revalidate(self.detail_url, first).status_code, 200
+        )
+
+    def test_no_validators_with_pending_message(self):
+        self.client.force_login(self.buyer)
+        # Adding to the cart leaves a "Added ... to cart" message
+        self.client.post(reverse("store:cart_add",
+                                 kwargs={"product_pk": self.product.pk}))
+        response = self.client.get(reverse("store:products_browse"))
+        self.assertFalse(response.has_header("ETag"))
+
+
+class FragmentCacheTests(TestCase):
+    """Rendered product cards and logged-out pages come from the cache"""
+
+    def setUp(self):
+        cache.clear()
+        page_cache.reset_stats()
+        self.vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+        self.products = make_products(self.store, 3)
+        self.browse_url = reverse("store:products_browse")
+
+    def test_cards_cached(self):
+        self.client.force_login(self.buyer)
+        self.client.get(self.browse_url)
+        response = self.client.get(self.browse_url)
+
+        self.assertEqual(page_cache.cache_stats()["card"],
+                         {"hits": 3, "misses": 3})
+        # The cart form is outside the cached part, with a fresh token
+        self.assertContains(response, "csrfmiddlewaretoken", count=3)
+
+    def test_saved_product_rendered_again(self):
+        self.client.force_login(self.buyer)
+        self.client.get(self.browse_url)
+
+        product = self.products[0]
+        product.name = "Renamed Product"
+        product.save()
+
+        response = self.client.get(self.browse_url)
+        self.assertContains(response, "Renamed Product")
+        self.assertEqual(page_cache.cache_stats()["card"],
+                         {"hits": 2, "misses": 4})
+
+    def test_review_changes_detail(self):
+        product = self.products[0]
+        url = reverse("store:product_detail", kwargs={"pk": product.pk})
+        self.client.force_login(self.buyer)
+        self.client.get(url)
+
+        Review.objects.create(content="Good", rating=4, product=product,
+                              buyer=self.buyer)
+
+        response = self.client.get(url)
+        self.assertContains(response, "4.0 / 5")
+        self.assertEqual(page_cache.cache_stats()["detail"],
+                         {"hits": 0, "misses": 2})
+
+    def test_cards_vary_by_role(self):
+        self.client.force_login(self.buyer)
+        self.client.get(self.browse_url)
+        self.client.force_login(self.vendor)
+        self.client.get(self.browse_url)
+
+        self.assertEqual(page_cache.cache_stats()["card"],
+                         {"hits": 0, "misses": 6})
+
+    def test_anonymous_page_cached(self):
+        self.client.get(self.browse_url)
+
+        # Whole page from the cache: no queries, no render
+        with self.assertNumQueries(0):
+            self.client.get(self.browse_url)
+        self.assertEqual(page_cache.cache_stats()["page"],
+                         {"hits": 1, "misses": 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].name = "Renamed Product"
+            self.products[0].save()
+        self.assertContains(self.client.get(self.browse_url),
+                            "Renamed Product")
+
+    def test_logged_in_pages_not_cached_whole(self):
+        self.client.force_login(self.buyer)
+        self.client.get(self.browse_url)
+        self.client.get(self.browse_url)
+        self.assertNotIn("page", page_cache.cache_stats())
+
+
+@override_settings(STORE_METRICS_ENABLED=True)
+class MetricsTests(TestCase):
+    """Per-request query and timing numbers"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_metrics()
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        make_products(store, 2)
+        self.browse_url = reverse("store:products_browse")
+        self.client = Client()
+
+    def test_server_timing_header(self):
+        response = self.client.get(self.browse_url)
+        self.assertIn("db;dur=", response["Server-Timing"])
+        self.assertIn("tpl;dur=", response["Server-Timing"])
+
+    def test_template_timing_only_during_requests(self):
+        original = Template.render
+        self.client.get(self.browse_url)
+        text = metrics.render_metrics()
+        self.assertIn(
+            'store_template_seconds_total{view="store:products_browse"}',
+            text,
+        )
+        self.assertNotIn(
+            'store_template_seconds_total{view="store:products_browse"} 0\n',
+            text,
+        )
+        # Rendering outside a request is left alone
+        self.assertIs(Template.render, original)
+
+    @override_settings(
+        STORE_METRICS_QUERY_BUDGETS={"store:products_browse": 0}
+    )
+    def test_over_budget_logged(self):
+        with self.assertLogs("store.metrics", "WARNING") as logs:
+            self.client.get(self.browse_url)
+        self.assertIn("store:products_browse", logs.output[0])
+
+    def test_metrics_page(self):
+        self.client.get(self.browse_url)
+        staff = User.objects.create_user("staff", password="password123",
+                                         is_staff=True)
+        self.client.force_login(staff)
+
+        text = self.client.get("/metrics").content.decode()
+        self.assertIn('store_requests_total{view="store:products_browse"} 1',
+                      text)
+        self.assertIn("store_db_queries_total", text)
+        self.assertIn('store_cache_misses_total{cache="page"}', text)
+
+    @override_settings(STORE_METRICS_TOKEN="secret")
+    def test_metrics_page_access(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        response = self.client.get("/metrics",
+                                   HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(STORE_METRICS_ENABLED=False)
+    def test_disabled(self):
+        client = Client()
+        response = client.get(self.browse_url)
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertEqual(client.get("/metrics").status_code, 404)
+
+
+class BenchmarkTests(TestCase):
+    """The benchmark harness seeds data, runs the flows and compares"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_and_run(self):
+        benchmark.seed(stores=2, products=10, reviews=20, buyers=2,
+                       orders=5)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(
+            Product.objects.aggregate(total=Sum("rating_count"))["total"],
+            20,
+        )
+
+        report = benchmark.run(clients=1, iterations=2, warmup=1,
+                               repeats=2)
+        self.assertEqual(report["errors"], 0)
+        # Warm-up requests aren't recorded, but do place orders
+        self.assertEqual(report["steps"]["checkout"]["requests"], 4)
+        self.assertEqual(Order.objects.count(), 11)
+        for numbers in report["steps"].values():
+            self.assertGreater(numbers["queries_per_request"], 0)
+            self.assertLessEqual(numbers["p50_ms"], numbers["p99_ms"])
+
+    def test_run_needs_data(self):
+        with self.assertRaises(ValueError):
+            benchmark.run(clients=1, iterations=1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+        self.assertEqual(benchmark.percentile([], 95), 0)
+
+    def test_compare(self):
+        baseline = {"steps": {"browse": {"p95_ms": 10,
+                                         "queries_per_request": 5,
+                                         "errors": 0}}}
+        same = {"steps": {"browse": {"p95_ms": 11,
+                                     "queries_per_request": 5,
+                                     "errors": 0}}}
+        worse = {"steps": {"browse": {"p95_ms": 20,
+                                      "queries_per_request": 6,
+                                      "errors": 0}}}
+        self.assertEqual(benchmark.compare(same, baseline), [])
+        # Twice as slow, but only by 10 ms: below the floor
+        self.assertEqual(len(benchmark.compare(worse, baseline)), 1)
+        self.assertEqual(
+            len(benchmark.compare(worse, baseline, min_delta_ms=5)), 2
+        )
+
+    def test_combine_takes_median(self):
+        def report(p95, requests=10):
+            return {"steps": {"browse": {
+                "requests": requests, "errors": 0, "p50_ms": 1,
+                "p95_ms": p95, "p99_ms": p95, "queries_per_request": 5,
+            }}, "requests": requests, "errors": 0, "seconds": 1}
+
+        combined = benchmark.combine([report(10), report(90), report(12)])
+        self.assertEqual(combined["steps"]["browse"]["p95_ms"], 12)
+        self.assertEqual(combined["steps"]["browse"]["requests"], 30)
+        self.assertEqual(combined["throughput"], 10)
+
+
+class SeedingTests(TestCase):
+    """seed_store writes repeatable data and rebuilds what signals keep"""
+
+    def seed(self, reviews=30, **options):
+        plan = seeding.Plan(stores=3, products=20, reviews=reviews,
+                            buyers=4, orders=10, items_per_order=2,
+                            chunk_size=7, **options)
+        written = seeding.generate(plan)
+        seeding.rebuild()
+        return written
+
+    def products(self):
+        return list(Product.objects.order_by("pk").values_list(
+            "name", "price", "stock", "store__name"
+        ))
+
+    def test_counts(self):
+        written = self.seed()
+        self.assertEqual(written["order items"], 20)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(OrderItem.objects.count(), 20)
+        self.assertEqual(
+            User.objects.filter(groups__name=BUYER).count(), 4
+        )
+        # Rating totals and search index were rebuilt
+        self.assertEqual(
+            Product.objects.aggregate(total=Sum("rating_count"))["total"],
+            30,
+        )
+        product = Product.objects.first()
+        self.assertIn(product.pk, [
+            pk for pk, score in search.search_products(product.name)
+        ])
+
+    def test_same_seed_same_data(self):
+        self.seed()
+        first = self.products()
+        for model in (OrderItem, Order, Review, Product, Store):
+            model.objects.all().delete()
+        User.objects.all().delete()
+
+        self.seed()
+        self.assertEqual(self.products(), first)
+
+    def test_one_review_per_buyer_and_product(self):
+        # Chunks smaller than a buyer's reviews, and as many reviews as
+        # there are buyer/product pairs
+        self.seed(reviews=80)
+        self.assertEqual(Review.objects.count(), 80)
+        pairs = set(Review.objects.values_list("buyer", "product"))
+        self.assertEqual(len(pairs), 80)
+
+    def test_seeding_again_adds(self):
+        self.seed()
+        self.seed()
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Order.objects.count(), 20)
+
+
+class ProductImportTests(TestCase):
+    """Bulk imports create or update products by SKU, a batch at a time"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+        self.url = reverse("store:vendor_product_import",
+                           kwargs={"store_pk": self.store.pk})
+
+    def run_import(self, text, file_format="csv", batch_size=2):
+        rows = product_import.read_rows(BytesIO(text.encode()), file_format)
+        return list(product_import.import_products(self.store, rows,
+                                                   batch_size=batch_size))
+
+    def test_csv_creates_then_updates(self):
+        reports = self.run_import(
+            "sku,name,description,price,stock\n"
+            "A1,Lamp,A lamp,10.00,5\n"
+            "B2,Mug,A mug,4.5,0\n"
+            "C3,Kettle,A kettle,20,3\n"
+        )
+        self.assertEqual([report.created for report in reports], [2, 1])
+        mug = Product.objects.get(store=self.store, sku="B2")
+        self.assertEqual(mug.price, Decimal("4.50"))
+
+        # Search index and facet counts are kept up to date
+        self.assertIn(mug.pk, [pk for pk, score
+                               in search.search_products("mug")])
+        self.assertEqual(
+            FacetCount.objects.get(facet="stock", value="in").count, 2
+        )
+
+        reports = self.run_import(
+            "sku,name,description,price,stock\n"
+            "B2,Big Mug,A big mug,6,7\n"
+        )
+        self.assertEqual((reports[0].created, reports[0].updated), (0, 1))
+        mug.refresh_from_db()
+        self.assertEqual((mug.name, mug.stock, mug.version),
+                         ("Big Mug", 7, 2))
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(
+            FacetCount.objects.get(facet="stock", value="in").count, 3
+        )
+
+    def test_bad_rows_reported(self):
+        reports = self.run_import(
+            '{"sku": "A1", "name": "Lamp", "description": "A lamp", '
+            '"price": 10, "stock": 5}\n'
+            "not json\n"
+            '{"sku": "B2", "name": "Mug", "description": "A mug", '
+            '"price": -1, "stock": 5}\n'
+            '{"name": "Cup", "description": "A cup", "price": 1, '
+            '"stock": 1}\n',
+            file_format="jsonl",
+            batch_size=10,
+        )
+        self.assertEqual(reports[0].created, 1)
+        self.assertEqual(reports[0].errors, [
+            (2, "", "Not valid JSON"),
+            (3, "B2", "Price must be greater than 0"),
+            (4, "", "SKU is required"),
+        ])
+
+    def test_missing_columns(self):
+        with self.assertRaises(product_import.ImportFormatError):
+            self.run_import("sku,name\nA1,Lamp\n")
+
+    def test_upload_page(self):
+        self.client.force_login(self.vendor)
+        upload = SimpleUploadedFile(
+            "products.csv",
+            b"sku,name,description,price,stock\n"
+            b"A1,Lamp,A lamp,10.00,5\n"
+            b"B2,Mug,A mug,abc,1\n",
+        )
+        response = self.client.post(self.url, {"file": upload})
+        self.assertContains(response, "Price must be a valid number")
+        self.assertEqual(response.context["created"], 1)
+        self.assertEqual(response.context["error_count"], 1)
+
+    def test_other_vendors_store(self):
+        other = make_user("other", "Vendors")
+        self.client.force_login(other)
+        response = self.client.post(self.url, {
+            "file": SimpleUploadedFile("p.csv", b"sku,name\n"),
+        })
+        self.assertRedirects(response, reverse("store:vendor_stores_list"))
+        self.assertFalse(Product.objects.exists())
+
+    def test_add_form_uses_same_rules(self):
+        self.client.force_login(self.vendor)
+        url = reverse("store:vendor_product_add",
+                      kwargs={"store_pk": self.store.pk})
+        self.client.post(url, {"name": "Lamp", "description": "A lamp",
+                               "price": "1.5", "stock": "2", "sku": "A1"})
+        response = self.client.post(url, {
+            "name": "Lamp 2", "description": "A lamp", "price": "1.5",
+            "stock": "2", "sku": "A1",
+        })
+        self.assertContains(response, "already has a product with SKU")
+        self.assertEqual(Product.objects.get().price, Decimal("1.50"))
+
+
+@override_settings(STORE_EXPORT_CHUNK_SIZE=2)
+class SalesExportTests(TestCase):
+    """Vendors download their order lines, streamed a chunk at a time"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        other = make_user("other", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+        other_store = Store.objects.create(
+            name="Other Store", description="A store", owner=other
+        )
+        products = make_products(store, 5) + make_products(other_store, 1)
+        for product in products:
+            place_order(self.buyer, {str(product.pk): 2})
+        self.url = reverse("store:vendor_sales_export")
+
+    def download(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        self.client.force_login(self.vendor)
+        # Session, user and role, then one query per chunk of 2 lines
+        # (5 lines -> 3 queries)
+        with self.assertNumQueries(6):
+            text = self.download()
+        rows = list(csv.DictReader(text.splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["store"], "Test Store")
+        self.assertEqual(rows[0]["line_total"], "20.00")
+        self.assertEqual(rows[0]["buyer"], "buyer")
+
+    def test_jsonl_and_dates(self):
+        self.client.force_login(self.vendor)
+        today = timezone.localdate()
+        text = self.download(format="jsonl", **{"from": str(today)})
+        self.assertEqual(len(text.splitlines()), 5)
+        self.assertEqual(json.loads(text.splitlines()[0])["quantity"], 2)
+
+        text = self.download(format="jsonl",
+                             to=str(today - timedelta(days=1)))
+        self.assertEqual(text, "")
+
+    def test_bad_store_ignored(self):
+        self.client.force_login(self.vendor)
+        text = self.download(store="\u00b2")
+        self.assertEqual(len(text.splitlines()), 6)
+
+    def test_buyers_cannot_export(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(self.url)
+        self.assertFalse(getattr(response, "streaming", False))
+        self.assertEqual(response.status_code, 302)
+
+    def test_iter_rows_all_chunks(self):
+        lines = sales_export.sales_lines(self.vendor)
+        self.assertEqual(len(list(sales_export.iter_rows(lines, 1))), 5)
+
+
+class SalesRollupTests(TestCase):
+    """The vendor dashboard reads daily totals kept up to date at checkout"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+        self.products = make_products(self.store, 3, stock=100)
+
+    def order(self, *quantities):
+        place_order(self.buyer, {
+            str(product.pk): quantity
+            for product, quantity in zip(self.products, quantities)
+            if quantity
+        })
+
+    def totals(self):
+        return (
+            sorted(StoreDailySales.objects.values_list(
+                "store_id", "day", "orders", "units", "revenue")),
+            sorted(ProductDailySales.objects.values_list(
+                "product_id", "store_id", "day", "units", "revenue")),
+            sorted(VendorDailySales.objects.values_list(
+                "vendor_id", "day", "orders")),
+        )
+
+    def test_checkout_adds_to_totals(self):
+        self.order(2, 1, 0)
+        self.order(3, 0, 0)
+        row = StoreDailySales.objects.get()
+        self.assertEqual((row.orders, row.units, row.revenue),
+                         (2, 6, Decimal("60.00")))
+        self.assertEqual(row.day, timezone.localdate())
+        product = ProductDailySales.objects.get(product=self.products[0])
+        self.assertEqual((product.units, product.revenue),
+                         (5, Decimal("50.00")))
+
+    def test_failed_checkout_adds_nothing(self):
+        with self.assertRaises(CheckoutError):
+            self.order(101, 1, 0)
+        self.assertFalse(StoreDailySales.objects.exists())
+        self.assertFalse(ProductDailySales.objects.exists())
+
+    def test_rebuild_matches_checkout(self):
+        self.order(2, 1, 0)
+        self.order(0, 4, 1)
+        # An order from yesterday
+        old = Order.objects.create(buyer=self.buyer, total_price=10)
+        Order.objects.filter(pk=old.pk).update(
+            order_date=timezone.now() - timedelta(days=1)
+        )
+        OrderItem.objects.create(order=old, product=self.products[2],
+                                 quantity=1, price=10)
+        sales_rollups.record_order(Order.objects.get(pk=old.pk),
+                                   old.orderitem_set.all())
+
+        kept = self.totals()
+        sales_rollups.rebuild(batch_size=1)
+        self.assertEqual(self.totals(), kept)
+        self.assertEqual(StoreDailySales.objects.count(), 2)
+
+        # Yesterday's only order goes, today's keeps its other line
+        self.products[2].delete()
+        kept = self.totals()
+        self.assertEqual(StoreDailySales.objects.get().orders, 2)
+        sales_rollups.rebuild()
+        self.assertEqual(self.totals(), kept)
+
+    def test_deleted_product_leaves_store_totals(self):
+        self.order(2, 1, 0)
+        self.products[0].delete()
+        kept = self.totals()
+        sales_rollups.rebuild()
+        self.assertEqual(self.totals(), kept)
+
+    def test_order_from_two_stores_is_one_vendor_order(self):
+        second = Store.objects.create(
+            name="Second Store", description="A store", owner=self.vendor
+        )
+        other_product = make_products(second, 1, stock=100)[0]
+        place_order(self.buyer, {str(self.products[0].pk): 1,
+                                 str(other_product.pk): 2})
+
+        summary = sales_rollups.vendor_summary(self.vendor)
+        self.assertEqual(summary["orders"], 1)
+        self.assertEqual([store["orders"] for store in summary["stores"]],
+                         [1, 1])
+        kept = self.totals()
+        sales_rollups.rebuild()
+        self.assertEqual(self.totals(), kept)
+
+        # The order still bought from the vendor's second store
+        self.products[0].delete()
+        summary = sales_rollups.vendor_summary(self.vendor)
+        self.assertEqual(summary["orders"], 1)
+        self.assertFalse(
+            StoreDailySales.objects.filter(store=self.store).exists()
+        )
+        other_product.delete()
+        self.assertEqual(sales_rollups.vendor_summary(self.vendor)["orders"],
+                         0)
+
+    def test_deleting_products_together_recounts_orders(self):
+        self.order(2, 1, 1)
+        self.order(1, 1, 0)
+        Product.objects.filter(pk__in=[self.products[0].pk,
+                                       self.products[1].pk]).delete()
+        # Only the first order has a line left
+        self.assertEqual(StoreDailySales.objects.get().orders, 1)
+        self.assertEqual(VendorDailySales.objects.get().orders, 1)
+        kept = self.totals()
+        sales_rollups.rebuild()
+        self.assertEqual(self.totals(), kept)
+
+    def test_summary_windows(self):
+        self.order(2, 1, 0)
+        today = timezone.localdate()
+
+        summary = sales_rollups.vendor_summary(self.vendor, "week")
+        self.assertEqual(summary["revenue"], Decimal("30.00"))
+        self.assertEqual(summary["orders"], 1)
+        self.assertEqual(len(summary["days"]), 7)
+        self.assertEqual(summary["days"][-1]["percent"], 100)
+        self.assertEqual(summary["top_products"][0]["product_id"],
+                         self.products[0].pk)
+
+        # Eight days later the sale has left the week but not the month
+        later = today + timedelta(days=8)
+        week = sales_rollups.vendor_summary(self.vendor, "week", later)
+        month = sales_rollups.vendor_summary(self.vendor, "month", later)
+        self.assertEqual(week["units"], 0)
+        self.assertEqual(month["units"], 3)
+
+        other = make_user("other", "Vendors")
+        self.assertEqual(sales_rollups.vendor_summary(other)["stores"], [])
+
+    def test_dashboard_queries_do_not_grow_with_orders(self):
+        self.client.force_login(self.vendor)
+        url = reverse("store:vendor_dashboard")
+        self.order(1, 0, 0)
+        # First request caches the role
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(url, {"window": "month"})
+        self.assertContains(response, "Top sellers")
+
+        for i in range(20):
+            self.order(1, 1, 1)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url, {"window": "month"})
+        self.assertEqual(len(many), len(few))
+        self.assertContains(response, "R610.00")
+
+    def test_buyers_cannot_see_dashboard(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse("store:vendor_dashboard"))
+        self.assertEqual(response.status_code, 302)
+
+
+class BuyerDashboardTests(TestCase):
+    """The buyer dashboard is served from a cached summary"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = make_user("buyer", "Buyers")
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.products = make_products(store, 4, stock=50)
+        self.url = reverse("store:buyer_dashboard")
+
+    def order(self, quantities):
+        # The summary is dropped once the order commits
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.buyer, quantities)
+
+    def dashboard(self):
+        return buyer_summary.dashboard(self.buyer)
+
+    def assert_matches_database(self):
+        cached = self.dashboard()
+        built = buyer_summary.build_summary(self.buyer)
+        for key in built:
+            self.assertEqual(cached[key], built[key], key)
+
+    def test_checkout_and_reviews_update_cached_summary(self):
+        self.order({str(self.products[0].pk): 2})
+        self.assertEqual(self.dashboard()["orders"], 1)
+
+        # Cached from here on: changes are applied in place
+        self.order({str(self.products[0].pk): 1,
+                                 str(self.products[1].pk): 1})
+        summary = self.dashboard()
+        self.assertEqual(summary["orders"], 2)
+        self.assertEqual(summary["spent"], Decimal("40.00"))
+        self.assertEqual(summary["recent_orders"][0]["items"], 2)
+        self.assert_matches_database()
+
+        Review.objects.create(product=self.products[0], buyer=self.buyer,
+                              content="Good", rating=5, verified=True)
+        self.assertEqual(
+            [entry["id"] for entry in self.dashboard()["pending_reviews"]],
+            [self.products[1].pk],
+        )
+        self.assert_matches_database()
+
+        # Buying a reviewed product again doesn't ask for another review
+        self.order({str(self.products[0].pk): 1})
+        self.assert_matches_database()
+
+        Review.objects.get().delete()
+        self.assert_matches_database()
+
+    def test_rolled_back_order_keeps_summary(self):
+        self.dashboard()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    place_order(self.buyer, {str(self.products[0].pk): 1})
+                    raise RuntimeError
+        self.assertIsNotNone(
+            cache.get(buyer_summary.summary_key(self.buyer.pk))
+        )
+        self.assertEqual(self.dashboard()["orders"], 0)
+
+    def test_recent_orders_are_bounded(self):
+        self.dashboard()
+        for i in range(buyer_summary.RECENT_ORDERS + 2):
+            self.order({str(self.products[0].pk): 1})
+        summary = self.dashboard()
+        self.assertEqual(len(summary["recent_orders"]),
+                         buyer_summary.RECENT_ORDERS)
+        self.assert_matches_database()
+
+    @override_settings(STORE_RECENTLY_VIEWED=3)
+    def test_recently_viewed_ring(self):
+        self.client.force_login(self.buyer)
+        for product in self.products + [self.products[1]]:
+            self.client.get(reverse("store:product_detail",
+                                    kwargs={"pk": product.pk}))
+        viewed = [entry["id"] for entry in self.dashboard()["recently_viewed"]]
+        self.assertEqual(viewed, [self.products[1].pk, self.products[3].pk,
+                                  self.products[2].pk])
+
+    @override_settings(STORE_PENDING_REVIEWS_SHOWN=2)
+    def test_pending_reviews_are_bounded(self):
+        self.dashboard()
+        for product in self.products:
+            self.order({str(product.pk): 1})
+        summary = self.dashboard()
+        self.assertEqual(len(summary["pending_reviews"]), 2)
+        self.assertEqual((summary["pending_count"], summary["pending_more"]),
+                         (4, 2))
+        self.assert_matches_database()
+
+        # Bought again while waiting past the end of the list
+        self.order({str(self.products[0].pk): 1})
+        self.assertEqual(self.dashboard()["pending_count"], 4)
+        self.assert_matches_database()
+
+        Review.objects.create(product=self.products[3], buyer=self.buyer,
+                              content="Good", rating=5, verified=True)
+        self.assertEqual(self.dashboard()["pending_count"], 3)
+        self.assert_matches_database()
+
+    def test_not_modified_product_page_is_still_viewed(self):
+        self.client.force_login(self.buyer)
+        first_url, second_url = [
+            reverse("store:product_detail", kwargs={"pk": product.pk})
+            for product in self.products[:2]
+        ]
+        # (The first visit sets the CSRF cookie, which is in the ETag)
+        self.client.get(first_url)
+        first = self.client.get(first_url)
+        self.client.get(second_url)
+
+        again = self.client.get(first_url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        viewed = [entry["id"] for entry in self.dashboard()["recently_viewed"]]
+        self.assertEqual(viewed, [self.products[0].pk, self.products[1].pk])
+
+        # Not on the list any more (e.g. it expired): looked up by id
+        cache.delete(buyer_summary.viewed_key(self.buyer.pk))
+        self.client.get(first_url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(self.dashboard()["recently_viewed"][0]["name"],
+                         self.products[0].name)
+
+    def test_page_runs_no_summary_queries_when_cached(self):
+        self.order({str(self.products[0].pk): 1})
+        self.client.force_login(self.buyer)
+        self.client.get(self.url)
+        # Session and user only
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertContains(response, "R10.00")
+        self.assertContains(response, "Review What You Bought")
+
+
+class InventoryTests(TestCase):
+    """Every stock change is a movement that adds up to Product.stock"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+        self.product = make_products(self.store, 1, stock=5)[0]
+
+    def assert_ledger_adds_up(self):
+        self.assertEqual(list(inventory.reconcile(batch_size=1)), [])
+
+    def kinds(self):
+        return list(self.product.stock_movements.order_by("id")
+                    .values_list("kind", "quantity", "stock_after"))
+
+    def test_new_product_and_checkout(self):
+        place_order(self.buyer, {str(self.product.pk): 2})
+        self.assertEqual(self.kinds(), [
+            (StockMovement.RESTOCK, 5, 5),
+            (StockMovement.SALE, -2, 3),
+        ])
+        self.assertEqual(StockMovement.objects.last().order.buyer,
+                         self.buyer)
+        self.assert_ledger_adds_up()
+
+    def test_edit_applies_change_not_count(self):
+        self.client.force_login(self.vendor)
+        url = reverse("store:vendor_product_edit",
+                      kwargs={"pk": self.product.pk})
+        # The form was opened at 5, then 2 were sold
+        place_order(self.buyer, {str(self.product.pk): 2})
+        self.client.post(url, {
+            "name": "Renamed", "description": "A product", "price": "10",
+            "stock": "8", "stock_was": "5",
+        })
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, "Renamed")
+        self.assertEqual(self.product.stock, 6)
+        movement = StockMovement.objects.last()
+        self.assertEqual((movement.kind, movement.quantity, movement.user),
+                         (StockMovement.RESTOCK, 3, self.vendor))
+        self.assert_ledger_adds_up()
+
+    def test_edit_below_zero_changes_nothing(self):
+        self.client.force_login(self.vendor)
+        url = reverse("store:vendor_product_edit",
+                      kwargs={"pk": self.product.pk})
+        place_order(self.buyer, {str(self.product.pk): 4})
+        response = self.client.post(url, {
+            "name": "Renamed", "description": "A product", "price": "10",
+            "stock": "0", "stock_was": "5",
+        })
+        self.assertContains(response, "Only 1 left")
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.stock),
+                         ("Product 0", 1))
+        self.assert_ledger_adds_up()
+
+    def test_move_updates_facets(self):
+        inventory.move(self.product, StockMovement.ADJUSTMENT, -5)
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(
+            FacetCount.objects.get(facet="stock", value="out").count, 1
+        )
+        with self.assertRaises(inventory.StockError):
+            inventory.move(self.product, StockMovement.ADJUSTMENT, -1)
+        self.assert_ledger_adds_up()
+
+    def test_import_and_save_are_recorded(self):
+        Product.objects.filter(pk=self.product.pk).update(sku="A")
+        rows = [(1, {"sku": "A", "name": "A", "description": "d",
+                     "price": "1", "stock": "9"}),
+                (2, {"sku": "B", "name": "B", "description": "d",
+                     "price": "1", "stock": "3"})]
+        list(product_import.import_products(self.store, rows))
+        product = Product.objects.get(sku="B")
+        product.stock = 1
+        product.save()
+        self.assertEqual(
+            list(product.stock_movements.values_list("quantity", flat=True)
+                 .order_by("id")),
+            [3, -2],
+        )
+        self.assert_ledger_adds_up()
+
+    def test_reconcile_finds_and_fixes_differences(self):
+        # A write that skips the ledger
+        Product.objects.filter(pk=self.product.pk).update(stock=7)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("reconcile_stock", stdout=out)
+        self.assertIn("stock 7, movements add up to 5", out.getvalue())
+
+        call_command("reconcile_stock", "--fix", stdout=StringIO())
+        self.assertEqual(StockMovement.objects.last().quantity, 2)
+        self.assert_ledger_adds_up()
+
+    def test_movements_are_append_only(self):
+        movement = StockMovement.objects.get()
+        movement.quantity = 50
+        with self.assertRaises(ValueError):
+            movement.save()
+
+
+@override_settings(STORE_STOCK_HOLDS_ENABLED=True)
+class StockHoldTests(TestCase):
+    """Adding to the cart holds stock for a while (when holds are on)"""
+
+    def setUp(self):
+        cache.clear()
+        self.first = make_user("first", "Buyers")
+        self.second = make_user("second", "Buyers")
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        self.product = make_products(store, 1, stock=5)[0]
+        self.add_url = reverse("store:cart_add",
+                               kwargs={"product_pk": self.product.pk})
+
+    def add(self, user, quantity):
+        self.client.force_login(user)
+        return self.client.post(self.add_url, {"quantity": quantity},
+                                follow=True)
+
+    def test_held_units_are_not_available_to_others(self):
+        self.add(self.first, 3)
+        response = self.add(self.second, 3)
+        self.assertContains(response, "Only 2 units available right now")
+        self.assertEqual(Cart(self.second).quantity(self.product.pk), 0)
+
+        self.add(self.second, 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(stock_holds.held([self.product.pk]),
+                             {self.product.pk: 5})
+        self.assertEqual(
+            stock_holds.available([self.product], self.first),
+            {self.product.pk: 3},
+        )
+
+    def test_checkout_respects_and_releases_holds(self):
+        self.add(self.first, 4)
+        # Added before holds were taken into account
+        Cart(self.second).add(self.product, 2)
+        with self.assertRaises(CheckoutError):
+            place_order(self.second, Cart(self.second).quantities())
+
+        place_order(self.first, Cart(self.first).quantities())
+        self.assertFalse(StockHold.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+    def test_removing_from_cart_releases_hold(self):
+        self.add(self.first, 3)
+        self.client.get(reverse("store:cart_remove",
+                                kwargs={"product_pk": self.product.pk}))
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        self.add(self.first, 5)
+        StockHold.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(stock_holds.held([self.product.pk]), {})
+        self.add(self.second, 5)
+
+        out = StringIO()
+        call_command("expire_stock_holds", "--once", "--batch-size", "1",
+                     stdout=out)
+        self.assertIn("1 expired holds deleted", out.getvalue())
+        self.assertEqual(
+            list(StockHold.objects.values_list("user", flat=True)),
+            [self.second.pk],
+        )
+
+    def test_cart_page_shows_reservation(self):
+        self.add(self.first, 1)
+        response = self.client.get(reverse("store:cart_view"))
+        self.assertContains(response, "Reserved for you until")
+
+    @override_settings(STORE_STOCK_HOLDS_ENABLED=False)
+    def test_off_by_default(self):
+        self.add(self.first, 5)
+        self.add(self.second, 5)
+        self.assertFalse(StockHold.objects.exists())
+
+
+class SearchTests(TestCase):
+    """Every word must match, best scores first, bad filters ignored"""
+
+    def setUp(self):
+        vendor = make_user("vendor", "Vendors")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+
+    def product(self, name, description="A product"):
+        return Product.objects.create(name=name, description=description,
+                                      price="10.00", stock=5,
+                                      store=self.store)
+
+    def test_every_word_must_match(self):
+        both = self.product("Blue mug")
+        self.product("Blue plate")
+        self.product("Red mug")
+        self.assertEqual(
+            [pk for pk, score in search.search_products("blue mug")],
+            [both.pk],
+        )
+        # Two words can match the same index word
+        self.assertEqual(
+            [pk for pk, score in search.search_products("mu mug")],
+            [pk for pk, score in search.search_products("mug")],
+        )
+
+    def test_scores(self):
+        in_name = self.product("Teapot")
+        in_description = self.product("Pot", "A teapot for two")
+        prefix = self.product("Teapots")
+        self.assertEqual(search.search_products("teapot"), [
+            (in_name.pk, search.NAME_WEIGHT * search.EXACT_MATCH_BOOST),
+            (prefix.pk, search.NAME_WEIGHT),
+            (in_description.pk,
+             search.DESCRIPTION_WEIGHT * search.EXACT_MATCH_BOOST),
+        ])
+
+    @override_settings(STORE_SEARCH_MAX_RESULTS=2)
+    def test_limit_keeps_best(self):
+        for i in range(3):
+            self.product(f"Plain {i}", "A lamp")
+        best = self.product("Lamp")
+        results = search.search_products("lamp")
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], best.pk)
+
+    def test_bad_store_filter_ignored(self):
+        product = self.product("Lamp")
+        for store in ("\u00b2", "abc", "-1"):
+            response = self.client.get(reverse("store:product_search"),
+                                       {"q": "lamp", "store": store})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context["products"]), [product])
+
+
+class CartTests(TestCase):
+    """The cart page loads in fixed queries; deleted products drop out"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = make_user("buyer", "Buyers")
+        store = Store.objects.create(
+            name="Test Store", description="A store",
+            owner=make_user("vendor", "Vendors"),
+        )
+        self.products = make_products(store, 12)
+        for i, product in enumerate(self.products):
+            product.name = f"Cart product {i}"
+            product.save()
+        self.client.force_login(self.buyer)
+        self.url = reverse("store:cart_view")
+
+    def test_cart_page_queries_do_not_grow(self):
+        cart = Cart(self.buyer)
+        for product in self.products[:2]:
+            cart.add(product)
+        # First request caches the role and the header summary
+        self.client.get(self.url)
+        # Session, user, cart lines, their products (store joined), holds
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Cart product 1")
+
+        for product in self.products[2:]:
+            cart.add(product)
+        self.client.get(self.url)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Cart product 11")
+
+    def test_header_summary_is_cached(self):
+        cart = Cart(self.buyer)
+        cart.add(self.products[0], 2)
+        cart.add(self.products[1])
+        self.assertEqual(Cart(self.buyer).summary(),
+                         {"count": 3, "total": Decimal("30.00")})
+        with self.assertNumQueries(0):
+            Cart(self.buyer).summary()
+
+        # Changing the cart works it out again
+        Cart(self.buyer).remove(self.products[1].pk)
+        self.assertEqual(Cart(self.buyer).summary(),
+                         {"count": 2, "total": Decimal("20.00")})
+
+    def test_deleted_product_is_dropped(self):
+        cart = Cart(self.buyer)
+        cart.add(self.products[0])
+        cart.add(self.products[1])
+        self.products[0].delete()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item.product for item in response.context["cart_items"]],
+            [self.products[1]],
+        )
+        self.assertEqual(response.context["cart_count"], 1)
+        self.assertNotContains(response, "Remove Cart product 0 from")
+        self.assertContains(response, "Remove Cart product 1 from")
+        self.assertEqual([line.product for line in Cart(self.buyer).lines()],
+                         [self.products[1]])
+        self.assertEqual(Cart(self.buyer).quantities(),
+                         {self.products[1].pk: 1})
+
+
+class CheckoutTests(TestCase):
+    """place_order() saves everything or nothing, and never oversells"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+        self.first, self.second = make_products(store, 2, stock=3)
+
+    def test_order_created_and_stock_taken(self):
+        order, items = place_order(
+            self.buyer, {str(self.first.pk): 2, str(self.second.pk): 1}
+        )
+
+        self.assertEqual(len(items), 2)
+        self.assertEqual(order.total_price, 30)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.stock, 1)
+        self.assertEqual(self.second.stock, 2)
+
+    def test_not_enough_stock_saves_nothing(self):
+        with self.assertRaises(CheckoutError):
+            place_order(
+                self.buyer, {str(self.first.pk): 1, str(self.second.pk): 4}
+            )
+
+        self.assertFalse(Order.objects.exists())
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.stock, 3)
+
+    def test_deleted_product_saves_nothing(self):
+        with self.assertRaises(CheckoutError):
+            place_order(self.buyer, {str(self.first.pk): 1, "999999": 1})
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkout_view_clears_cart(self):
+        self.client.force_login(self.buyer)
+        Cart(self.buyer).add(self.first, 1)
+
+        response = self.client.get(reverse("store:checkout"))
+
+        order = Order.objects.get()
+        self.assertRedirects(
+            response,
+            reverse("store:order_detail", kwargs={"pk": order.pk}),
+            fetch_redirect_response=False,
+        )
+        self.assertFalse(Cart(self.buyer))
+
+
+class CartStoreTestsMixin:
+    """The same cart store API checks, run against each backend"""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+        self.owner = make_user("buyer", "Buyers").pk
+        shop = Store.objects.create(
+            name="Test Store",
+            description="A store",
+            owner=make_user("vendor", "Vendors"),
+        )
+        self.first, self.second = [p.pk for p in make_products(shop, 2)]
+
+    def test_add_update_remove(self):
+        self.store.add(self.owner, self.first, 1)
+        self.store.add(self.owner, self.first, 2)
+        self.store.update(self.owner, self.second, 5)
+        self.assertEqual(
+            self.store.get(self.owner), {self.first: 3, self.second: 5}
+        )
+
+        self.assertTrue(self.store.remove(self.owner, self.first))
+        self.assertFalse(self.store.remove(self.owner, self.first))
+        self.assertEqual(self.store.get(self.owner), {self.second: 5})
+
+        self.store.clear(self.owner)
+        self.assertEqual(self.store.get(self.owner), {})
+
+    def test_lines_keep_the_order_they_were_added(self):
+        self.store.add(self.owner, self.second, 1)
+        self.store.add(self.owner, self.first, 1)
+        self.store.update(self.owner, self.second, 4)
+        self.assertEqual(list(self.store.get(self.owner)),
+                         [self.second, self.first])
+
+    def test_merge_adds_quantities(self):
+        other = make_user("buyer2", "Buyers").pk
+        self.store.add(self.owner, self.first, 1)
+        self.store.add(other, self.first, 2)
+        self.store.add(other, self.second, 1)
+
+        self.store.merge(other, self.owner)
+
+        self.assertEqual(
+            self.store.get(self.owner), {self.first: 3, self.second: 1}
+        )
+        self.assertEqual(self.store.get(other), {})
+
+
+class LocMemCartStoreTests(CartStoreTestsMixin, TestCase):
+    def make_store(self):
+        return LocMemCartStore()
+
+
+class DatabaseCartStoreTests(CartStoreTestsMixin, TestCase):
+    def make_store(self):
+        return DatabaseCartStore()
+
+    def test_summary_follows_price_changes(self):
+        buyer = User.objects.get(pk=self.owner)
+        product = Product.objects.get(pk=self.first)
+        Cart(buyer).add(product, 2)
+        self.assertEqual(Cart(buyer).summary()["total"], Decimal("20.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = Decimal("12.50")
+            product.save()
+        self.assertEqual(Cart(buyer).summary()["total"], Decimal("25.00"))
+
+        # Cached again until the next change
+        with self.assertNumQueries(0):
+            Cart(buyer).summary()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(Cart(buyer).summary()["count"], 0)
+
+    def test_cart_survives_logout(self):
+        buyer = User.objects.get(pk=self.owner)
+        self.client.force_login(buyer)
+        self.client.post(
+            reverse("store:cart_add", kwargs={"product_pk": self.first})
+        )
+        self.client.logout()
+        self.client.force_login(buyer)
+
+        self.assertEqual(Cart(buyer).quantities(), {self.first: 1})
+
+
+class ApiTests(TestCase):
+    """The /api/v1/ endpoints"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = make_user("vendor", "Vendors")
+        self.buyer = make_user("buyer", "Buyers")
+        self.store = Store.objects.create(
+            name="Test Store", description="A store", owner=self.vendor
+        )
+
+    def list_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_lists_cost_fixed_queries(self):
+        for url in ("/api/v1/products/", "/api/v1/stores/",
+                    "/api/v1/reviews/"):
+            make_products(self.store, 2)
+            few = self.list_queries(url)
+            products = make_products(self.store, 15)
+            for product in products:
+                Review.objects.create(content="Good", rating=4,
+                                      product=product, buyer=self.buyer)
+            self.assertEqual(self.list_queries(url), few, url)
+
+    def test_sparse_fields(self):
+        make_products(self.store, 1)
+        response = self.client.get("/api/v1/products/?fields=id,name")
+        self.assertEqual(set(response.json()["results"][0]), {"id", "name"})
+
+        response = self.client.get("/api/v1/products/?fields=id,nope")
+        self.assertEqual(response.status_code, 400)
+
+    def test_review_filters_must_be_numbers(self):
+        product = make_products(self.store, 1)[0]
+        Review.objects.create(content="Good", rating=4, product=product,
+                              buyer=self.buyer)
+        response = self.client.get("/api/v1/reviews/",
+                                   {"product": product.pk})
+        self.assertEqual(len(response.json()["results"]), 1)
+        for value in ("\u00b2", "abc"):
+            response = self.client.get("/api/v1/reviews/",
+                                       {"product": value})
+            self.assertEqual(response.status_code, 400)
+
+    def test_etag_not_modified(self):
+        make_products(self.store, 1)
+        response = self.client.get("/api/v1/products/")
+
+        again = self.client.get("/api/v1/products/",
+                                HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        make_products(self.store, 1)
+        changed = self.client.get("/api/v1/products/",
+                                  HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+
+    def test_cart_and_checkout(self):
+        product = make_products(self.store, 1, stock=3)[0]
+        self.client.force_login(self.buyer)
+
+        response = self.client.post(
+            "/api/v1/cart/items/", {"product": product.pk, "quantity": 2},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            "/api/v1/cart/items/", {"product": product.pk, "quantity": 2},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/cart/").json()["count"], 2)
+
+        response = self.client.post("/api/v1/orders/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["item_count"], 2)
+        self.assertEqual(self.client.get("/api/v1/cart/").json()["count"], 0)
+        self.assertEqual(
+            len(self.client.get("/api/v1/orders/").json()["results"]), 1
+        )
+
+    def test_cart_buyers_only(self):
+        self.client.force_login(self.vendor)
+        self.assertEqual(self.client.get("/api/v1/cart/").status_code, 403)
+        self.assertEqual(self.client.get("/api/v1/orders/").status_code, 403)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Stress test: hundreds of buyers checking out the same product at once
+    must never sell more than is in stock
+
+    The parallel run needs real row locks (MySQL/MariaDB), so it is skipped
+    on SQLite; the last-unit races below play both sides in turn and run
+    everywhere.
+    """
+
+    CHECKOUTS = 200
+    STOCK = 50
+
+    def last_unit(self):
+        """One unit left, in two buyers' carts"""
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        product = make_products(store, 1, stock=1)[0]
+        buyers = [make_user(f"buyer{i}", "Buyers") for i in range(2)]
+        for buyer in buyers:
+            Cart(buyer).add(product)
+        return product, buyers
+
+    def assert_sold_once(self, product):
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(),
+                         1)
+
+    def test_last_unit_sold_once(self):
+        product, (first, second) = self.last_unit()
+        place_order(first, Cart(first).quantities())
+
+        with self.assertRaisesMessage(CheckoutError, "Only 0 available"):
+            place_order(second, Cart(second).quantities())
+        self.assert_sold_once(product)
+
+    def test_stale_stock_check_sold_once(self):
+        # The second checkout read the stock before the first one took the
+        # unit: only the stock__gte guard on the UPDATE stops it
+        product, (first, second) = self.last_unit()
+        place_order(first, Cart(first).quantities())
+
+        with mock.patch.object(stock_holds, "available",
+                               return_value={product.pk: 1}):
+            with self.assertRaisesMessage(CheckoutError,
+                                          "Not enough stock for"):
+                place_order(second, Cart(second).quantities())
+        self.assert_sold_once(product)
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_parallel_checkouts_do_not_oversell(self):
+        vendor = make_user("vendor", "Vendors")
+        store = Store.objects.create(
+            name="Test Store", description="A store", owner=vendor
+        )
+        hot, other = make_products(store, 2, stock=self.STOCK)
+        buyers = [make_user(f"buyer{i}", "Buyers")
+                  for i in range(self.CHECKOUTS)]
+
+        def checkout(buyer):
+            # Half the carts list the products the other way round
+            if buyer.pk % 2:
+                cart = {str(hot.pk): 1, str(other.pk): 1}
+            else:
+                cart = {str(other.pk): 1, str(hot.pk): 1}
+            try:
+                place_order(buyer, cart)
+                return True
+            except CheckoutError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(checkout, buyers))
+
+        hot.refresh_from_db()
+        self.assertEqual(results.count(True), self.STOCK)
+        self.assertEqual(hot.stock, 0)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        self.assertEqual(
+            OrderItem.objects.filter(product=hot).count(), self.STOCK
+        )
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    """Email backend whose mail server is always down"""
+
+    def send_messages(self, email_messages):
+        raise SMTPException("Connection refused")
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+)
+class OutboxTests(TestCase):
+    """Views only queue emails; the worker sends them and retries"""
+
+    def test_password_reset_only_queues(self):
+        make_user("buyer", "Buyers")
+
+        self.client.post(
+            reverse("store:password_reset_request"),
+            {"email": "buyer@example.com"},
+        )
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboxEmail.objects.get()
+        self.assertEqual(queued.recipients, ["buyer@example.com"])
+
+    def test_send_pending_sends_batch(self):
+        for i in range(3):
+            outbox.enqueue_email("Hello", "Body", [f"user{i}@example.com"])
+
+        sent, failed = outbox.send_pending()
+
+        self.assertEqual((sent, failed), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(
+            OutboxEmail.objects.exclude(
+                status=OutboxEmail.STATUS_SENT
+            ).exists()
+        )
+
+    @override_settings(
+        EMAIL_BACKEND="store.tests.FailingEmailBackend",
+        STORE_OUTBOX_MAX_ATTEMPTS=2,
+    )
+    def test_failures_back_off_then_give_up(self):
+        email = outbox.enqueue_email("Hello", "Body", ["user@example.com"])
+
+        self.assertEqual(outbox.send_pending(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("Connection refused", email.last_error)
+
+        # Not due yet - nothing is retried straight away
+        self.assertEqual(outbox.send_pending(), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=email.created_at)
+        outbox.send_pending()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.STATUS_FAILED)
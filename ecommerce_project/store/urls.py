@@ -20,6 +20,11 @@ urlpatterns = [
     ),
     # Dashboards
     path("vendor/dashboard/", views.vendor_dashboard, name="vendor_dashboard"),
+    path(
+        "vendor/sales/export/",
+        views.vendor_sales_export,
+        name="vendor_sales_export",
+    ),
     path("buyer/dashboard/", views.buyer_dashboard, name="buyer_dashboard"),
     # Vendor Store Management
     path("vendor/stores/", views.vendor_stores_list, name="vendor_stores_list"),
@@ -46,6 +51,11 @@ urlpatterns = [
         views.vendor_product_add,
         name="vendor_product_add",
     ),
+    path(
+        "vendor/stores/<int:store_pk>/products/import/",
+        views.vendor_product_import,
+        name="vendor_product_import",
+    ),
     path(
         "vendor/products/<int:pk>/edit/",
         views.vendor_product_edit,
@@ -59,8 +69,16 @@ urlpatterns = [
     # Buyer Shopping
     # Browse all products
     path("products/", views.products_browse, name="products_browse"),
+    # Search products
+    path("products/search/", views.product_search, name="product_search"),
     # Product detail
     path("products/<int:pk>/", views.product_detail, name="product_detail"),
+    # More reviews for a product (JSON, used by "Load more")
+    path(
+        "products/<int:pk>/reviews/",
+        views.product_reviews,
+        name="product_reviews",
+    ),
     # Buyer cart
     # View cart
     path("cart/", views.cart_view, name="cart_view"),
@@ -1,16 +1,61 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.contrib.auth.models import User, Group
 from .forms import RegisterForm, LoginForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.urls import reverse
-from django.core.mail import EmailMessage
 from django.utils import timezone
-from datetime import timedelta
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Prefetch
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
 import secrets
 from hashlib import sha256
-from .models import Store, Product, Order, OrderItem, Review, PasswordResetToken
+from .models import (
+    Store,
+    Product,
+    Order,
+    OrderItem,
+    Review,
+    PasswordResetToken,
+    StockMovement,
+)
+from .pagination import KeysetPaginator, InvalidCursor
+from . import (
+    buyer_summary,
+    facets,
+    inventory,
+    sales_export,
+    sales_rollups,
+    search,
+    stock_holds,
+)
+from .cart import Cart
+from .checkout import place_order, send_invoice, CheckoutError
+from .conditional import browse_conditional, product_conditional
+from .page_cache import (
+    anonymous_page_cache,
+    browse_page_version,
+    product_page_version,
+    warm_fragments,
+)
+from .decorators import vendor_required, buyer_required
+from .roles import VENDOR, BUYER, get_role
+from .outbox import enqueue_email
+from .sales_export import start_of_day
+from .product_import import (
+    FORMATS,
+    ImportFormatError,
+    ProductDataError,
+    clean_product,
+    import_products,
+    read_rows,
+)
 
 # Register user view
 
@@ -103,9 +148,10 @@ def login_user(request):
             messages.success(request, f"Welcome back, {user.username}!")
 
             # Redirect based on group
-            if user.groups.filter(name="Vendors").exists():
+            role = get_role(user)
+            if role == VENDOR:
                 return redirect("store:vendor_dashboard")
-            elif user.groups.filter(name="Buyers").exists():
+            elif role == BUYER:
                 return redirect("store:buyer_dashboard")
             else:
                 return redirect("store:home")
@@ -177,9 +223,7 @@ def password_reset_request(request):
                     kwargs={"token": raw_token})
         )
 
-        # Send email
-        from django.core.mail import EmailMessage
-
+        # Queue the email (the send_outbox worker sends it)
         subject = "Password Reset Request"
         body = f"""
 Hello {user.username},
@@ -197,15 +241,7 @@ Best regards,
 The eCommerce Team
         """
 
-        email_message = EmailMessage(
-            subject, body, "noreply@ecommerce.com", [user.email]
-        )
-
-        try:
-            email_message.send()
-            print(f"Password reset email sent to {user.email}")
-        except Exception as e:
-            print(f"Failed to send email: {e}")
+        enqueue_email(subject, body, [user.email])
 
         messages.success(request,
                          "If that email exists, a reset link has been sent.")
@@ -283,35 +319,95 @@ def home(request):
     return render(request, "store/home.html")
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can view the vendor dashboard")
 def vendor_dashboard(request):
     """
-    Vendor dashboard - placeholder for now
+    Vendor dashboard - sales over the last day, week or month per store,
+    top selling products and revenue per day
+
+    The numbers come from the daily sales totals (store/sales_rollups.py),
+    so the page never reads the order history.
+
+    Query string:
+        window: "day", "week" (default) or "month"
+    """
+    window = request.GET.get("window")
+    if window not in sales_rollups.WINDOWS:
+        window = sales_rollups.DEFAULT_WINDOW
+
+    # For the sales export form
+    stores = Store.objects.filter(owner=request.user).order_by("name")
+    return render(request, "store/vendor/dashboard.html", {
+        "stores": stores,
+        "export_formats": sales_export.FORMATS,
+        "sales": sales_rollups.vendor_summary(request.user, window),
+        "window": window,
+        "windows": [(key, label) for key, (label, days)
+                    in sales_rollups.WINDOWS.items()],
+    })
+
+
+@vendor_required("Only vendors can export sales")
+def vendor_sales_export(request):
     """
-    return render(request, "store/vendor/dashboard.html")
+    Download every order line of the vendor's products, streamed as it is
+    read (see store/sales_export.py)
 
+    Query string:
+        format: "csv" (default) or "jsonl"
+        from, to: only orders placed on or between these dates (YYYY-MM-DD)
+        store: only this store's sales
+    """
+    file_format = request.GET.get("format", "csv")
+    if file_format not in sales_export.FORMATS:
+        file_format = "csv"
+
+    store_id = _parse_id(request.GET.get("store"))
+    date_from = _parse_date(request.GET.get("from"))
+    date_to = _parse_date(request.GET.get("to"))
+
+    lines = sales_export.sales_lines(
+        request.user,
+        store_id=store_id,
+        start=start_of_day(date_from) if date_from else None,
+        end=start_of_day(date_to + timedelta(days=1)) if date_to else None,
+    )
 
-@login_required(login_url="store:login")
+    # Rows are read and sent a chunk at a time - nothing waits for the
+    # whole export
+    response = StreamingHttpResponse(
+        sales_export.render(sales_export.iter_rows(lines), file_format),
+        content_type=sales_export.FORMATS[file_format],
+    )
+    filename = f"sales-{timezone.localdate():%Y%m%d}.{file_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    # Ask proxies (nginx) to pass rows on instead of buffering the file
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@buyer_required("Only buyers can view the buyer dashboard")
 def buyer_dashboard(request):
     """
-    Buyer dashboard - placeholder for now
+    Buyer dashboard - orders, money spent, products waiting for a review
+    and recently viewed products
+
+    Everything comes from the buyer's cached summary
+    (store/buyer_summary.py), so the page usually runs no query of its
+    own.
     """
-    return render(request, "store/buyer/dashboard.html")
+    return render(request, "store/buyer/dashboard.html",
+                  {"summary": buyer_summary.dashboard(request.user)})
 
 
 # Create Store View
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can create stores")
 def vendor_store_create(request):
     """
     Allow vendors to create a new store
     """
-    # Check user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can create stores")
-        return redirect("store:home")
-
     # Get data from form
     if request.method == "POST":
         name = request.POST.get("name")
@@ -350,15 +446,10 @@ def vendor_store_create(request):
 # Check if user is logged in
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can view their stores")
 def vendor_stores_list(request):
     """Show all stores owned by current vendor"""
 
-    # Check if user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can view their stores")
-        return redirect("store:home")
-
     # Get all stores where owner = current user
     stores = Store.objects.filter(owner=request.user)
 
@@ -370,7 +461,7 @@ def vendor_stores_list(request):
 # Vendor Store Create View
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can add products")
 def vendor_product_add(request, store_pk):
     """
     Allow vendors to add a product to their store
@@ -378,11 +469,6 @@ def vendor_product_add(request, store_pk):
     Args:
         store_pk: The ID of the store to add product to
     """
-    # Check if the user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can add products")
-        return redirect("store:home")
-
     # Get the store by store_pk
     store = get_object_or_404(Store, pk=store_pk)
 
@@ -393,51 +479,25 @@ def vendor_product_add(request, store_pk):
 
     # Get data from form
     if request.method == "POST":
-        name = request.POST.get("name")
-        description = request.POST.get("description")
-        price = request.POST.get("price")
-        stock = request.POST.get("stock")
-
-        # Validation
-        # Check if fields are empty
-        if not name or not description or not price or not stock:
-            messages.error(request, "All fields are required")
-            return render(request, "store/vendor/product_add.html")
-
-        # Check if price is valid (greater than 0)
+        # Same rules as bulk imports (see store/product_import.py)
         try:
-            price = float(price)
-            if price <= 0:
-                messages.error(request, "Price must be greater than 0")
-                return render(
-                    request, "store/vendor/product_add.html", {"store": store}
-                )
-        except ValueError:
-            messages.error(request, "Price must be a valid number")
+            fields = clean_product(request.POST)
+        except ProductDataError as error:
+            messages.error(request, str(error))
             return render(request,
                           "store/vendor/product_add.html", {"store": store})
 
-        # Check if stock is valid (not negative)
-        try:
-            stock = int(stock)
-            if stock < 0:
-                messages.error(request, "Stock cannot be negative")
-                return render(
-                    request, "store/vendor/product_add.html", {"store": store}
-                )
-        except ValueError:
-            messages.error(request, "Stock must be a valid number")
+        if fields["sku"] and store.product_set.filter(
+                sku=fields["sku"]).exists():
+            messages.error(
+                request, f'This store already has a product with SKU '
+                         f'"{fields["sku"]}"'
+            )
             return render(request,
                           "store/vendor/product_add.html", {"store": store})
 
         # Create the product
-        product = Product.objects.create(
-            name=name,
-            description=description,
-            price=price,
-            stock=stock,
-            store=store
-        )
+        product = Product.objects.create(store=store, **fields)
 
         # Success message and redirect
         messages.success(request,
@@ -450,11 +510,75 @@ def vendor_product_add(request, store_pk):
                       "store/vendor/product_add.html", {"store": store})
 
 
+@vendor_required("Only vendors can import products")
+def vendor_product_import(request, store_pk):
+    """
+    Create or update many products at once from a CSV or JSON Lines file,
+    matched on SKU (see store/product_import.py)
+
+    Args:
+        store_pk: The ID of the store to import into
+    """
+    store = get_object_or_404(Store, pk=store_pk)
+
+    # Check if current user owns this store
+    if store.owner != request.user:
+        messages.error(request,
+                       "You can only import products to your own stores")
+        return redirect("store:vendor_stores_list")
+
+    context = {"store": store, "formats": FORMATS}
+    if request.method != "POST":
+        return render(request, "store/vendor/product_import.html", context)
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        messages.error(request, "Choose a file to import")
+        return render(request, "store/vendor/product_import.html", context)
+
+    # The format comes from the file name unless one was picked
+    file_format = request.POST.get("format") or (
+        "jsonl" if upload.name.lower().endswith((".jsonl", ".ndjson"))
+        else "csv"
+    )
+
+    # Large uploads are kept in a temporary file by Django and read one
+    # row at a time, so only a batch is ever in memory
+    batches = []
+    errors = []
+    error_count = 0
+    try:
+        for report in import_products(store, read_rows(upload, file_format)):
+            # Keep the counts, and only the first few errors
+            batches.append({
+                "number": report.number,
+                "rows": report.rows,
+                "created": report.created,
+                "updated": report.updated,
+                "errors": len(report.errors),
+            })
+            error_count += len(report.errors)
+            room = settings.STORE_IMPORT_ERRORS_SHOWN - len(errors)
+            errors.extend(report.errors[:max(room, 0)])
+    except ImportFormatError as error:
+        messages.error(request, str(error))
+
+    context.update({
+        "batches": batches,
+        "created": sum(batch["created"] for batch in batches),
+        "updated": sum(batch["updated"] for batch in batches),
+        "errors": errors,
+        "error_count": error_count,
+        "errors_hidden": error_count - len(errors),
+    })
+    return render(request, "store/vendor/product_import.html", context)
+
+
 # Store Detail View
 # Check if user is logged in
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can add products")
 def vendor_store_detail(request, pk):
     """
     Show store details with all products in that store
@@ -462,11 +586,6 @@ def vendor_store_detail(request, pk):
     Args:
         pk: The ID of the store
     """
-    # Check if user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can add products")
-        return redirect("store:home")
-
     # Get the store by pk
     store = get_object_or_404(Store, pk=pk)
 
@@ -476,7 +595,8 @@ def vendor_store_detail(request, pk):
         return redirect("store:vendor_stores_list")
 
     # Get all products in this store
-    products = Product.objects.filter(store=store)
+    # (list() so the template can count them without a second query)
+    products = list(Product.objects.filter(store=store))
 
     # Pass both store and products to template
     context = {"store": store, "products": products}
@@ -488,7 +608,7 @@ def vendor_store_detail(request, pk):
 # Check if user is logged-in
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can add products")
 def vendor_store_edit(request, pk):
     """
     Allow vendors to edit their store
@@ -496,11 +616,6 @@ def vendor_store_edit(request, pk):
     Args:
         pk: The ID of the store to edit
     """
-    # Check if user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can add products")
-        return redirect("store:home")
-
     # Get the store by pk
     store = get_object_or_404(Store, pk=pk)
 
@@ -547,7 +662,7 @@ def vendor_store_edit(request, pk):
 # Check if the current user is logged-in
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can add products")
 def vendor_store_delete(request, pk):
     """
     Allow vendors to delete their store(only if it has no products)
@@ -555,11 +670,6 @@ def vendor_store_delete(request, pk):
     Args:
         pk: The ID of the store to delete
     """
-    # Check if user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can add products")
-        return redirect("store:home")
-
     # Get the store by pk
     store = get_object_or_404(Store, pk=pk)
 
@@ -593,18 +703,17 @@ def vendor_store_delete(request, pk):
 # Products List View
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can view products")
 def vendor_products_list(request):
     """
     Show all products from all stores owned by current vendor
     """
-    # Check if user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can view products")
-        return redirect("store:home")
-
     # Get all products where the store owner is current user
-    products = Product.objects.filter(store__owner=request.user)
+    # select_related joins the store in the same query, so showing
+    # product.store.name doesn't cost one query per product
+    products = Product.objects.filter(
+        store__owner=request.user
+    ).select_related("store")
 
     # Pass to template
     context = {"products": products}
@@ -616,7 +725,7 @@ def vendor_products_list(request):
 # make sure that the user is logged in
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can edit products")
 def vendor_product_edit(request, pk):
     """
     Allow vendors to edit their product
@@ -624,11 +733,6 @@ def vendor_product_edit(request, pk):
     Args:
         pk: The ID of the product to edit
     """
-    # Check if user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can edit products")
-        return redirect("store:home")
-
     # Get the product by pk
     product = get_object_or_404(Product, pk=pk)
 
@@ -638,57 +742,50 @@ def vendor_product_edit(request, pk):
         return redirect("store:vendor_products_list")
 
     if request.method == "POST":
-        # Get data from form
-        name = request.POST.get("name")
-        description = request.POST.get("description")
-        price = request.POST.get("price")
-        stock = request.POST.get("stock")
+        # Same rules as bulk imports (see store/product_import.py)
+        try:
+            fields = clean_product(request.POST)
+        except ProductDataError as error:
+            messages.error(request, str(error))
+            return _product_edit_page(request, product)
 
-        # Validation
-        # Check if all fields are provided
-        if not name or not description or not price or not stock:
-            messages.error(request, "All fields are required")
-            return render(
-                request, "store/vendor/product_edit.html", {"product": product}
+        if fields["sku"] and product.store.product_set.filter(
+                sku=fields["sku"]).exclude(pk=product.pk).exists():
+            messages.error(
+                request, f'This store already has a product with SKU '
+                         f'"{fields["sku"]}"'
             )
+            return _product_edit_page(request, product)
 
-        # Check if price is valid (greater than 0)
+        # Stock goes through the inventory ledger as the change the vendor
+        # made (new count - count shown on the form), so units sold while
+        # the form was open aren't put back
+        stock = fields.pop("stock")
         try:
-            price = float(price)
-            if price <= 0:
-                messages.error(request, "Price must be greater than 0")
-                return render(
-                    request,
-                    "store/vendor/product_edit.html", {"product": product}
-                )
+            stock_was = int(request.POST.get("stock_was", ""))
         except ValueError:
-            messages.error(request, "Price must be a valid number")
-            return render(
-                request, "store/vendor/product_edit.html", {"product": product}
-            )
+            stock_was = product.stock
+        change = stock - stock_was
 
-        # Check if stock is valid (not negative)
         try:
-            stock = int(stock)
-            if stock < 0:
-                messages.error(request, "Stock cannot be negative")
-                return render(
-                    request,
-                    "store/vendor/product_edit.html",
-                    {"product": product}
-                )
-        except ValueError:
-            messages.error(request, "Stock must be a valid number")
-            return render(
-                request, "store/vendor/product_edit.html", {"product": product}
-            )
-
-        # Update the product
-        product.name = name
-        product.description = description
-        product.price = price
-        product.stock = stock
-        product.save()  # Save changes to database
+            with transaction.atomic():
+                if change:
+                    inventory.move(
+                        product,
+                        (StockMovement.RESTOCK if change > 0
+                         else StockMovement.ADJUSTMENT),
+                        change,
+                        user=request.user,
+                    )
+                # Update the product
+                for name, value in fields.items():
+                    setattr(product, name, value)
+                # Only save the edited fields, so review totals changed
+                # since the product was loaded aren't overwritten
+                product.save(update_fields=list(fields))
+        except inventory.StockError as error:
+            messages.error(request, str(error))
+            return _product_edit_page(request, product)
 
         # Success message and redirect
         messages.success(request,
@@ -697,14 +794,20 @@ def vendor_product_edit(request, pk):
 
     else:
         # GET request - show form with current product data
-        return render(request,
-                      "store/vendor/product_edit.html", {"product": product})
+        return _product_edit_page(request, product)
+
+
+def _product_edit_page(request, product):
+    """The edit form, with the product's latest stock movements"""
+    movements = product.stock_movements.order_by("-id")[:10]
+    return render(request, "store/vendor/product_edit.html",
+                  {"product": product, "movements": movements})
 
 
 # Product Delete View
 
 
-@login_required(login_url="store:login")
+@vendor_required("Only vendors can edit products")
 def vendor_product_delete(request, pk):
     """
     Allow vendors to delete their product
@@ -712,11 +815,6 @@ def vendor_product_delete(request, pk):
     Args:
         pk: The ID of the product to delete
     """
-    # Check if the user is a vendor
-    if not request.user.groups.filter(name="Vendors").exists():
-        messages.error(request, "Only vendors can edit products")
-        return redirect("store:home")
-
     # Get the product by pk
     product = get_object_or_404(Product, pk=pk)
 
@@ -740,29 +838,161 @@ def vendor_product_delete(request, pk):
 # ===== BUYER SHOPPING VIEWS =====
 
 
+@browse_conditional
+@anonymous_page_cache(browse_page_version)
 def products_browse(request):
     """
     Show all products from all stores for buyers to browse
     Anyone can view (no login required)
+
+    Products are shown one page at a time. The page is picked with an
+    opaque ?cursor= value (keyset pagination) so every page costs the same
+    no matter how many products there are.
+
+    Query string:
+        store / price / stock / rating: filters (see store.facets)
+        sort: newest, price_asc, price_desc or rating
+        cursor: page cursor
     """
-    # Get all products
-    products = Product.objects.all().order_by("-created_at")
+    filters = facets.read_filters(request.GET)
+    products, ordering = facets.filter_products(
+        Product.objects.select_related("store"), filters
+    )
+
+    paginator = KeysetPaginator(
+        products,
+        ordering=ordering,
+        page_size=settings.STORE_PRODUCTS_PAGE_SIZE,
+    )
+
+    # A broken or outdated cursor just shows the first page
+    try:
+        page = paginator.page(request.GET.get("cursor"))
+    except InvalidCursor:
+        page = paginator.page()
+
+    # Check the role once here instead of once per product card
+    is_buyer = request.role == BUYER
+
+    # All the cached product cards in one cache call
+    warm_fragments(request, "card", page)
+
+    # Keep the filters and sort when moving between pages
+    params = request.GET.copy()
+    params.pop("cursor", None)
 
     # Pass to template
-    context = {"products": products}
+    context = {
+        "products": page,
+        "page": page,
+        "is_buyer": is_buyer,
+        "facet_groups": facets.facet_groups(request.GET, filters),
+        "sort_options": facets.sort_options(request.GET, filters),
+        "filter_query": params.urlencode(),
+    }
     return render(request, "store/buyer/products_browse.html", context)
 
 
+def _parse_price(value):
+    """Turn a price from the query string into a Decimal (None if invalid)"""
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        return None
+    if not price.is_finite() or price < 0:
+        return None
+    return price
+
+
+def _parse_id(value):
+    """Turn an id from the query string into an int (None if invalid)"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def product_search(request):
+    """
+    Search products by name, description and store name
+    Anyone can search (no login required)
+
+    Query string:
+        q: search words (partial words match too)
+        min_price / max_price: price range
+        in_stock: "1" to hide sold out products
+        store: only show products from this store id
+        page: page number of the results
+    """
+    query = request.GET.get("q", "").strip()
+    min_price = _parse_price(request.GET.get("min_price"))
+    max_price = _parse_price(request.GET.get("max_price"))
+    in_stock = request.GET.get("in_stock") == "1"
+
+    store_id = _parse_id(request.GET.get("store"))
+
+    # Ranked (product id, score) list from the search index
+    results = search.search_products(
+        query,
+        min_price=min_price,
+        max_price=max_price,
+        in_stock=in_stock,
+        store_id=store_id,
+    )
+
+    paginator = Paginator(results, settings.STORE_PRODUCTS_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get("page"))
+
+    # Load only the products on this page, in ranked order
+    product_ids = [product_id for product_id, score in page]
+    products_by_id = Product.objects.select_related("store").in_bulk(
+        product_ids
+    )
+    products = [products_by_id[pk] for pk in product_ids
+                if pk in products_by_id]
+
+    is_buyer = request.role == BUYER
+    warm_fragments(request, "card", products)
+
+    # Keep the filters when moving between pages
+    params = request.GET.copy()
+    params.pop("page", None)
+
+    context = {
+        "query": query,
+        "products": products,
+        "page": page,
+        "min_price": min_price,
+        "max_price": max_price,
+        "in_stock": in_stock,
+        "store_id": store_id,
+        "stores": Store.objects.order_by("name").only("name"),
+        "filter_query": params.urlencode(),
+        "is_buyer": is_buyer,
+    }
+    return render(request, "store/buyer/product_search.html", context)
+
+
+@buyer_summary.records_product_view
+@product_conditional
+@anonymous_page_cache(product_page_version)
 def product_detail(request, pk):
     """
     Show detailed information about a specific product
     Anyone can view all the products
+
+    Only the first page of reviews is shown; "Load more" fetches the next
+    ones from product_reviews.
     """
     # Get product by pk
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.select_related("store"),
+                                pk=pk)
 
-    # Get all reviews for this product
-    reviews = Review.objects.filter(product=product).order_by("-created_at")
+    # One page of reviews (newest first, or as filtered)
+    reviews, review_filters = _review_page(request, product)
 
     # Check if user has bought this product
     can_review = False
@@ -781,23 +1011,95 @@ def product_detail(request, pk):
 
         can_review = has_purchased
 
+    # For "Recently viewed" on the buyer dashboard (a 304 is recorded by
+    # records_product_view)
+    if request.role == BUYER:
+        buyer_summary.product_viewed(request.user, product.pk, product)
+
     # Pass to template
     context = {
         "product": product,
         "reviews": reviews,
+        "review_filters": review_filters,
         "can_review": can_review,
         "already_reviewed": already_reviewed,  # ← Add this!
     }
     return render(request, "store/buyer/product_detail.html", context)
 
 
+def product_reviews(request, pk):
+    """
+    Next page of a product's reviews for the "Load more" button
+
+    Returns JSON: {"html": rendered reviews, "next_cursor": cursor or null}
+    """
+    product = get_object_or_404(Product, pk=pk)
+    reviews = _review_page(request, product)[0]
+
+    html = render_to_string(
+        "store/buyer/review_list.html", {"reviews": reviews}, request=request
+    )
+    return JsonResponse({"html": html, "next_cursor": reviews.next_cursor})
+
+
+# Review list sorts -> keyset ordering
+REVIEW_SORTS = {
+    "newest": ("Newest", ("-created_at", "-id")),
+    "verified": ("Verified first", ("-verified", "-created_at", "-id")),
+}
+
+
+def _review_page(request, product):
+    """
+    One page of a product's reviews, using the sort, star filter and cursor
+    from the query string
+
+    Returns:
+        (page, filters) - a KeysetPage of reviews (buyer loaded) and
+        {"sort", "rating", "query", "sorts", "ratings"} for the template
+    """
+    sort = request.GET.get("sort")
+    if sort not in REVIEW_SORTS:
+        sort = "newest"
+    rating = request.GET.get("rating")
+    rating = int(rating) if rating in ("1", "2", "3", "4", "5") else None
+
+    # select_related: the buyer's name without one query per review
+    reviews = Review.objects.filter(product=product).select_related("buyer")
+    if rating is not None:
+        reviews = reviews.filter(rating=rating)
+
+    label, ordering = REVIEW_SORTS[sort]
+    paginator = KeysetPaginator(
+        reviews, ordering=ordering,
+        page_size=settings.STORE_REVIEWS_PAGE_SIZE,
+    )
+    try:
+        page = paginator.page(request.GET.get("cursor"))
+    except InvalidCursor:
+        page = paginator.page()
+
+    # Keep the sort and filter in the "Load more" link
+    params = request.GET.copy()
+    params.pop("cursor", None)
+
+    filters = {
+        "sort": sort,
+        "rating": rating,
+        "query": params.urlencode(),
+        "sorts": [(key, label) for key, (label, o) in REVIEW_SORTS.items()],
+        "ratings": [5, 4, 3, 2, 1],
+    }
+    return page, filters
+
+
 # ===== BUYER CART VIEWS =====
 
 
 @login_required(login_url="store:login")
 def cart_add(request, product_pk):
     """
-    Add a product to the shopping cart (stored in session)
+    Add a product to the shopping cart
     """
     # Get the product
     product = get_object_or_404(Product, pk=product_pk)
@@ -814,29 +1116,25 @@ def cart_add(request, product_pk):
         messages.error(request, f"Only {product.stock} units available")
         return redirect("store:product_detail", pk=product_pk)
 
-    # Get cart from session (or create empty dict)
-    cart = request.session.get("cart", {})
+    cart = Cart(request.user)
 
-    # Product ID as string (session keys must be strings)
-    product_id = str(product_pk)
+    # Check total quantity doesn't exceed stock
+    if cart.quantity(product.pk) + quantity > product.stock:
+        messages.error(
+            request,
+            f"Cannot add more. Only {product.stock} units available"
+        )
+        return redirect("store:product_detail", pk=product_pk)
 
-    # Add or update quantity in cart
-    if product_id in cart:
-        # Check total quantity doesn't exceed stock
-        new_quantity = cart[product_id] + quantity
-        if new_quantity > product.stock:
-            messages.error(
-                request,
-                f"Cannot add more. Only {product.stock} units available"
-            )
-            return redirect("store:product_detail", pk=product_pk)
-        cart[product_id] = new_quantity
-    else:
-        cart[product_id] = quantity
+    # Set the units aside for a while, if stock holds are on (flash sales)
+    try:
+        stock_holds.hold(request.user, product,
+                         cart.quantity(product.pk) + quantity)
+    except stock_holds.HoldError as error:
+        messages.error(request, str(error))
+        return redirect("store:product_detail", pk=product_pk)
 
-    # Save cart back to session
-    request.session["cart"] = cart
-    request.session.modified = True  # Tell Django to save the session
+    cart.add(product, quantity)
 
     # Success message
     messages.success(request, f"Added {product.name} to cart")
@@ -850,33 +1148,23 @@ def cart_view(request):
     """
     Display the shopping cart with all items
     """
-    # Get cart from session
-    cart = request.session.get("cart", {})
+    cart = Cart(request.user)
 
-    # Build list of cart items with product details
-    cart_items = []
-    total_price = 0
+    # All cart products in one query (deleted ones are dropped)
+    cart_items = cart.lines()
+    summary = cart.summary()
 
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(pk=int(product_id))
-            subtotal = product.price * quantity
-            total_price += subtotal
-
-            cart_items.append({
-                "product": product,
-                "quantity": quantity,
-                "subtotal": subtotal
-            })
-        except Product.DoesNotExist:
-            # Product was deleted, remove from cart
-            pass
+    # How long each product stays set aside (when stock holds are on)
+    holds = stock_holds.user_holds(request.user)
+    for item in cart_items:
+        item.held_until = holds.get(item.product.pk)
 
     # Pass to template
     context = {
         "cart_items": cart_items,
-        "total_price": total_price,
+        "total_price": summary["total"],
         "cart_count": len(cart_items),
+        "holds_enabled": stock_holds.enabled(),
     }
     return render(request, "store/buyer/cart.html", context)
 
@@ -890,27 +1178,31 @@ def cart_update(request, product_pk):
         # Get new quantity
         quantity = int(request.POST.get("quantity", 1))
 
-        # Get product to check stock
-        product = get_object_or_404(Product, pk=product_pk)
-
         # Validate quantity
         if quantity < 1:
             messages.error(request, "Quantity must be at least 1")
             return redirect("store:cart_view")
 
+        cart = Cart(request.user)
+        if not cart.quantity(product_pk):
+            return redirect("store:cart_view")
+
+        # Get product to check stock
+        product = get_object_or_404(Product, pk=product_pk)
+
         if quantity > product.stock:
             messages.error(request, f"Only {product.stock} units available")
             return redirect("store:cart_view")
 
-        # Update cart
-        cart = request.session.get("cart", {})
-        product_id = str(product_pk)
+        try:
+            stock_holds.hold(request.user, product, quantity)
+        except stock_holds.HoldError as error:
+            messages.error(request, str(error))
+            return redirect("store:cart_view")
 
-        if product_id in cart:
-            cart[product_id] = quantity
-            request.session["cart"] = cart
-            request.session.modified = True
-            messages.success(request, f"Updated {product.name} quantity")
+        # Update cart
+        cart.set(product, quantity)
+        messages.success(request, f"Updated {product.name} quantity")
 
     return redirect("store:cart_view")
 
@@ -920,23 +1212,9 @@ def cart_remove(request, product_pk):
     """
     Remove a product from the cart
     """
-    # Get cart
-    cart = request.session.get("cart", {})
-    product_id = str(product_pk)
-
-    # Remove product if it exists
-    if product_id in cart:
-        # Get product name for message
-        try:
-            product = Product.objects.get(pk=product_pk)
-            product_name = product.name
-        except Product.DoesNotExist:
-            product_name = "Product"
-
-        del cart[product_id]
-        request.session["cart"] = cart
-        request.session.modified = True
-        messages.success(request, f"Removed {product_name} from cart")
+    # Remove product if it exists (no need to load the product)
+    if Cart(request.user).remove(product_pk):
+        messages.success(request, "Removed item from cart")
 
     return redirect("store:cart_view")
 
@@ -946,8 +1224,7 @@ def cart_clear(request):
     """
     Clear all items from the cart
     """
-    request.session["cart"] = {}
-    request.session.modified = True
+    Cart(request.user).clear()
     messages.success(request, "Cart cleared")
     return redirect("store:cart_view")
 
@@ -955,135 +1232,30 @@ def cart_clear(request):
 # ===== BUYER CHECKOUT & ORDERS =====
 
 
-@login_required(login_url="store:login")
+@buyer_required("Only buyers can checkout")
 def checkout(request):
     """
     Process checkout: create order, order items, send email
     """
-    # Check if user is a buyer
-    if not request.user.groups.filter(name="Buyers").exists():
-        messages.error(request, "Only buyers can checkout")
-        return redirect("store:home")
-
-    # Get cart from session
-    cart = request.session.get("cart", {})
+    cart = Cart(request.user)
 
     # Check if cart is empty
     if not cart:
         messages.error(request, "Your cart is empty")
         return redirect("store:products_browse")
 
-    # Calculate total and validate stock
-    total_price = 0
-    cart_items = []
-
-    for product_id, quantity in cart.items():
-        try:
-            product = Product.objects.get(pk=int(product_id))
-
-            # Check stock availability
-            if quantity > product.stock:
-                messages.error(
-                    request,
-                    f"Not enough stock for {product.name}. \
-                    Only {product.stock} available",
-                )
-                return redirect("store:cart_view")
-
-            subtotal = product.price * quantity
-            total_price += subtotal
-            cart_items.append({
-                "product": product,
-                "quantity": quantity,
-                "subtotal": subtotal
-            })
-        except Product.DoesNotExist:
-            messages.error(request,
-                           "Some products in your cart no longer exist")
-            return redirect("store:cart_view")
-
-    # Create the order
-    order = Order.objects.create(buyer=request.user, total_price=total_price)
-
-    # Create order items and update stock
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item["product"],
-            quantity=item["quantity"],
-            price=item["product"].price,  # Save price at time of purchase
-        )
-
-        # Reduce product stock
-        product = item["product"]
-        product.stock -= item["quantity"]
-        product.save()
+    # Create the order, its items and take the stock in one transaction
+    try:
+        order, order_items = place_order(request.user, cart.quantities())
+    except CheckoutError as error:
+        messages.error(request, str(error))
+        return redirect("store:cart_view")
 
     # Clear cart
-    request.session["cart"] = {}
-    request.session.modified = True
-
-    # ===== SEND INVOICE EMAIL =====
-
-    # Build invoice email
-    subject = f"Order Confirmation - Order #{order.id}"
-
-    body = f"""
-    Dear {request.user.username},
-
-    Thank you for your order! Your order has been confirmed.
+    cart.clear()
 
-    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    ORDER DETAILS
-    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-    Order Number: #{order.id}
-    Order Date: {order.order_date.strftime('%B %d, %Y at %H:%M')}
-
-    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    ITEMS ORDERED
-    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-    """
-
-    # Add each item
-    for item in cart_items:
-        body += f"""
-    Product: {item['product'].name}
-    Store: {item['product'].store.name}
-    Quantity: {item['quantity']}
-    Price: R{item['product'].price} each
-    Subtotal: R{item['subtotal']}
-    ─────────────────────────────────────────
-    """
-
-    body += f"""
-    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    TOTAL: R{total_price}
-    ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-    Thank you for shopping with us!
-
-    If you have any questions about your order, please contact us.
-
-    Best regards,
-    The eCommerce Team
-    """
-
-    # Create and send email
-    email = EmailMessage(
-        subject,
-        body,
-        "noreply@ecommerce.com",  # From email
-        [request.user.email],  # To email
-    )
-
-    try:
-        email.send()
-        print(f" Invoice email sent to {request.user.email}")
-    except Exception as e:
-        print(f" Failed to send email: {e}")
-        # Don't fail the checkout if email fails
+    # Queue the invoice email
+    send_invoice(request.user, order, order_items)
 
     # Success message
     messages.success(
@@ -1095,24 +1267,75 @@ def checkout(request):
     return redirect("store:order_detail", pk=order.pk)
 
 
-@login_required(login_url="store:login")
+@buyer_required("Only buyers can view order history")
 def order_history(request):
     """
-    Show all orders for the current buyer
+    Show the current buyer's orders, newest first, one page at a time
+
+    Query string:
+        from, to: only orders placed on or between these dates (YYYY-MM-DD)
+        cursor: the page to show
     """
-    # Check if user is a buyer
-    if not request.user.groups.filter(name="Buyers").exists():
-        messages.error(request, "Only buyers can view order history")
-        return redirect("store:home")
+    date_from = _parse_date(request.GET.get("from"))
+    date_to = _parse_date(request.GET.get("to"))
+
+    # Items with their products in one extra query for the whole page
+    orders = Order.objects.filter(buyer=request.user).prefetch_related(
+        Prefetch(
+            "orderitem_set",
+            queryset=OrderItem.objects.select_related("product").order_by(
+                "id"
+            ),
+            to_attr="lines",
+        )
+    )
 
-    # Get all orders for this buyer
-    orders = Order.objects.filter(buyer=request.user).order_by("-order_date")
+    # Compare against midnight (not order_date__date) so the
+    # (buyer, order_date) index can be used
+    if date_from:
+        orders = orders.filter(order_date__gte=start_of_day(date_from))
+    if date_to:
+        orders = orders.filter(
+            order_date__lt=start_of_day(date_to + timedelta(days=1))
+        )
+
+    paginator = KeysetPaginator(
+        orders,
+        ordering=("-order_date", "-id"),
+        page_size=settings.STORE_ORDERS_PAGE_SIZE,
+    )
+    try:
+        page = paginator.page(request.GET.get("cursor"))
+    except InvalidCursor:
+        page = paginator.page()
+
+    # Number of items in each order (from the prefetched lines)
+    for order in page:
+        order.item_count = sum(line.quantity for line in order.lines)
+
+    # Keep the date filter when moving between pages
+    params = request.GET.copy()
+    params.pop("cursor", None)
 
     # Pass to template
-    context = {"orders": orders}
+    context = {
+        "orders": page,
+        "page": page,
+        "date_from": date_from,
+        "date_to": date_to,
+        "filter_query": params.urlencode(),
+    }
     return render(request, "store/buyer/order_history.html", context)
 
 
+def _parse_date(value):
+    """Turn a YYYY-MM-DD date from the query string into a date (or None)"""
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
 @login_required(login_url="store:login")
 def order_detail(request, pk):
     """
@@ -1121,25 +1344,32 @@ def order_detail(request, pk):
     # Get the order
     order = get_object_or_404(Order, pk=pk)
 
-    # Check if current user owns this order
-    if order.buyer != request.user:
+    # Check if current user owns this order (buyer_id: no query for the
+    # buyer row)
+    if order.buyer_id != request.user.pk:
         messages.error(request, "You can only view your own orders")
         return redirect("store:order_history")
 
-    # Get all items in this order with review status
-    order_items = OrderItem.objects.filter(order=order)
+    # All items with their product and store in one query
+    order_items = list(
+        OrderItem.objects.filter(order=order)
+        .select_related("product__store")
+        .order_by("id")
+    )
 
-    # Add review status to each item
-    items_with_review_status = []
-    for item in order_items:
-        # Check if user has reviewed this product
-        has_reviewed = Review.objects.filter(
-            buyer=request.user, product=item.product
-        ).exists()
+    # Which of these products the buyer has reviewed - one query
+    reviewed_ids = set(
+        Review.objects.filter(
+            buyer=request.user,
+            product_id__in=[item.product_id for item in order_items],
+        ).values_list("product_id", flat=True)
+    )
 
-        items_with_review_status.append(
-            {"order_item": item, "has_reviewed": has_reviewed}
-        )
+    # Add review status to each item
+    items_with_review_status = [
+        {"order_item": item, "has_reviewed": item.product_id in reviewed_ids}
+        for item in order_items
+    ]
 
     # Pass to template
     context = {"order": order,
@@ -1150,7 +1380,7 @@ def order_detail(request, pk):
 # ===== REVIEWS =====
 
 
-@login_required(login_url="store:login")
+@buyer_required("Only buyers can leave reviews")
 def review_add(request, product_pk):
     """
     Allow buyers to add a review for a product.
@@ -1158,11 +1388,6 @@ def review_add(request, product_pk):
     - Unverified review: buyer has NOT purchased the product
     Both are allowed but marked differently!
     """
-    # Check if user is a buyer
-    if not request.user.groups.filter(name="Buyers").exists():
-        messages.error(request, "Only buyers can leave reviews")
-        return redirect("store:home")
-
     # Get the product
     product = get_object_or_404(Product, pk=product_pk)
 